@@ -19,7 +19,7 @@ def perform_health_check():
     # Run health-check - to verify if backend server is running,
     health_check_response = requests.get(f"{backend_url}/health-check")
     # This health_check will respond in one of 3 ways.
-    # Either 200: Healthy, 600: Celery workers are not active,
+    # Either 200: Healthy (JSON body includes the worker heartbeat age), 503: Celery workers are not active,
     # or it will not respond with either of these if there is a problem with the server
     print(f"Status: {health_check_response.status_code}, body: {health_check_response.text}")
     # Raises error if the status is not 200
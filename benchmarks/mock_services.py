@@ -0,0 +1,266 @@
+"""
+Local stand-ins for the external HTTP services used by the pipeline, serving recorded responses, so that benchmarks
+run without network access and are not affected by the speed of the real services.
+Each service runs on its own local port. In record mode, requests are forwarded to the real service and the responses
+are saved as fixtures, to be replayed in later runs.
+"""
+import base64
+import hashlib
+import json
+import logging
+import pathlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+log = logging.getLogger(__name__)
+
+
+class MockService(NamedTuple):
+    """
+    An external HTTP service replaced by a local stand-in.
+
+    Attributes
+    ----------
+    name : str
+        The name of the service, used as the directory name of its fixtures.
+    upstream_url : str
+        The base URL of the real service, requests are recorded relative to it.
+    env_vars : Dict[str, str]
+        The environment variables that point the pipeline at the service, with the path to append to the stand-in's
+        base URL for each. GeoServer is configured by host and port instead, and has no entries.
+    """
+    name: str
+    upstream_url: str
+    env_vars: Dict[str, str]
+
+
+SERVICES = (
+    MockService("niwa_api", "https://api.niwa.co.nz", {"NIWA_API_URL": ""}),
+    MockService("rec", "https://gis.niwa.co.nz/server/rest/services/HYDRO/Flood_Statistics_Henderson_Collins_V2/"
+                       "MapServer/2", {"REC_API_URL": ""}),
+    MockService("overpass", "http://overpass-api.de/api", {"OVERPASS_API_URL": "/"}),
+    MockService("zenodo", "https://zenodo.org", {"SEA_LEVEL_RISE_RECORD_URL": "/records/11398538/export/json"}),
+    MockService("geoserver", "http://localhost:8088", {}),
+)
+
+# Query parameters holding credentials, which are left out of fixture keys
+_SECRET_PARAMS = ("apikey", "api_key", "key")
+# Response body content types that may contain absolute URLs of other services, which are rewritten when recording
+_TEXT_CONTENT_TYPES = ("json", "text", "xml", "csv")
+
+
+def strip_secrets(path: str) -> str:
+    """
+    Remove the query parameters holding credentials from a request path, so they are not saved in fixtures.
+
+    Parameters
+    ----------
+    path : str
+        The path and query string of a request.
+
+    Returns
+    -------
+    str
+        The path and query string without credentials.
+    """
+    url = urlsplit(path)
+    query = urlencode([(name, value) for name, value in parse_qsl(url.query) if name.lower() not in _SECRET_PARAMS])
+    return f"{url.path}?{query}" if query else url.path
+
+
+def get_fixture_key(method: str, path: str, body: bytes) -> str:
+    """
+    Get the key identifying a request among the recorded fixtures of a service.
+    API keys are not part of the key, so that fixtures can be replayed without them. Request bodies are only part of
+    the key when they are text, so that uploaded files do not need to match exactly.
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method of the request.
+    path : str
+        The path and query string of the request, relative to the service's base URL.
+    body : bytes
+        The body of the request.
+
+    Returns
+    -------
+    str
+        The fixture key.
+    """
+    key = hashlib.sha256(f"{method} {strip_secrets(path)}".encode())
+    try:
+        key.update(body.decode("utf-8").encode())
+    except UnicodeDecodeError:
+        pass
+    return key.hexdigest()[:24]
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Local HTTP server replaying, or recording, the responses of one external service.
+
+    Attributes
+    ----------
+    service : MockService
+        The service the server stands in for.
+    fixtures_dir : pathlib.Path
+        The directory holding the recorded responses of the service.
+    record : bool
+        Whether to forward requests to the real service and record the responses.
+    url_placeholders : Dict[str, str]
+        The base URL of each stand-in server, by the placeholder used in recorded responses for that service's URL.
+    """
+
+    def __init__(self, service: MockService, fixtures_dir: pathlib.Path, record: bool):
+        super().__init__(("127.0.0.1", 0), _MockRequestHandler)
+        self.service = service
+        self.fixtures_dir = fixtures_dir / service.name
+        self.fixtures_dir.mkdir(parents=True, exist_ok=True)
+        self.record = record
+        self.url_placeholders: Dict[str, str] = {}
+
+    @property
+    def url(self) -> str:
+        """The base URL of the stand-in."""
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    """Handles every HTTP method by replaying, or recording, the response for the request."""
+    server: MockServer
+
+    def log_message(self, format_string: str, *args) -> None:
+        log.debug(f"{self.server.service.name}: {format_string % args}")
+
+    def _handle(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        fixture_path = self.server.fixtures_dir / f"{get_fixture_key(self.command, self.path, body)}.json"
+        if self.server.record:
+            fixture = self._record(body)
+            with open(fixture_path, "w") as fixture_file:
+                json.dump(fixture, fixture_file)
+        elif fixture_path.exists():
+            with open(fixture_path) as fixture_file:
+                fixture = json.load(fixture_file)
+        else:
+            log.warning(f"No recorded {self.server.service.name} response for {self.command} {self.path}")
+            self.send_error(404, "No recorded response")
+            return
+
+        response_body = base64.b64decode(fixture["body"])
+        if any(content_type in fixture["content_type"] for content_type in _TEXT_CONTENT_TYPES):
+            text = response_body.decode("utf-8")
+            for placeholder, url in self.server.url_placeholders.items():
+                text = text.replace(placeholder, url)
+            response_body = text.encode("utf-8")
+        self.send_response(fixture["status"])
+        self.send_header("Content-Type", fixture["content_type"])
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def _record(self, body: bytes) -> Dict:
+        """Forwards the request to the real service, returning the response as a fixture."""
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in ("host", "content-length")}
+        response = requests.request(self.command, f"{self.server.service.upstream_url}{self.path}",
+                                    headers=headers, data=body or None, timeout=600)
+        content_type = response.headers.get("Content-Type", "application/octet-stream")
+        response_body = response.content
+        if any(text_type in content_type for text_type in _TEXT_CONTENT_TYPES):
+            # Replace absolute URLs of the real services, so replayed responses link to the stand-ins
+            text = response_body.decode("utf-8")
+            for service in SERVICES:
+                text = text.replace(service.upstream_url, f"{{{{{service.name}}}}}")
+            response_body = text.encode("utf-8")
+        return {
+            "method": self.command,
+            "path": strip_secrets(self.path),
+            "status": response.status_code,
+            "content_type": content_type,
+            "body": base64.b64encode(response_body).decode("ascii"),
+        }
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+
+def start_mock_services(
+        fixtures_dir: pathlib.Path,
+        record: bool = False,
+        geoserver_upstream_url: Optional[str] = None) -> List[MockServer]:
+    """
+    Start a stand-in server for each external service, in background threads.
+
+    Parameters
+    ----------
+    fixtures_dir : pathlib.Path
+        The directory holding the recorded responses, with a subdirectory for each service.
+    record : bool = False
+        Whether to forward requests to the real services and record the responses. Defaults to replaying responses.
+    geoserver_upstream_url : Optional[str] = None
+        The base URL of the real GeoServer to record from. Defaults to http://localhost:8088.
+
+    Returns
+    -------
+    List[MockServer]
+        The running servers.
+    """
+    servers = []
+    for service in SERVICES:
+        if service.name == "geoserver" and geoserver_upstream_url is not None:
+            service = service._replace(upstream_url=geoserver_upstream_url)
+        server = MockServer(service, fixtures_dir, record)
+        threading.Thread(target=server.serve_forever, daemon=True, name=f"mock-{service.name}").start()
+        servers.append(server)
+    url_placeholders = {f"{{{{{server.service.name}}}}}": server.url for server in servers}
+    for server in servers:
+        server.url_placeholders = url_placeholders
+    return servers
+
+
+def get_mock_service_env_vars(servers: List[MockServer]) -> Dict[str, str]:
+    """
+    Get the environment variables that point the pipeline at the stand-in servers.
+
+    Parameters
+    ----------
+    servers : List[MockServer]
+        The running stand-in servers.
+
+    Returns
+    -------
+    Dict[str, str]
+        The value of each environment variable.
+    """
+    env_vars = {}
+    for server in servers:
+        for env_var, path in server.service.env_vars.items():
+            env_vars[env_var] = f"{server.url}{path}"
+        if server.service.name == "geoserver":
+            env_vars["GEOSERVER_HOST"] = "http://127.0.0.1"
+            env_vars["GEOSERVER_PORT"] = str(server.server_port)
+    return env_vars
+
+
+def stop_mock_services(servers: List[MockServer]) -> None:
+    """
+    Stop the stand-in servers.
+
+    Parameters
+    ----------
+    servers : List[MockServer]
+        The running stand-in servers.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,415 @@
+"""
+Benchmarks the whole pipeline (`run_all.main`) for areas of interest of increasing size, from a suburb to a region.
+External HTTP services are replaced by local stand-ins serving recorded responses (see `mock_services`), and the
+database is a disposable PostGIS container restored from a static data snapshot (see
+`src.digitaltwin.static_data_snapshot`), so that results do not depend on the network.
+Each run is a separate process using its own copy of the restored database, so that results are not affected by data
+left by earlier runs, and the peak memory of each run is measured from the start of that run.
+Reports the wall time, database queries, HTTP requests and peak memory of each pipeline stage, and fails if any stage
+is slower than the stored baseline by more than the tolerance.
+
+Run with `python -m benchmarks.run_benchmarks --snapshot <snapshot_dir>`.
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks import mock_services
+
+log = logging.getLogger(__name__)
+
+BENCHMARKS_DIR = pathlib.Path(__file__).parent
+DEFAULT_FIXTURES_DIR = BENCHMARKS_DIR / "fixtures"
+DEFAULT_BASELINE_PATH = BENCHMARKS_DIR / "baseline.json"
+DEFAULT_POSTGIS_IMAGE = "postgis/postgis:16-3.4"
+
+# Areas of interest in EPSG:2193 (xmin, ymin, xmax, ymax), centred on the sample polygon 'selected_polygon.geojson'
+AREAS_OF_INTEREST: Dict[str, Tuple[float, float, float, float]] = {
+    "suburb": (1572200.0, 5194750.0, 1574200.0, 5196750.0),
+    "town": (1568800.0, 5192500.0, 1577600.0, 5199000.0),
+    "district": (1558200.0, 5180750.0, 1588200.0, 5210750.0),
+    "region": (1523200.0, 5145750.0, 1623200.0, 5245750.0),
+}
+
+# Stages faster than this are not checked for regressions, since their timings are mostly noise
+MIN_REGRESSION_SECONDS = 0.5
+
+
+def _find_free_port() -> int:
+    """Find a local TCP port that is not in use."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_disposable_postgis(image: str, timeout_seconds: float = 120) -> Tuple[str, Dict[str, str]]:
+    """
+    Start a PostGIS docker container that is removed when stopped, and wait until it accepts connections.
+
+    Parameters
+    ----------
+    image : str
+        The PostGIS docker image to run.
+    timeout_seconds : float = 120
+        The maximum time to wait for the database to start.
+
+    Returns
+    -------
+    Tuple[str, Dict[str, str]]
+        The container id, and the environment variables used to connect to the database.
+
+    Raises
+    ------
+    TimeoutError
+        If the database does not accept connections within the timeout.
+    """
+    import psycopg2
+
+    env_vars = {
+        "POSTGRES_HOST": "localhost",
+        "POSTGRES_PORT": str(_find_free_port()),
+        "POSTGRES_DB": "db",
+        "POSTGRES_USER": "postgres",
+        "POSTGRES_PASSWORD": "benchmark",
+    }
+    container_id = subprocess.run(
+        ["docker", "run", "--detach", "--rm", "--publish", f"{env_vars['POSTGRES_PORT']}:5432",
+         "--env", f"POSTGRES_DB={env_vars['POSTGRES_DB']}",
+         "--env", f"POSTGRES_PASSWORD={env_vars['POSTGRES_PASSWORD']}", image],
+        check=True, capture_output=True, text=True).stdout.strip()
+    # The container restarts the database once after initialising it, so wait until connections succeed repeatedly
+    deadline = time.monotonic() + timeout_seconds
+    successes = 0
+    while successes < 3:
+        if time.monotonic() > deadline:
+            subprocess.run(["docker", "stop", container_id], check=False)
+            raise TimeoutError(f"PostGIS container {container_id} did not start within {timeout_seconds}s")
+        try:
+            with psycopg2.connect(host=env_vars["POSTGRES_HOST"], port=env_vars["POSTGRES_PORT"],
+                                  dbname=env_vars["POSTGRES_DB"], user=env_vars["POSTGRES_USER"],
+                                  password=env_vars["POSTGRES_PASSWORD"]) as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT PostGIS_Version();")
+            successes += 1
+        except psycopg2.OperationalError:
+            successes = 0
+        time.sleep(1)
+    return container_id, env_vars
+
+
+def _admin_connection(database_env_vars: Dict[str, str]):
+    """Open an autocommit connection to the maintenance database of the PostGIS server, to create and drop databases."""
+    import psycopg2
+
+    connection = psycopg2.connect(host=database_env_vars["POSTGRES_HOST"], port=database_env_vars["POSTGRES_PORT"],
+                                  dbname="postgres", user=database_env_vars["POSTGRES_USER"],
+                                  password=database_env_vars["POSTGRES_PASSWORD"])
+    connection.autocommit = True
+    return connection
+
+
+def create_database_copy(database_env_vars: Dict[str, str], copy_name: str) -> None:
+    """
+    Create a copy of the benchmark database, to run the pipeline against without changing the restored data.
+
+    Parameters
+    ----------
+    database_env_vars : Dict[str, str]
+        The environment variables used to connect to the database to copy.
+    copy_name : str
+        The name of the new database.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    connection = _admin_connection(database_env_vars)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE DATABASE "{copy_name}" TEMPLATE "{database_env_vars["POSTGRES_DB"]}";')
+    finally:
+        connection.close()
+
+
+def drop_database(database_env_vars: Dict[str, str], database_name: str) -> None:
+    """
+    Drop a copy of the benchmark database once a run has finished with it.
+
+    Parameters
+    ----------
+    database_env_vars : Dict[str, str]
+        The environment variables used to connect to the database server.
+    database_name : str
+        The name of the database to drop.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    connection = _admin_connection(database_env_vars)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{database_name}" WITH (FORCE);')
+    finally:
+        connection.close()
+
+
+def run_pipeline_in_subprocess(
+        aoi_name: str,
+        skip_modules: List[str],
+        database_env_vars: Optional[Dict[str, str]],
+        run_name: str) -> List[Dict[str, Any]]:
+    """
+    Run the pipeline for an area of interest in a new process, against a new copy of the benchmark database.
+
+    Parameters
+    ----------
+    aoi_name : str
+        The name of the area of interest to run the pipeline for.
+    skip_modules : List[str]
+        The names of modules not to run, e.g. "bg_flood_model".
+    database_env_vars : Optional[Dict[str, str]]
+        The environment variables used to connect to the benchmark database, which is copied for the run,
+        or None to run against the configured database without copying it.
+    run_name : str
+        A name for the run, unique within the benchmark, used to name its copy of the database.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The measurements of each stage that ran.
+    """
+    run_env = dict(os.environ)
+    if database_env_vars is not None:
+        create_database_copy(database_env_vars, run_name)
+        run_env["POSTGRES_DB"] = run_name
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stages_path = pathlib.Path(temp_dir) / "stages.json"
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.run_benchmarks", "--run-aoi", aoi_name,
+                 "--stages-output", str(stages_path), "--skip-module", *skip_modules],
+                check=True, env=run_env, cwd=BENCHMARKS_DIR.parent)
+            return json.loads(stages_path.read_text())
+    finally:
+        if database_env_vars is not None:
+            drop_database(database_env_vars, run_name)
+
+
+def run_pipeline(aoi_bounds: Tuple[float, float, float, float], skip_modules: List[str]) -> List[Dict[str, Any]]:
+    """
+    Run every module of the pipeline for an area of interest, measuring each stage.
+
+    Parameters
+    ----------
+    aoi_bounds : Tuple[float, float, float, float]
+        The bounds of the area of interest in EPSG:2193.
+    skip_modules : List[str]
+        The names of modules not to run, e.g. "bg_flood_model".
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The measurements of each stage that ran.
+    """
+    # Imported here, so that the pipeline reads the environment variables set for the benchmark
+    import geopandas as gpd
+    import shapely
+
+    from src import pipeline_metrics, run_all
+
+    selected_polygon = gpd.GeoDataFrame(geometry=[shapely.box(*aoi_bounds)], crs=2193)
+    modules_to_parameters = {
+        module: parameters for module, parameters in run_all.DEFAULT_MODULES_TO_PARAMETERS.items()
+        if module.__name__.rsplit(".", 1)[-1] not in skip_modules
+    }
+    pipeline_metrics.install_http_instrumentation()
+    pipeline_metrics.start_collecting()
+    with pipeline_metrics.track_stage("run_all"):
+        run_all.main(selected_polygon, modules_to_parameters)
+    return pipeline_metrics.collect_stages()
+
+
+def summarise_runs(runs: List[List[Dict[str, Any]]]) -> Dict[str, Dict[str, float]]:
+    """
+    Summarise the stage measurements of repeated runs of the pipeline for an area of interest.
+    Measurements of a stage that ran several times in a run are summed, and the fastest run of each stage is kept.
+    Every run starts from the same restored database in a new process, so slower runs are mostly slowed by noise.
+
+    Parameters
+    ----------
+    runs : List[List[Dict[str, Any]]]
+        The measurements of each stage, for each run.
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        The summarised measurements of each stage, by stage name.
+    """
+    summary: Dict[str, Dict[str, float]] = {}
+    for stages in runs:
+        run_totals: Dict[str, Dict[str, float]] = {}
+        for stage_metrics in stages:
+            totals = run_totals.setdefault(stage_metrics["stage"], {
+                "wall_seconds": 0.0, "db_queries": 0, "http_requests": 0, "http_bytes": 0, "peak_rss_bytes": 0})
+            for measure in ("wall_seconds", "db_queries", "http_requests", "http_bytes"):
+                totals[measure] += stage_metrics[measure]
+            totals["peak_rss_bytes"] = max(totals["peak_rss_bytes"], stage_metrics["peak_rss_bytes"])
+        for stage, totals in run_totals.items():
+            if stage not in summary or totals["wall_seconds"] < summary[stage]["wall_seconds"]:
+                summary[stage] = totals
+    return summary
+
+
+def find_regressions(
+        results: Dict[str, Any],
+        baseline: Dict[str, Any],
+        tolerance: float) -> List[str]:
+    """
+    Find stages that are slower than the baseline by more than the tolerance.
+
+    Parameters
+    ----------
+    results : Dict[str, Any]
+        The benchmark results.
+    baseline : Dict[str, Any]
+        The stored baseline benchmark results.
+    tolerance : float
+        The allowed fractional increase in wall time, e.g. 0.2 for 20%.
+
+    Returns
+    -------
+    List[str]
+        A description of each regression.
+    """
+    regressions = []
+    for aoi_name, aoi_results in results["aois"].items():
+        baseline_stages = baseline.get("aois", {}).get(aoi_name, {})
+        for stage, measures in aoi_results.items():
+            if stage not in baseline_stages:
+                continue
+            baseline_seconds = baseline_stages[stage]["wall_seconds"]
+            seconds = measures["wall_seconds"]
+            if seconds > MIN_REGRESSION_SECONDS and seconds > baseline_seconds * (1 + tolerance):
+                regressions.append(f"{aoi_name} {stage}: {seconds:.2f}s, baseline {baseline_seconds:.2f}s")
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    """Print the measurements of each stage as a table."""
+    print(f"{'aoi':<10} {'stage':<70} {'seconds':>9} {'queries':>8} {'http':>6} {'http MB':>8} {'peak MB':>8}")
+    for aoi_name, aoi_results in results["aois"].items():
+        for stage, measures in aoi_results.items():
+            print(f"{aoi_name:<10} {stage:<70} {measures['wall_seconds']:>9.2f} {measures['db_queries']:>8} "
+                  f"{measures['http_requests']:>6} {measures['http_bytes'] / 1e6:>8.1f} "
+                  f"{measures['peak_rss_bytes'] / 1e6:>8.0f}")
+
+
+def get_git_commit() -> Optional[str]:
+    """Get the commit of the code being benchmarked, if it is in a git repository."""
+    git_result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=BENCHMARKS_DIR)
+    return git_result.stdout.strip() if git_result.returncode == 0 else None
+
+
+def main() -> int:
+    """
+    Command line interface to run the benchmarks.
+
+    Returns
+    -------
+    int
+        The exit code, 1 if any stage regressed compared to the baseline, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline against local stand-ins for external services.")
+    parser.add_argument("--snapshot", type=pathlib.Path,
+                        help="Static data snapshot to restore into the database before running.")
+    parser.add_argument("--aoi", nargs="+", choices=list(AREAS_OF_INTEREST), default=list(AREAS_OF_INTEREST),
+                        help="Areas of interest to benchmark. Defaults to all.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs for each area of interest.")
+    parser.add_argument("--skip-module", nargs="*", default=[],
+                        help="Pipeline modules not to run, e.g. bg_flood_model if BG-Flood is not installed.")
+    parser.add_argument("--fixtures", type=pathlib.Path, default=DEFAULT_FIXTURES_DIR,
+                        help="Directory of recorded responses of the external services.")
+    parser.add_argument("--record", action="store_true",
+                        help="Record responses from the real external services instead of replaying fixtures.")
+    parser.add_argument("--use-configured-database", action="store_true",
+                        help="Use the database configured in .env instead of a disposable PostGIS container.")
+    parser.add_argument("--postgis-image", default=DEFAULT_POSTGIS_IMAGE)
+    parser.add_argument("--baseline", type=pathlib.Path, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed fractional increase in a stage's time before it is a regression.")
+    parser.add_argument("--output", type=pathlib.Path, help="File to write the results to as JSON.")
+    # Used by the benchmark to run the pipeline once in a new process
+    parser.add_argument("--run-aoi", choices=list(AREAS_OF_INTEREST), help=argparse.SUPPRESS)
+    parser.add_argument("--stages-output", type=pathlib.Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.run_aoi is not None:
+        stages = run_pipeline(AREAS_OF_INTEREST[args.run_aoi], args.skip_module)
+        args.stages_output.write_text(json.dumps(stages))
+        return 0
+
+    servers = mock_services.start_mock_services(args.fixtures, record=args.record)
+    os.environ.update(mock_services.get_mock_service_env_vars(servers))
+    container_id = None
+    database_env_vars = None
+    try:
+        if not args.use_configured_database:
+            container_id, database_env_vars = start_disposable_postgis(args.postgis_image)
+            os.environ.update(database_env_vars)
+        else:
+            log.warning("Runs share the configured database, so later runs may reuse data fetched by earlier runs.")
+        if args.snapshot is not None:
+            from src.digitaltwin import setup_environment, static_data_snapshot
+            engine = setup_environment.get_database()
+            static_data_snapshot.import_snapshot(engine, args.snapshot)
+            # The restored database is copied for each run, which needs it to have no open connections
+            engine.dispose()
+
+        results = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": get_git_commit(),
+            "aois": {},
+        }
+        for aoi_name in args.aoi:
+            log.info(f"Benchmarking {aoi_name}.")
+            runs = [run_pipeline_in_subprocess(aoi_name, args.skip_module, database_env_vars, f"{aoi_name}_{run}")
+                    for run in range(args.repeat)]
+            results["aois"][aoi_name] = summarise_runs(runs)
+    finally:
+        mock_services.stop_mock_services(servers)
+        if container_id is not None:
+            subprocess.run(["docker", "stop", container_id], check=False, capture_output=True)
+
+    print_results(results)
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        log.info(f"Stored baseline {args.baseline}.")
+        return 0
+    if not args.baseline.exists():
+        log.info(f"No baseline at {args.baseline} to compare with, run with --update-baseline to store one.")
+        return 0
+    regressions = find_regressions(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for regression in regressions:
+        log.error(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
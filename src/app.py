@@ -1,21 +1,27 @@
 """
 The main web application that serves the Digital Twin to the web through a Rest API.
 """
+import gzip
+import io
 import logging
-import pathlib
+import zlib
 from functools import wraps
-from http.client import OK, ACCEPTED, BAD_REQUEST, INTERNAL_SERVER_ERROR, NOT_FOUND, SERVICE_UNAVAILABLE
-from typing import Callable
+from http.client import OK, ACCEPTED, BAD_REQUEST, CONFLICT, INTERNAL_SERVER_ERROR, NOT_FOUND, SERVICE_UNAVAILABLE
+from typing import Callable, Iterator
 
 import requests
 from celery import result, states
-from flask import Flask, Response, jsonify, make_response, send_file, request
+from flask import (
+    Flask, Response, jsonify, make_response, send_file, send_from_directory, request, stream_with_context
+)
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
-from kombu.exceptions import OperationalError
+from requests.adapters import HTTPAdapter
+import shapely.geometry
 from shapely import box
+from shapely.errors import ShapelyError
 
-from src import tasks
+from src import data_access, pipeline_metrics, tasks, worker_heartbeat
 from src.config import get_env_variable
 
 # Initialise flask server object
@@ -24,11 +30,25 @@ CORS(app)
 
 WWW_HOST = get_env_variable('WWW_HOST', default="http://localhost")
 WWW_PORT = get_env_variable('WWW_port', default="8080")
+# The most geometries that can be sent to the depth query endpoint in a single request
+MAX_DEPTH_QUERY_GEOMETRIES = 1000
+# Size of the chunks streamed from GeoServer to clients
+STREAM_CHUNK_SIZE = 64 * 1024
+# The most zoomed in vector tile level served
+MAX_TILE_ZOOM = 22
+
+# Session shared by all requests to GeoServer, so that connections are pooled and reused
+geoserver_session = requests.Session()
+geoserver_adapter = HTTPAdapter(
+    pool_maxsize=get_env_variable("GEOSERVER_CONNECTION_POOL_SIZE", default=10, cast_to=int))
+geoserver_session.mount("http://", geoserver_adapter)
+geoserver_session.mount("https://", geoserver_adapter)
 
 
 def check_celery_alive(f: Callable[..., Response]) -> Callable[..., Response]:
     """
     Function decorator to check if the Celery workers are running and return INTERNAL_SERVER_ERROR if they are down.
+    Uses the heartbeats recorded by the workers, rather than pinging every worker on every request.
 
     Parameters
     ----------
@@ -43,12 +63,7 @@ def check_celery_alive(f: Callable[..., Response]) -> Callable[..., Response]:
 
     @wraps(f)
     def decorated_function(*args, **kwargs) -> Response:
-        try:
-            ping_celery_response = tasks.app.control.ping()
-            if len(ping_celery_response) == 0:
-                logging.warning("Celery workers not active, may indicate a fault")
-                return make_response("Celery workers not active", SERVICE_UNAVAILABLE)
-        except OperationalError:
+        if worker_heartbeat.get_latest_heartbeat_age() is None:
             logging.warning("Celery workers not active, may indicate a fault")
             return make_response("Celery workers not active", SERVICE_UNAVAILABLE)
         return f(*args, **kwargs)
@@ -95,9 +110,13 @@ def health_check() -> Response:
     Returns
     -------
     Response
-        The HTTP Response. Expect OK if health check is successful
+        The HTTP Response. Expect OK if health check is successful.
+        JSON body contains the status, and the number of seconds since a Celery worker last sent a heartbeat.
     """
-    return Response("Healthy", OK)
+    return make_response(jsonify({
+        "status": "Healthy",
+        "workerHeartbeatAgeSeconds": worker_heartbeat.get_latest_heartbeat_age()
+    }), OK)
 
 
 @app.route('/tasks/<task_id>', methods=["GET"])
@@ -135,6 +154,44 @@ def get_status(task_id: str) -> Response:
     }), http_status)
 
 
+@app.route('/tasks/<task_id>/metrics', methods=["GET"])
+def get_task_metrics(task_id: str) -> Response:
+    """
+    Retrieves the stage timings and resource use measured for a task and every other finished task in its workflow.
+    Supported methods: GET
+
+    Parameters
+    ----------
+    task_id : str
+        The id of any Celery task in the workflow
+
+    Returns
+    -------
+    Response
+        JSON response containing the measurements of each finished task, or NOT_FOUND if the task has no measurements
+    """
+    workflow_metrics = pipeline_metrics.get_workflow_metrics(task_id)
+    if workflow_metrics is None:
+        return make_response(f"Could not find metrics for task {task_id}", NOT_FOUND)
+    return make_response(jsonify({"taskId": task_id, "tasks": workflow_metrics}), OK)
+
+
+@app.route('/metrics', methods=["GET"])
+def get_prometheus_metrics() -> Response:
+    """
+    Exports running totals of the pipeline stage measurements of all tasks, for scraping by Prometheus.
+    Supported methods: GET
+
+    Returns
+    -------
+    Response
+        The metrics in the Prometheus text exposition format
+    """
+    response = make_response(pipeline_metrics.render_prometheus_metrics(), OK)
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
 @app.route('/tasks/<task_id>', methods=["DELETE"])
 def remove_task(task_id: str) -> Response:
     """
@@ -199,7 +256,6 @@ def generate_model() -> Response:
 
 
 @app.route('/models/flood/parameters/', methods=["GET"])
-@check_celery_alive
 def get_valid_flood_model_parameters() -> Response:
     """
     Get information on valid flood model parameters based on the valid values in the database.
@@ -210,7 +266,7 @@ def get_valid_flood_model_parameters() -> Response:
         JSON response describing the valid flood model parameters.
 
     """
-    valid_parameters = tasks.get_valid_parameters_based_on_confidence_level.delay().get()
+    valid_parameters = data_access.get_valid_parameters_based_on_confidence_level()
     return make_response(jsonify(valid_parameters), OK)
 
 
@@ -242,7 +298,6 @@ def create_wkt_from_coords(lat1: float, lng1: float, lat2: float, lng2: float) -
 
 
 @app.route('/tasks/<task_id>/model/depth', methods=["GET"])
-@check_celery_alive
 def get_depth_at_point(task_id: str) -> Response:
     """
     Finds the depths and times at a particular point for a given completed model output task.
@@ -280,8 +335,10 @@ def get_depth_at_point(task_id: str) -> Response:
         return response
 
     model_id = model_task_result.get()
-    depth_task = tasks.get_depth_by_time_at_point.delay(model_id, lat, lng)
-    depths, times = depth_task.get()
+    try:
+        depths, times = data_access.get_depth_by_time_at_point(model_id, lat, lng)
+    except FileNotFoundError:
+        return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
 
     return make_response(jsonify({
         'depth': depths,
@@ -289,8 +346,67 @@ def get_depth_at_point(task_id: str) -> Response:
     }), OK)
 
 
+@app.route('/models/<int:model_id>/depths', methods=["POST"])
+def get_depths_in_geometries(model_id: int) -> Response:
+    """
+    Finds the flood depths over time for many points, lines, and polygons of a flood model output in one request.
+    Points return the depths and times of the nearest pixel, lines and polygons return statistics of the depths of the
+    pixels they cover.
+    Supported methods: POST
+    Required JSON body: {"geometries": Array<GeoJSON geometry>} in WGS84 (lng, lat) coordinates.
+
+    Parameters
+    ----------
+    model_id: int
+        The ID of the flood output model to be queried
+
+    Returns
+    -------
+    Response
+        Returns JSON response in the form {"results": Array<object>}, with one result for each geometry, in order.
+    """
+    geometries_json = (request.get_json(silent=True) or {}).get("geometries")
+    if not isinstance(geometries_json, list) or len(geometries_json) == 0:
+        return make_response("JSON body parameter geometries: Array<GeoJSON geometry> mandatory", BAD_REQUEST)
+    if len(geometries_json) > MAX_DEPTH_QUERY_GEOMETRIES:
+        return make_response(f"At most {MAX_DEPTH_QUERY_GEOMETRIES} geometries can be queried at once", BAD_REQUEST)
+    try:
+        geometries = [shapely.geometry.shape(geometry_json) for geometry_json in geometries_json]
+    except (AttributeError, KeyError, TypeError, ValueError, ShapelyError):
+        return make_response("Each of geometries must be a valid GeoJSON geometry", BAD_REQUEST)
+    supported_geometry_types = {"Point", "LineString", "MultiLineString", "Polygon", "MultiPolygon"}
+    if any(geometry.geom_type not in supported_geometry_types for geometry in geometries):
+        return make_response(f"Each of geometries must be one of {sorted(supported_geometry_types)}", BAD_REQUEST)
+    if any(not valid_coordinates(geometry.bounds[1], geometry.bounds[0])
+           or not valid_coordinates(geometry.bounds[3], geometry.bounds[2]) for geometry in geometries):
+        return make_response("lat & lng must fall in the range -90 < lat <= 90, -180 < lng <= 180", BAD_REQUEST)
+
+    try:
+        # Query all points at once, since they can be read from the model output together
+        point_indexes = [i for i, geometry in enumerate(geometries) if geometry.geom_type == "Point"]
+        point_depths = data_access.get_depths_by_time_at_points(
+            model_id, [(geometries[i].y, geometries[i].x) for i in point_indexes])
+        results = [None] * len(geometries)
+        for i, (depths, times) in zip(point_indexes, point_depths):
+            results[i] = {"type": "Point", "depth": depths, "time": times}
+        for i, geometry in enumerate(geometries):
+            if geometry.geom_type != "Point":
+                times, max_depths, mean_depths, flooded_fractions = data_access.get_depth_statistics_in_geometry(
+                    model_id, geometry)
+                results[i] = {
+                    "type": geometry.geom_type,
+                    "time": times,
+                    "maxDepth": max_depths,
+                    "meanDepth": mean_depths,
+                    "floodedFraction": flooded_fractions,
+                }
+    except FileNotFoundError:
+        return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
+
+    return make_response(jsonify({"results": results}), OK)
+
+
 @app.route('/models/<int:model_id>/buildings', methods=["GET"])
-@check_celery_alive
 def retrieve_building_flood_status(model_id: int) -> Response:
     """
     Retrieves information on building flood status, for a given flood model output id.
@@ -304,15 +420,25 @@ def retrieve_building_flood_status(model_id: int) -> Response:
     Returns
     -------
     Response
-        Returns GeoJSON building layer for the area of the flood model output.
-        Has a property "is_flooded" to designate if a building is flooded in that scenario or not
+        Returns GeoJSON building layer for the area of the flood model output, streamed from GeoServer.
+        Has a property "is_flooded" to designate if a building is flooded in that scenario or not.
+        Optional query param values: "crs": int, "startIndex": int, "count": int to page through the buildings.
     """
     # Set output crs argument from request args
     crs = request.args.get("crs", type=int, default=4326)
+    # Optional pagination of the buildings
+    try:
+        start_index = request.args.get("startIndex", type=int, default=0)
+        count = request.args.get("count", type=int)
+    except ValueError:
+        return make_response("Query parameters startIndex & count must be valid integers", BAD_REQUEST)
+    if start_index < 0 or (count is not None and count <= 0):
+        return make_response("Query parameter startIndex must not be negative, and count must be positive",
+                             BAD_REQUEST)
 
     try:
         # Get bounding box of model output to filter vector data to that area
-        bbox = tasks.get_model_extents_bbox.delay(model_id).get()
+        bbox = data_access.get_model_extents_bbox(model_id)
     except FileNotFoundError:
         return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
 
@@ -332,23 +458,142 @@ def retrieve_building_flood_status(model_id: int) -> Response:
         "outputFormat": "application/json",
         "srsName": f"EPSG:{crs}",  # Set output CRS
         "viewParams": f"scenario:{model_id}",  # Choose scenario for flooded_buildings
-        "cql_filter": f"bbox(geometry,{bbox},'EPSG:2193')"  # Filter output to be only geometries inside the model bbox
+        "cql_filter": f"bbox(geometry,{bbox},'EPSG:2193')",  # Filter output to be only geometries inside the model bbox
+        "startIndex": start_index,
+        "sortBy": "building_outline_id",  # Sort so that pages are consistent between requests
     }
-    # Request building statuses from geoserver
-    geoserver_response = requests.get(request_url, params)
-    # Serve those building statuses
-    return Response(
-        geoserver_response.text,
+    if count is not None:
+        params["maxFeatures"] = count
+    # Request building statuses from geoserver, streaming the response rather than loading it all into memory
+    geoserver_response = geoserver_session.get(request_url, params=params, stream=True)
+    # Compress the response if the client supports it
+    use_gzip = "gzip" in request.accept_encodings
+    response = Response(
+        stream_with_context(stream_response_content(geoserver_response, use_gzip)),
         status=geoserver_response.status_code,
         content_type=geoserver_response.headers['content-type']
     )
+    response.vary.add("Accept-Encoding")
+    if use_gzip:
+        response.content_encoding = "gzip"
+    return response
+
+
+def stream_response_content(upstream_response: requests.Response, use_gzip: bool) -> Iterator[bytes]:
+    """
+    Streams the content of a response from another server in chunks, optionally compressing it with gzip.
+    Closes the upstream response once streamed.
+
+    Parameters
+    ----------
+    upstream_response : requests.Response
+        The response to stream, requested with stream=True.
+    use_gzip : bool
+        If True, compress the content with gzip.
+
+    Returns
+    -------
+    Iterator[bytes]
+        The chunks of content to send.
+    """
+    try:
+        # wbits with 16 added writes a gzip header and trailer
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if use_gzip else None
+        for chunk in upstream_response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            if compressor is None:
+                yield chunk
+            else:
+                compressed_chunk = compressor.compress(chunk)
+                if compressed_chunk:
+                    yield compressed_chunk
+        if compressor is not None:
+            yield compressor.flush()
+    finally:
+        upstream_response.close()
+
+
+@app.route('/models/<int:model_id>/buildings/<int:z>/<int:x>/<int:y>.mvt', methods=["GET"])
+def serve_building_flood_status_tile(model_id: int, z: int, x: int, y: int) -> Response:
+    """
+    Serves a Mapbox Vector Tile of the buildings and their flood statuses for a given flood model output id,
+    generated by the database from the precomputed building layer for the model.
+
+    Parameters
+    ----------
+    model_id: int
+        The ID of the flood output model to be queried
+    z: int
+        The zoom level of the tile
+    x: int
+        The column of the tile
+    y: int
+        The row of the tile
+
+    Returns
+    -------
+    Response
+        Returns the vector tile, with a "buildings" layer.
+    """
+    if not 0 <= z <= MAX_TILE_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return make_response(f"Tile {z}/{x}/{y} does not exist, z must be at most {MAX_TILE_ZOOM}", BAD_REQUEST)
+    try:
+        tile = data_access.get_model_buildings_tile(model_id, z, x, y)
+    except FileNotFoundError:
+        return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
+    response = make_response(tile, OK)
+    response.mimetype = "application/vnd.mapbox-vector-tile"
+    response.vary.add("Accept-Encoding")
+    if "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(tile))
+        response.content_encoding = "gzip"
+    return response
+
+
+@app.route('/models/<int:model_id>/buildings/geoparquet', methods=["GET"])
+def serve_building_flood_status_geoparquet(model_id: int) -> Response:
+    """
+    Serves the building outlines and flood statuses for a given flood model output id as a GeoParquet file, read
+    directly from the precomputed building layer for the model.
+    Optional query param values: "bbox": "min_lng,min_lat,max_lng,max_lat" to filter buildings, "crs": int
+
+    Parameters
+    ----------
+    model_id: int
+        The ID of the flood output model to be queried
+
+    Returns
+    -------
+    Response
+        Returns a GeoParquet file of the buildings in the area of the flood model output, with their flood statuses.
+    """
+    crs = request.args.get("crs", type=int, default=4326)
+    bbox = None
+    if "bbox" in request.args:
+        try:
+            bbox = tuple(float(coord) for coord in request.args["bbox"].split(","))
+        except ValueError:
+            return make_response("Query parameter bbox must be four comma separated floats", BAD_REQUEST)
+        if len(bbox) != 4:
+            return make_response("Query parameter bbox must be four comma separated floats", BAD_REQUEST)
+        min_lng, min_lat, max_lng, max_lat = bbox
+        if not valid_coordinates(min_lat, min_lng) or not valid_coordinates(max_lat, max_lng):
+            return make_response("lat & lng must fall in the range -90 < lat <= 90, -180 < lng <= 180", BAD_REQUEST)
+    try:
+        buildings = data_access.get_model_buildings(model_id, bbox, crs)
+    except FileNotFoundError:
+        return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
+    parquet_buffer = io.BytesIO()
+    buildings.to_parquet(parquet_buffer, index=False)
+    parquet_buffer.seek(0)
+    return send_file(parquet_buffer, mimetype="application/vnd.apache.parquet",
+                     download_name=f"buildings_{model_id}.parquet")
 
 
 @app.route('/models/<int:model_id>', methods=['GET'])
-@check_celery_alive
 def serve_model_output(model_id: int) -> Response:
     """
     Serve the specified model output as a raw file.
+    Supports HTTP range requests, so clients can download part of the file.
 
     Parameters
     ----------
@@ -361,12 +606,66 @@ def serve_model_output(model_id: int) -> Response:
         HTTP Response containing the model output file.
     """
     try:
-        model_filepath = tasks.get_model_output_filepath_from_model_id.delay(model_id).get()
-        return send_file(pathlib.Path(model_filepath))
+        model_filepath = data_access.get_model_output_filepath_from_model_id(model_id)
+        return send_file(model_filepath, mimetype="application/x-netcdf", conditional=True)
     except FileNotFoundError:
         return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
 
 
+@app.route('/models/<int:model_id>/cog/<variable>', methods=['GET'])
+def serve_model_output_cog(model_id: int, variable: str) -> Response:
+    """
+    Serve a variable of the specified model output as a Cloud Optimised GeoTiff.
+    Supports HTTP range requests, so clients can read individual tiles and overviews.
+
+    Parameters
+    ----------
+    model_id: int
+        The ID of the model output to be served.
+    variable: str
+        The name of the model output variable to be served, e.g. "hmax_P0".
+
+    Returns
+    -------
+    Response
+        HTTP Response containing the COG file.
+    """
+    try:
+        cog_filepath = data_access.get_model_output_cog_filepath(model_id, variable)
+        return send_file(cog_filepath, mimetype="image/tiff", conditional=True)
+    except FileNotFoundError:
+        response = make_response(f"Could not find {variable} for flood model output {model_id}", NOT_FOUND)
+        # Explicitly set content-type because variable may make browsers visiting this endpoint vulnerable to XSS
+        response.mimetype = "text/plain"
+        return response
+
+
+@app.route('/models/<int:model_id>/zarr/<path:key>', methods=['GET'])
+def serve_model_output_zarr(model_id: int, key: str) -> Response:
+    """
+    Serve a file from the Zarr store of the specified model output, so that clients can open the store over HTTP
+    and read only the chunks they need.
+
+    Parameters
+    ----------
+    model_id: int
+        The ID of the model output to be served.
+    key: str
+        The path of the file within the Zarr store, e.g. ".zmetadata" or "hmax_P0/0.0.0".
+
+    Returns
+    -------
+    Response
+        HTTP Response containing the Zarr store file.
+    """
+    try:
+        zarr_path = data_access.get_model_output_zarr_path(model_id)
+    except FileNotFoundError:
+        return make_response(f"Could not find flood model output {model_id}", NOT_FOUND)
+    # send_from_directory prevents keys from reaching outside the store, and responds NOT_FOUND for missing keys
+    return send_from_directory(zarr_path, key, mimetype="application/octet-stream", conditional=True)
+
+
 @app.route('/datasets/update', methods=["POST"])
 @check_celery_alive
 def refresh_lidar_data_sources():
@@ -391,6 +690,32 @@ def refresh_lidar_data_sources():
     )
 
 
+@app.route('/rainfall/hirds/ingest', methods=["POST"])
+@check_celery_alive
+def ingest_all_hirds_rainfall_data():
+    """
+    Stores the rainfall data of every HIRDS rainfall site in New Zealand in the database, so that requests for new
+    catchment areas do not have to wait for HIRDS. Takes a long time to run, and resumes where it stopped if it was
+    interrupted. Only one ingest runs at a time.
+    Supported methods: POST
+
+    Returns
+    -------
+    Response
+        ACCEPTED is the expected response. Response body contains Celery taskId.
+        CONFLICT if an ingest is already running.
+    """
+    if data_access.is_hirds_ingest_running():
+        return make_response("An ingest of the HIRDS rainfall data is already running", CONFLICT)
+    # Start task to ingest the rainfall data of all sites
+    task = tasks.ingest_all_hirds_rainfall_data.delay()
+    # Return HTTP Response with task id so it can be monitored with get_status(taskId)
+    return make_response(
+        jsonify({"taskId": task.id}),
+        ACCEPTED
+    )
+
+
 def valid_coordinates(latitude: float, longitude: float) -> bool:
     """
     Validates coordinates are in the valid range of WGS84
@@ -0,0 +1,729 @@
+"""
+Read-only data access shared by the web application and the Celery workers.
+These queries are quick, so the web application calls them directly instead of waiting on a Celery task, which would
+hold a web server worker until a Celery worker is free to respond.
+"""
+import contextlib
+import functools
+import pathlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import shapely
+import xarray
+from pyproj import Transformer
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import transform
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import text
+
+from src import config
+from src.digitaltwin import setup_environment, tables
+from src.dynamic_boundary_conditions.rainfall import bootstrap_hirds_rainfall_data
+from src.dynamic_boundary_conditions.tide import main_tide_slr
+from src.flood_model import bg_flood_model, cloud_optimised_output, flooded_buildings
+
+
+class DepthTimePlot(NamedTuple):
+    """
+    Represents the depths over time for a particular pixel location in a raster.
+    Uses tuples and lists instead of Arrays or Dataframes because it needs to be easily serializable when communicating
+    over message_broker
+
+    Attributes
+    ----------
+    depths : List[float]
+        A list of all of the depths in m for the pixel. Parallels the times list
+    times : List[float]
+        A list of all of the times in s for the pixel. Parallels the depts list
+    """
+    depths: List[float]
+    times: List[float]
+
+
+class DepthStatistics(NamedTuple):
+    """
+    Represents statistics of the flood depths over time within an area or along a line of a flood model output.
+
+    Attributes
+    ----------
+    times : List[float]
+        A list of all of the times in s of the model output.
+    max_depths : List[Optional[float]]
+        The maximum depth in m of the pixels within the geometry at each time. Parallels the times list.
+    mean_depths : List[Optional[float]]
+        The mean depth in m of the pixels within the geometry at each time. Parallels the times list.
+    flooded_fractions : List[Optional[float]]
+        The fraction of the pixels within the geometry flooded to at least FLOOD_DEPTH_THRESHOLD at each time.
+        Parallels the times list.
+
+    All statistics are None when the geometry does not overlap any pixels of the flood model output.
+    """
+    times: List[float]
+    max_depths: List[Optional[float]]
+    mean_depths: List[Optional[float]]
+    flooded_fractions: List[Optional[float]]
+
+
+# The minimum depth in m for a pixel to be considered flooded, matching the threshold used for buildings
+FLOOD_DEPTH_THRESHOLD = 0.1
+
+# The bounds (xmin, ymin, xmax, ymax) in Web Mercator (EPSG:3857) of the area of use of NZTM (EPSG:2193),
+# outside which tiles cannot be transformed to the CRS of the stored buildings
+NZ_EXTENT_3857 = (18520223.68, -5996105.80, 19885000.64, -4042237.50)
+# Half the width in m of the Web Mercator world, which is split into 2^z by 2^z tiles at zoom level z
+WEB_MERCATOR_HALF_WIDTH = 20037508.342789244
+
+
+class _OpenModelOutput:
+    """
+    A flood model output dataset kept open for depth queries, with the number of queries currently reading it.
+
+    Attributes
+    ----------
+    dataset : xarray.Dataset
+        The open flood model output dataset.
+    users : int
+        The number of queries currently reading the dataset.
+    evicted : bool
+        Whether the dataset has been removed from the open datasets, and should be closed when it has no more users.
+    """
+
+    def __init__(self, dataset: xarray.Dataset):
+        self.dataset = dataset
+        self.users = 0
+        self.evicted = False
+
+
+# Flood model outputs kept open for depth queries, in order of least to most recently used
+_open_model_outputs: "OrderedDict[int, _OpenModelOutput]" = OrderedDict()
+_open_model_outputs_lock = threading.Lock()
+
+
+def get_model_output_filepath_from_model_id(model_id: int) -> pathlib.Path:
+    """
+    Query the database to find the filepath for the model output for the model_id.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+
+    Returns
+    -------
+    pathlib.Path
+        The filepath of the model output.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database.
+    """
+    engine = setup_environment.get_connection_from_profile()
+    return bg_flood_model.model_output_from_db_by_id(engine, model_id)
+
+
+def get_model_output_cog_filepath(model_id: int, variable: str) -> pathlib.Path:
+    """
+    Find the filepath of the Cloud Optimised GeoTiff of a variable of the model output for the model_id.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+    variable : str
+        The name of the model output variable, e.g. "hmax_P0".
+
+    Returns
+    -------
+    pathlib.Path
+        The filepath of the COG.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database, or has no COG for the variable.
+    """
+    cog_path = cloud_optimised_output.get_model_output_cog_path(
+        get_model_output_filepath_from_model_id(model_id), variable)
+    if not cog_path.is_file():
+        raise FileNotFoundError(f"Flood model output {model_id} has no COG for variable {variable}")
+    return cog_path
+
+
+def get_model_output_zarr_path(model_id: int) -> pathlib.Path:
+    """
+    Find the path of the Zarr store of the model output for the model_id.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the Zarr store directory.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database, or has no Zarr store.
+    """
+    zarr_path = cloud_optimised_output.get_model_output_zarr_path(get_model_output_filepath_from_model_id(model_id))
+    if not zarr_path.is_dir():
+        raise FileNotFoundError(f"Flood model output {model_id} has no Zarr store")
+    return zarr_path
+
+
+@functools.lru_cache(maxsize=None)
+def _get_wgs84_to_nztm_transformer() -> Transformer:
+    """
+    Get the transformer from WGS84 (EPSG:4326) to NZTM (EPSG:2193) coordinates, taking (lng, lat) and returning (x, y).
+    Creating a Transformer is slow, so it is only created once per process.
+
+    Returns
+    -------
+    Transformer
+        The transformer from WGS84 to NZTM.
+    """
+    return Transformer.from_crs(4326, 2193, always_xy=True)
+
+
+@contextlib.contextmanager
+def _open_model_output(model_id: int) -> Iterator[xarray.Dataset]:
+    """
+    Get the flood model output dataset for model_id, opening it only if it is not already open.
+    Keeps the DEPTH_QUERY_OPEN_DATASETS most recently used datasets open, and closes the rest.
+    A dataset evicted while queries are still reading it is only closed once the last of those queries finishes.
+    Datasets are opened lazily, so queries only read the parts of the file they need.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to open.
+
+    Yields
+    ------
+    xarray.Dataset
+        The flood model output dataset, which stays open until the context exits.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database.
+    """
+    with _open_model_outputs_lock:
+        open_output = _open_model_outputs.get(model_id)
+        if open_output is not None:
+            _open_model_outputs.move_to_end(model_id)
+            open_output.users += 1
+    if open_output is None:
+        model_file_path = get_model_output_filepath_from_model_id(model_id)
+        ds = xarray.open_dataset(model_file_path)
+        max_open_datasets = config.get_env_variable("DEPTH_QUERY_OPEN_DATASETS", default=8, cast_to=int)
+        evicted_datasets = []
+        with _open_model_outputs_lock:
+            open_output = _open_model_outputs.get(model_id)
+            if open_output is None:
+                open_output = _OpenModelOutput(ds)
+                _open_model_outputs[model_id] = open_output
+            else:
+                # Another thread opened the same dataset while this one was opening it
+                evicted_datasets.append(ds)
+            _open_model_outputs.move_to_end(model_id)
+            open_output.users += 1
+            while len(_open_model_outputs) > max_open_datasets:
+                _, least_recent_output = _open_model_outputs.popitem(last=False)
+                least_recent_output.evicted = True
+                if least_recent_output.users == 0:
+                    evicted_datasets.append(least_recent_output.dataset)
+        # Close datasets outside the lock, since closing a file can be slow
+        for evicted_ds in evicted_datasets:
+            evicted_ds.close()
+
+    try:
+        yield open_output.dataset
+    finally:
+        with _open_model_outputs_lock:
+            open_output.users -= 1
+            close_dataset = open_output.evicted and open_output.users == 0
+        if close_dataset:
+            open_output.dataset.close()
+
+
+def _nearest_indexes(coords: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Find the index of the nearest coordinate in coords for each of the values.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        1-dimensional array of the coordinates of a raster axis.
+    values : np.ndarray
+        1-dimensional array of the values to find the nearest coordinates for.
+
+    Returns
+    -------
+    np.ndarray
+        The index in coords of the nearest coordinate to each value.
+    """
+    if len(coords) == 1:
+        return np.zeros(len(values), dtype=int)
+    # Search a sorted copy, so that coordinates in either ascending or descending order are supported
+    sort_order = np.argsort(coords)
+    sorted_coords = coords[sort_order]
+    upper_indexes = np.searchsorted(sorted_coords, values).clip(1, len(coords) - 1)
+    lower_indexes = upper_indexes - 1
+    is_lower_nearer = (values - sorted_coords[lower_indexes]) <= (sorted_coords[upper_indexes] - values)
+    return sort_order[np.where(is_lower_nearer, lower_indexes, upper_indexes)]
+
+
+def _get_pixel_size(xx: np.ndarray, yy: np.ndarray) -> Optional[float]:
+    """
+    Find the size of the pixels of a raster from the spacing of its pixel centre coordinates.
+    Pixels are square, so an axis only one pixel long uses the spacing of the other axis.
+
+    Parameters
+    ----------
+    xx : np.ndarray
+        1-dimensional array of the pixel centre coordinates of the x axis of the raster.
+    yy : np.ndarray
+        1-dimensional array of the pixel centre coordinates of the y axis of the raster.
+
+    Returns
+    -------
+    Optional[float]
+        The size of the pixels, or None if the raster is a single pixel, so the size cannot be found.
+    """
+    spacings = [abs(float(coords[1] - coords[0])) for coords in (xx, yy) if len(coords) > 1]
+    return min(spacings) if spacings else None
+
+
+def _within_grid(coords: np.ndarray, values: np.ndarray, pixel_size: Optional[float]) -> np.ndarray:
+    """
+    Find which of the values fall within the pixels of a raster axis, including the half pixel beyond each edge centre.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        1-dimensional array of the pixel centre coordinates of a raster axis.
+    values : np.ndarray
+        1-dimensional array of the values to check.
+    pixel_size : Optional[float]
+        The size of the pixels of the raster, or None if it is unknown, in which case only the pixel centres are
+        within the raster axis.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array, True for each value that falls within the raster axis. Parallels values.
+    """
+    half_pixel = pixel_size / 2 if pixel_size is not None else 0
+    return (values >= coords.min() - half_pixel) & (values <= coords.max() + half_pixel)
+
+
+def _depths_at_cells(ds: xarray.Dataset, x_indexes: np.ndarray, y_indexes: np.ndarray) -> np.ndarray:
+    """
+    Read the depths over time for a set of pixels, in one read of the model output.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The flood model output dataset.
+    x_indexes : np.ndarray
+        The x index of each pixel.
+    y_indexes : np.ndarray
+        The y index of each pixel. Parallels x_indexes.
+
+    Returns
+    -------
+    np.ndarray
+        Array of depths with dimensions (time, pixel).
+    """
+    return ds["hmax_P0"].isel(
+        xx_P0=xarray.DataArray(x_indexes, dims="cell"),
+        yy_P0=xarray.DataArray(y_indexes, dims="cell"),
+    ).transpose("time", "cell").values
+
+
+def _summarise_depths(times: List[float], depths: np.ndarray) -> DepthStatistics:
+    """
+    Calculate statistics of depths over time for a set of pixels.
+
+    Parameters
+    ----------
+    times : List[float]
+        A list of all of the times in s of the model output.
+    depths : np.ndarray
+        Array of depths with dimensions (time, pixel).
+
+    Returns
+    -------
+    DepthStatistics
+        The maximum depth, mean depth, and flooded fraction of the pixels at each time.
+        Depths are None for times where all pixels have no data, and all statistics are None if there are no pixels.
+    """
+    if depths.shape[1] == 0:
+        # The geometry does not overlap the model output, so there is nothing to summarise
+        no_statistics = [None] * len(times)
+        return DepthStatistics(times=times, max_depths=no_statistics, mean_depths=no_statistics,
+                               flooded_fractions=no_statistics)
+    has_data = ~np.isnan(depths)
+    pixels_with_data = has_data.sum(axis=1)
+    # Fill missing data so that statistics can be calculated without warnings, then remove them from the results
+    max_depths = np.where(has_data, depths, -np.inf).max(axis=1)
+    mean_depths = np.where(has_data, depths, 0).sum(axis=1) / np.maximum(pixels_with_data, 1)
+    flooded_fractions = (np.where(has_data, depths, 0) >= FLOOD_DEPTH_THRESHOLD).mean(axis=1)
+    return DepthStatistics(
+        times=times,
+        max_depths=[float(depth) if count else None for depth, count in zip(max_depths, pixels_with_data)],
+        mean_depths=[float(depth) if count else None for depth, count in zip(mean_depths, pixels_with_data)],
+        flooded_fractions=flooded_fractions.tolist(),
+    )
+
+
+def get_depths_by_time_at_points(model_id: int, points: Sequence[Tuple[float, float]]) -> List[DepthTimePlot]:
+    """
+    Query many points in a flood model output at once and return the list of depths and times for each.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+    points : Sequence[Tuple[float, float]]
+        The (lat, lng) of each point to query.
+
+    Returns
+    -------
+    List[DepthTimePlot]
+        Tuple of depths list and times list for the pixel in the output nearest to each point. Parallels points.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database.
+    """
+    if len(points) == 0:
+        return []
+    lats, lngs = np.asarray(points, dtype=float).T
+    xs, ys = _get_wgs84_to_nztm_transformer().transform(lngs, lats)
+    with _open_model_output(model_id) as ds:
+        x_indexes = _nearest_indexes(ds["xx_P0"].values, np.atleast_1d(xs))
+        y_indexes = _nearest_indexes(ds["yy_P0"].values, np.atleast_1d(ys))
+        depths = _depths_at_cells(ds, x_indexes, y_indexes)
+        times = ds.coords["time"].values.tolist()
+    return [DepthTimePlot(depths[:, point_index].tolist(), times) for point_index in range(len(points))]
+
+
+def get_depth_by_time_at_point(model_id: int, lat: float, lng: float) -> DepthTimePlot:
+    """
+    Query a point in a flood model output and return the list of depths and times.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+    lat : float
+        The latitude of the point to query.
+    lng : float
+        The longitude of the point to query.
+
+    Returns
+    -------
+    DepthTimePlot
+        Tuple of depths list and times list for the pixel in the output nearest to the point.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database.
+    """
+    return get_depths_by_time_at_points(model_id, [(lat, lng)])[0]
+
+
+def get_depth_statistics_in_geometry(model_id: int, geometry: BaseGeometry) -> DepthStatistics:
+    """
+    Calculate statistics of the flood depths over time for the pixels along a line or within a polygon.
+    Lines use the pixels they pass through. Polygons use the pixels with centres inside the polygon, or the pixel
+    containing the polygon's centroid if the polygon is smaller than a pixel.
+    Parts of the geometry outside the model output are left out, so a geometry entirely outside it has no statistics.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+    geometry : BaseGeometry
+        The line or polygon to query, in WGS84 (lng, lat) coordinates.
+
+    Returns
+    -------
+    DepthStatistics
+        The maximum depth, mean depth, and flooded fraction of the pixels at each time.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database.
+    ValueError
+        If the geometry is not a line or polygon.
+    """
+    nztm_geometry = transform(_get_wgs84_to_nztm_transformer().transform, geometry)
+    if nztm_geometry.geom_type not in ("LineString", "MultiLineString", "Polygon", "MultiPolygon"):
+        raise ValueError(f"Depth statistics can only be calculated for lines and polygons, not {geometry.geom_type}")
+
+    with _open_model_output(model_id) as ds:
+        xx = ds["xx_P0"].values
+        yy = ds["yy_P0"].values
+        pixel_size = _get_pixel_size(xx, yy)
+        if nztm_geometry.geom_type in ("LineString", "MultiLineString"):
+            # Sample the line at least once per pixel so that every pixel it passes through is included
+            if pixel_size is not None:
+                nztm_geometry = shapely.segmentize(nztm_geometry, pixel_size)
+            sample_points = shapely.get_coordinates(nztm_geometry)
+            # Leave out the parts of the line outside the model output, instead of snapping them to its edge
+            sample_points = sample_points[
+                _within_grid(xx, sample_points[:, 0], pixel_size) & _within_grid(yy, sample_points[:, 1], pixel_size)]
+            cells = np.unique(np.column_stack([
+                _nearest_indexes(xx, sample_points[:, 0]),
+                _nearest_indexes(yy, sample_points[:, 1]),
+            ]), axis=0).reshape(-1, 2)
+            x_indexes, y_indexes = cells[:, 0], cells[:, 1]
+        else:
+            min_x, min_y, max_x, max_y = nztm_geometry.bounds
+            x_candidates = np.nonzero((xx >= min_x) & (xx <= max_x))[0]
+            y_candidates = np.nonzero((yy >= min_y) & (yy <= max_y))[0]
+            grid_x_indexes, grid_y_indexes = np.meshgrid(x_candidates, y_candidates)
+            inside = shapely.contains_xy(nztm_geometry, xx[grid_x_indexes], yy[grid_y_indexes])
+            x_indexes, y_indexes = grid_x_indexes[inside], grid_y_indexes[inside]
+            centroid = nztm_geometry.centroid
+            centroid_x, centroid_y = np.array([centroid.x]), np.array([centroid.y])
+            if (len(x_indexes) == 0 and _within_grid(xx, centroid_x, pixel_size)[0]
+                    and _within_grid(yy, centroid_y, pixel_size)[0]):
+                # The polygon is smaller than a pixel, so use the pixel it falls in
+                x_indexes = _nearest_indexes(xx, centroid_x)
+                y_indexes = _nearest_indexes(yy, centroid_y)
+
+        depths = _depths_at_cells(ds, x_indexes, y_indexes)
+        times = ds.coords["time"].values.tolist()
+    return _summarise_depths(times, depths)
+
+
+def get_model_extents_bbox(model_id: int) -> str:
+    """
+    Find the bounding box of a given model output
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+
+    Returns
+    -------
+    str:
+        The bounding box in 'x1,y1,x2,y2' format
+
+    Raises
+    ------
+    FileNotFoundError
+        If the model output could not be found in the database.
+    """
+    engine = setup_environment.get_connection_from_profile()
+    extents = bg_flood_model.model_extents_from_db_by_id(engine, model_id).geometry[0]
+    # Retrieve a tuple of the corners of the extents
+    bbox_corners = extents.bounds
+    # Convert the tuple into a string in x1,y1,x2,y2 form
+    return ",".join(map(str, bbox_corners))
+
+
+def _get_model_buildings_source(engine: Engine, model_id: int) -> Tuple[str, Dict[str, int]]:
+    """
+    Get the table to read the building outlines and flood statuses of a flood model from.
+    This is the precomputed building layer, or for flood models stored before building layers were precomputed,
+    a query of the building flood statuses joined with the building outlines.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    model_id : int
+        The database id of the model output to query.
+
+    Returns
+    -------
+    Tuple[str, Dict[str, int]]
+        The table or subquery to select the buildings from, and the query parameters it needs.
+
+    Raises
+    ------
+    FileNotFoundError
+        If there are no building flood statuses for the model output in the database.
+    """
+    table_name = flooded_buildings.get_model_buildings_table_name(model_id)
+    if tables.check_table_exists(engine, table_name):
+        return table_name, {}
+    if tables.check_table_exists(engine, "building_flood_status") and engine.execute(
+            text("SELECT EXISTS (SELECT 1 FROM building_flood_status WHERE flood_model_id = :flood_model_id);"),
+            flood_model_id=model_id).scalar():
+        return f"({flooded_buildings.get_model_buildings_query()})", {"flood_model_id": model_id}
+    raise FileNotFoundError(f"Buildings for flood model output {model_id} could not be found")
+
+
+def get_model_buildings(model_id: int,
+                        bbox: Optional[Tuple[float, float, float, float]] = None,
+                        crs: int = 4326) -> gpd.GeoDataFrame:
+    """
+    Get the building outlines and their flood statuses for a flood model, from the precomputed building layer.
+    Flood models stored before building layers were precomputed are read from their building flood statuses instead.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+    bbox : Optional[Tuple[float, float, float, float]] = None
+        Only include buildings intersecting this (min_lng, min_lat, max_lng, max_lat) WGS84 bounding box.
+        Defaults to all buildings in the model area.
+    crs : int = 4326
+        The EPSG code of the CRS to return the building outlines in. Defaults to 4326.
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        The building outlines with their flood statuses and depths.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the building layer for the model output could not be found in the database.
+    """
+    engine = setup_environment.get_connection_from_profile()
+    buildings_source, query_params = _get_model_buildings_source(engine, model_id)
+    query_text = f"SELECT * FROM {buildings_source} AS buildings"
+    if bbox is not None:
+        # Filter using the spatial index, comparing in the CRS of the stored buildings
+        query_text += " WHERE geometry && ST_Transform(ST_MakeEnvelope(:min_x, :min_y, :max_x, :max_y, 4326), 2193)"
+        query_params.update(zip(["min_x", "min_y", "max_x", "max_y"], bbox))
+    buildings = gpd.read_postgis(text(query_text).bindparams(**query_params), engine, geom_col="geometry")
+    return buildings.to_crs(crs)
+
+
+def _get_tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    Get the bounds of a Web Mercator tile, matching the envelope of ST_TileEnvelope.
+
+    Parameters
+    ----------
+    z : int
+        The zoom level of the tile.
+    x : int
+        The column of the tile.
+    y : int
+        The row of the tile, counted down from the top of the world.
+
+    Returns
+    -------
+    Tuple[float, float, float, float]
+        The bounds (xmin, ymin, xmax, ymax) of the tile in EPSG:3857.
+    """
+    tile_width = 2 * WEB_MERCATOR_HALF_WIDTH / 2 ** z
+    xmin = -WEB_MERCATOR_HALF_WIDTH + x * tile_width
+    ymax = WEB_MERCATOR_HALF_WIDTH - y * tile_width
+    return xmin, ymax - tile_width, xmin + tile_width, ymax
+
+
+def get_model_buildings_tile(model_id: int, z: int, x: int, y: int) -> bytes:
+    """
+    Generate a Mapbox Vector Tile of the building outlines and their flood statuses for a flood model,
+    from the precomputed building layer.
+
+    Parameters
+    ----------
+    model_id : int
+        The database id of the model output to query.
+    z : int
+        The zoom level of the tile.
+    x : int
+        The column of the tile.
+    y : int
+        The row of the tile.
+
+    Returns
+    -------
+    bytes
+        The vector tile, with the buildings in a layer named "buildings".
+
+    Raises
+    ------
+    FileNotFoundError
+        If the building layer for the model output could not be found in the database.
+    """
+    engine = setup_environment.get_connection_from_profile()
+    buildings_source, query_params = _get_model_buildings_source(engine, model_id)
+    tile_xmin, tile_ymin, tile_xmax, tile_ymax = _get_tile_bounds(z, x, y)
+    nz_xmin, nz_ymin, nz_xmax, nz_ymax = NZ_EXTENT_3857
+    if tile_xmax <= nz_xmin or tile_xmin >= nz_xmax or tile_ymax <= nz_ymin or tile_ymin >= nz_ymax:
+        # The tile is outside New Zealand so has no buildings, and could not be transformed to NZTM to search for them
+        return b""
+    query = text(f"""
+        WITH tile AS (
+            SELECT ST_TileEnvelope(:z, :x, :y) AS envelope
+        ),
+        search_area AS (
+            -- Clip the tile to New Zealand, then add vertices along its edges so that it keeps its shape in NZTM
+            SELECT ST_Transform(
+                ST_Segmentize(
+                    ST_Intersection(tile.envelope, ST_MakeEnvelope(:nz_xmin, :nz_ymin, :nz_xmax, :nz_ymax, 3857)),
+                    (ST_XMax(tile.envelope) - ST_XMin(tile.envelope)) / 64
+                ),
+                2193
+            ) AS geometry
+            FROM tile
+        ),
+        tile_buildings AS (
+            SELECT
+                ST_AsMVTGeom(ST_Transform(buildings.geometry, 3857), tile.envelope) AS geometry,
+                buildings.building_outline_id,
+                buildings.is_flooded,
+                buildings.max_depth,
+                buildings.mean_depth,
+                buildings.flooded_fraction,
+                buildings.peak_time,
+                buildings.first_inundation_time
+            FROM {buildings_source} AS buildings, tile, search_area
+            -- Filter using the spatial index, comparing in the CRS of the stored buildings
+            WHERE buildings.geometry && search_area.geometry
+        )
+        SELECT ST_AsMVT(tile_buildings.*, 'buildings', 4096, 'geometry') FROM tile_buildings;
+        """).bindparams(z=z, x=x, y=y, nz_xmin=nz_xmin, nz_ymin=nz_ymin, nz_xmax=nz_xmax, nz_ymax=nz_ymax,
+                        **query_params)
+    tile = engine.execute(query).scalar()
+    return bytes(tile) if tile is not None else b""
+
+
+def is_hirds_ingest_running() -> bool:
+    """
+    Check whether the rainfall data of every HIRDS rainfall site is being ingested.
+
+    Returns
+    -------
+    bool
+        True if an ingest of the HIRDS rainfall data is running, otherwise False.
+    """
+    engine = setup_environment.get_connection_from_profile()
+    return bootstrap_hirds_rainfall_data.is_hirds_ingest_running(engine)
+
+
+def get_valid_parameters_based_on_confidence_level() -> Dict[str, Dict[str, Union[str, int]]]:
+    """
+    Get information on valid tide and sea-level-rise parameters based on the valid values in the database.
+    These parameters are mostly dependent on the "confidence_level" parameter, so that is the key in the returned dict.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Union[str, int]]]
+        Dictionary with confidence_level as the key, and 2nd level dict with allowed values for dependent values.
+    """
+    return main_tide_slr.get_valid_parameters_based_on_confidence_level()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+This script prepares a new deployment by fetching all New Zealand geospatial layers that are not yet in the database,
+concurrently, so that the first catchment area request does not have to wait for them.
+Run with `python -m src.digitaltwin.bootstrap_national_layers`.
+"""
+
+import logging
+import time
+from typing import Optional
+
+from src.digitaltwin import setup_environment, instructions_records_to_db, data_to_db
+from src.digitaltwin.utils import LogLevel, setup_logging
+
+log = logging.getLogger(__name__)
+
+
+def main(max_workers: Optional[int] = None, log_level: LogLevel = LogLevel.INFO) -> None:
+    """
+    Populates the 'geospatial_layers' table, then fetches and stores all New Zealand geospatial layers that are missing
+    from the database, logging the time taken for each layer.
+
+    Parameters
+    ----------
+    max_workers : Optional[int] = None
+        The maximum number of layers to fetch at once. Defaults to fetching all missing layers at once.
+    log_level : LogLevel = LogLevel.INFO
+        The log level to set for the root logger. Defaults to LogLevel.INFO.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    # Set up logging with the specified log level
+    setup_logging(log_level)
+    start_time = time.perf_counter()
+    # Connect to the database
+    engine = setup_environment.get_database()
+    # Store 'static_boundary_instructions' records in the 'geospatial_layers' table in the database.
+    instructions_records_to_db.store_instructions_records_to_db(engine)
+    # Store the missing New Zealand geospatial layers in the database
+    timings = data_to_db.nz_geospatial_layers_data_to_db(engine, max_workers=max_workers)
+    total_records = sum(timing.records for timing in timings)
+    log.info(f"Loaded {len(timings)} national layers ({total_records} records) "
+             f"in {time.perf_counter() - start_time:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
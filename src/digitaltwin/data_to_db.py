@@ -4,16 +4,32 @@ This script fetches geospatial data from various providers using the 'geoapis' l
 It also saves user log information in the database.
 """
 
+import io
 import logging
-from typing import Tuple, Set
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, NamedTuple, Optional, Tuple
 
 import geopandas as gpd
 import pandas as pd
+import shapely
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import text
 
-from src.digitaltwin.tables import GeospatialLayers, UserLogInfo, create_table, check_table_exists, execute_query
-from src.digitaltwin.get_data_using_geoapis import fetch_vector_data_using_geoapis
+from src.digitaltwin.tables import (
+    GeospatialLayers,
+    GeospatialLayerCoverage,
+    UserLogInfo,
+    create_table,
+    check_table_exists,
+    execute_query
+)
+from src.digitaltwin.get_data_using_geoapis import (
+    fetch_vector_data_using_geoapis,
+    fetch_vector_data_in_tiles_using_geoapis
+)
+from src.pipeline_metrics import propagate_context, track_stage
 
 log = logging.getLogger(__name__)
 
@@ -23,6 +39,27 @@ class NoNonIntersectionError(Exception):
     pass
 
 
+class LayerLoadTiming(NamedTuple):
+    """
+    Represents the time taken to load a New Zealand geospatial layer into the database.
+
+    Attributes
+    ----------
+    table_name : str
+        The database table name of the geospatial layer.
+    records : int
+        The number of records loaded.
+    fetch_seconds : float
+        The time taken to fetch the layer from the data provider.
+    load_seconds : float
+        The time taken to load the layer and its indexes into the database.
+    """
+    table_name: str
+    records: int
+    fetch_seconds: float
+    load_seconds: float
+
+
 def get_nz_geospatial_layers(engine: Engine) -> pd.DataFrame:
     """
     Retrieve geospatial layers from the database that have a coverage area of New Zealand.
@@ -99,15 +136,88 @@ def get_geospatial_layer_info(layer_row: pd.Series) -> Tuple[str, int, str, str]
     return data_provider, layer_id, table_name, unique_column_name
 
 
-def get_vector_data_id_not_in_db(
+def create_unique_column_index(engine: Engine, table_name: str, unique_column_name: str) -> None:
+    """
+    Create a unique index on the unique column of a geospatial layer table if it does not already exist, so that new
+    records can be inserted without duplicating existing ones. Duplicate records already in the table are removed
+    first. Concurrent calls for the same table are serialised with a transaction-level advisory lock, so only one of
+    them removes duplicates and creates the index.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    table_name : str
+        The name of the table in the database.
+    unique_column_name : str
+        The unique column name used for record identification in the database table.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    index_name = f"{table_name}_{unique_column_name}_key"
+    with engine.begin() as conn:
+        # Held until the transaction ends, so other tasks wait here and then see the index created by this one
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table_name));"), {"table_name": table_name})
+        index_exists = conn.execute(
+            text("SELECT to_regclass(:index_name) IS NOT NULL;"), {"index_name": index_name}).scalar()
+        if index_exists:
+            return
+        # Keep one record for each ID, tables filled before the index existed may have duplicates
+        conn.execute(text(f"""
+        DELETE FROM {table_name} AS a
+        USING {table_name} AS b
+        WHERE a.{unique_column_name} = b.{unique_column_name} AND a.ctid > b.ctid;
+        """))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table_name} ({unique_column_name});"))
+
+
+def vector_data_to_csv_buffer(vector_data: gpd.GeoDataFrame, columns: List[str]) -> io.StringIO:
+    """
+    Write vector data as CSV in memory, to be bulk loaded with COPY. Geometries are written as hex EWKB, which PostGIS
+    reads directly as geometry text input.
+
+    Parameters
+    ----------
+    vector_data : gpd.GeoDataFrame
+        A GeoDataFrame containing the vector data. Geometries without a CRS are written as EPSG:2193.
+    columns : List[str]
+        The columns of the vector data to write, in order.
+
+    Returns
+    -------
+    io.StringIO
+        The CSV rows without a header, positioned at the start.
+
+    Raises
+    ------
+    ValueError
+        If the CRS of the vector data has no EPSG code to use as the SRID of the geometries.
+    """
+    geometry_name = vector_data.geometry.name
+    srid = vector_data.crs.to_epsg() if vector_data.crs is not None else 2193
+    if srid is None:
+        raise ValueError(f"The CRS of the vector data has no EPSG code to store it with: {vector_data.crs.name}")
+    vector_data = pd.DataFrame(vector_data[columns])
+    if geometry_name in columns:
+        vector_data[geometry_name] = shapely.to_wkb(
+            shapely.set_srid(vector_data[geometry_name].values, srid), hex=True, include_srid=True)
+    csv_buffer = io.StringIO()
+    vector_data.to_csv(csv_buffer, header=False, index=False)
+    csv_buffer.seek(0)
+    return csv_buffer
+
+
+def copy_vector_data_to_db(
         engine: Engine,
         vector_data: gpd.GeoDataFrame,
         table_name: str,
-        unique_column_name: str,
-        area_of_interest: gpd.GeoDataFrame) -> Set[int]:
+        unique_column_name: str) -> int:
     """
-    Get the IDs from the fetched vector_data that are not present in the specified database table
-    for the area of interest.
+    Bulk load vector data into an existing table with COPY, through a staging table so that records whose IDs are
+    already in the table are skipped by the database.
 
     Parameters
     ----------
@@ -118,40 +228,142 @@ def get_vector_data_id_not_in_db(
     table_name : str
         The name of the table in the database.
     unique_column_name : str
-        The name of the unique column in the table.
-    area_of_interest : gpd.GeoDataFrame
-        A GeoDataFrame representing the area of interest.
+        The unique column name used for record identification in the database table.
 
     Returns
     -------
-    Set[int]
-        The set of IDs from the fetched vector_data that are not present in the specified table in the database.
+    int
+        The number of new records added to the table.
     """
-    # Get the unique IDs from the vector_data
-    vector_data_ids = set(vector_data[unique_column_name])
-    # Fetch the unique IDs from the specified table that intersect with the area of interest
-    aoi_polygon = area_of_interest["geometry"][0]
-    command_text = f"""
-    SELECT DISTINCT {unique_column_name}
-    FROM {table_name} AS ids
-    WHERE ST_Intersects(ids.geometry, ST_GeomFromText(:aoi_polygon, 2193));
+    create_unique_column_index(engine, table_name, unique_column_name)
+    # Only load the columns the table has, in case the data provider has added new columns to the layer
+    table_columns = pd.read_sql(
+        text("SELECT column_name FROM information_schema.columns WHERE table_name = :table_name;")
+        .bindparams(table_name=table_name), engine)["column_name"]
+    columns = [column for column in vector_data.columns if column in set(table_columns)]
+    csv_buffer = vector_data_to_csv_buffer(vector_data, columns)
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE staging ON COMMIT DROP AS SELECT {column_list} FROM {table_name} LIMIT 0;")
+            cursor.copy_expert(f"COPY staging ({column_list}) FROM STDIN WITH (FORMAT csv)", csv_buffer)
+            cursor.execute(f"""
+            INSERT INTO {table_name} ({column_list})
+            SELECT {column_list} FROM staging
+            ON CONFLICT ({unique_column_name}) DO NOTHING;
+            """)
+            new_records = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+    return new_records
+
+
+def copy_new_vector_data_to_db(engine: Engine, vector_data: gpd.GeoDataFrame, table_name: str) -> None:
     """
-    query = text(command_text).bindparams(
-        aoi_polygon=str(aoi_polygon)
-    )
-    # Execute the query and retrieve the IDs present in the database
-    ids_in_db = set(pd.read_sql(query, engine)[unique_column_name])
-    # Find the IDs from vector_data that are not present in the database
-    ids_not_in_db = vector_data_ids - ids_in_db
-    return ids_not_in_db
+    Create a table for vector data and bulk load the data into it with COPY, replacing any existing table.
+    Also ensures the table has a spatial index. The data is loaded into a table with a temporary name, which is only
+    renamed to table_name once it is complete, so the table never exists without its data, and a failed load leaves
+    no table.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    vector_data : gpd.GeoDataFrame
+        A GeoDataFrame containing the fetched vector data.
+    table_name : str
+        The name of the table to create in the database.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    geometry_name = vector_data.geometry.name
+    # Unique per load, so that concurrent loads of the same layer do not share a table
+    loading_table_name = f"{table_name}_loading_{uuid.uuid4().hex[:8]}"
+    index_name = f"idx_{table_name}_{geometry_name}"
+    # Create the empty table with the columns of the vector data
+    vector_data.iloc[:0].to_postgis(loading_table_name, engine, index=False)
+    columns = list(vector_data.columns)
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {loading_table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)",
+                               vector_data_to_csv_buffer(vector_data, columns))
+            # geoalchemy2 usually creates this index with the table, so only create it if that did not happen
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{loading_table_name}_{geometry_name} "
+                f"ON {loading_table_name} USING GIST ({geometry_name});")
+            cursor.execute(f"ANALYZE {loading_table_name};")
+            # Swap the loaded table in, in the same transaction as the load
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+            cursor.execute(f"ALTER TABLE {loading_table_name} RENAME TO {table_name};")
+            cursor.execute(f"ALTER INDEX idx_{loading_table_name}_{geometry_name} RENAME TO {index_name};")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {loading_table_name};")
+        connection.commit()
+        raise
+    finally:
+        connection.close()
+
+
+def load_nz_geospatial_layer_to_db(
+        engine: Engine,
+        data_provider: str,
+        layer_id: int,
+        table_name: str,
+        crs: int = 2193,
+        verbose: bool = False) -> LayerLoadTiming:
+    """
+    Fetches a New Zealand geospatial layer using 'geoapis' and stores it into the database.
 
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    data_provider : str
+        The data provider of the geospatial layer.
+    layer_id : int
+        The ID of the geospatial layer.
+    table_name : str
+        The database table name of the geospatial layer.
+    crs : int = 2193
+        The coordinate reference system (CRS) code to use. Default is 2193.
+    verbose : bool = False
+        Whether to print messages. Default is False.
+
+    Returns
+    -------
+    LayerLoadTiming
+        The number of records loaded, and the time taken to fetch and load them.
+    """
+    log.info(f"Fetching '{table_name}' data ({data_provider} {layer_id}).")
+    start_time = time.perf_counter()
+    vector_data = fetch_vector_data_using_geoapis(data_provider, layer_id, crs, verbose)
+    fetched_time = time.perf_counter()
+    log.info(f"Adding '{table_name}' data ({data_provider} {layer_id}) to the database.")
+    copy_new_vector_data_to_db(engine, vector_data, table_name)
+    loaded_time = time.perf_counter()
+    return LayerLoadTiming(table_name, len(vector_data), fetched_time - start_time, loaded_time - fetched_time)
 
+
+@track_stage("nz_geospatial_layers_data_to_db")
 def nz_geospatial_layers_data_to_db(
         engine: Engine,
         crs: int = 2193,
-        verbose: bool = False) -> None:
+        verbose: bool = False,
+        max_workers: Optional[int] = None) -> List[LayerLoadTiming]:
     """
-    Fetches New Zealand geospatial layers data using 'geoapis' and stores it into the database.
+    Fetches New Zealand geospatial layers data that is not yet in the database using 'geoapis' and stores it into the
+    database. Layers are fetched and loaded concurrently.
 
     Parameters
     ----------
@@ -161,30 +373,71 @@ def nz_geospatial_layers_data_to_db(
         The coordinate reference system (CRS) code to use. Default is 2193.
     verbose : bool = False
         Whether to print messages. Default is False.
+    max_workers : Optional[int] = None
+        The maximum number of layers to fetch at once. Defaults to fetching all missing layers at once.
 
     Returns
     -------
-    None
-        This function does not return any value.
+    List[LayerLoadTiming]
+        The time taken to load each layer that was missing, in the order they finished.
     """
     # Get New Zealand geospatial layers
     nz_geo_layers = get_nz_geospatial_layers(engine)
-
-    # Iterate over each NZ geospatial layer
+    # Find the layers whose table does not yet exist in the database
+    missing_layers = []
     for _, layer_row in nz_geo_layers.iterrows():
-        # Extract geospatial layer information
         data_provider, layer_id, table_name, _ = get_geospatial_layer_info(layer_row)
-
-        # Check if the table already exists in the database
         if check_table_exists(engine, table_name):
             log.info(f"'{table_name}' data already exists in the database.")
         else:
-            # Fetch vector data using geoapis
-            log.info(f"Fetching '{table_name}' data ({data_provider} {layer_id}).")
-            vector_data = fetch_vector_data_using_geoapis(data_provider, layer_id, crs, verbose)
-            # Insert vector data into the database
-            log.info(f"Adding '{table_name}' data ({data_provider} {layer_id}) to the database.")
-            vector_data.to_postgis(table_name, engine, index=False, if_exists="replace")
+            missing_layers.append((data_provider, layer_id, table_name))
+    if not missing_layers:
+        return []
+
+    timings = []
+    with ThreadPoolExecutor(max_workers=max_workers or len(missing_layers)) as executor:
+        futures = [
+            executor.submit(propagate_context(load_nz_geospatial_layer_to_db),
+                            engine, data_provider, layer_id, table_name, crs, verbose)
+            for data_provider, layer_id, table_name in missing_layers
+        ]
+        for future in as_completed(futures):
+            timing = future.result()
+            timings.append(timing)
+            log.info(f"[{len(timings)}/{len(missing_layers)}] Loaded {timing.records} '{timing.table_name}' records "
+                     f"(fetch {timing.fetch_seconds:.1f}s, load {timing.load_seconds:.1f}s).")
+    return timings
+
+
+def create_geospatial_layer_coverage_table(engine: Engine) -> None:
+    """
+    Create the 'geospatial_layer_coverage' table if it doesn't exist, filling it with the coverage of each layer from
+    the user log information already in the database.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    if check_table_exists(engine, GeospatialLayerCoverage.__tablename__):
+        return
+    create_table(engine, UserLogInfo)
+    create_table(engine, GeospatialLayerCoverage)
+    # Union the areas already fetched for each layer
+    command_text = f"""
+    INSERT INTO {GeospatialLayerCoverage.__tablename__} (table_name, updated_at, geometry)
+    SELECT table_name, now(), ST_Multi(ST_CollectionExtract(ST_Union(geometry), 3))
+    FROM {UserLogInfo.__tablename__}, unnest(source_table_list) AS table_name
+    GROUP BY table_name
+    ON CONFLICT (table_name) DO NOTHING;
+    """
+    with engine.begin() as conn:
+        conn.execute(text(command_text))
 
 
 def get_non_intersection_area_from_db(
@@ -192,8 +445,7 @@ def get_non_intersection_area_from_db(
         catchment_area: gpd.GeoDataFrame,
         table_name: str) -> gpd.GeoDataFrame:
     """
-    Get the non-intersecting area from the catchment area and user log information table in the database
-    for the specified table.
+    Get the area of the catchment area that is not yet covered by the data in the database for the specified table.
 
     Parameters
     ----------
@@ -214,33 +466,28 @@ def get_non_intersection_area_from_db(
     NoNonIntersectionError
         If the non-intersecting area is empty, it suggests that the catchment area is already fully covered.
     """
-    # Create the 'user_log_information' table if it doesn't exist
-    create_table(engine, UserLogInfo)
+    # Create the 'geospatial_layer_coverage' table if it doesn't exist
+    create_geospatial_layer_coverage_table(engine)
     # Extract the geometry of the catchment area
     catchment_polygon = catchment_area["geometry"][0]
-    # Build the SQL query to find intersections between the user log information and the catchment area
+    # Subtract the area already covered by the table from the catchment area
     command_text = f"""
-    SELECT *
-    FROM (
-        SELECT *
-        FROM {UserLogInfo.__tablename__}
-        WHERE :table_name = ANY(source_table_list)
-    ) AS sub
-    WHERE ST_Intersects(sub.geometry, ST_GeomFromText(:catchment_polygon, 2193));
+    SELECT ST_CollectionExtract(ST_Difference(catchment.geometry, coverage.geometry), 3) AS geometry
+    FROM (SELECT ST_GeomFromText(:catchment_polygon, 2193) AS geometry) AS catchment
+    JOIN {GeospatialLayerCoverage.__tablename__} AS coverage
+    ON coverage.table_name = :table_name AND ST_Intersects(coverage.geometry, catchment.geometry);
     """
     query = text(command_text).bindparams(
         table_name=str(table_name),
         catchment_polygon=str(catchment_polygon)
     )
-    # Execute the SQL query and retrieve the intersections as a GeoDataFrame
-    user_log_intersections = gpd.GeoDataFrame.from_postgis(query, engine, geom_col="geometry")
-    # Check if there are no intersections
-    if user_log_intersections.empty:
+    # Execute the SQL query and retrieve the non-intersecting area as a GeoDataFrame
+    non_intersection_area = gpd.GeoDataFrame.from_postgis(query, engine, geom_col="geometry")
+    # Check if the table's coverage does not intersect the catchment area
+    if non_intersection_area.empty:
         return catchment_area
-    # Compute the non-intersecting area by overlaying the catchment area with the intersections
-    non_intersection_area = catchment_area.overlay(user_log_intersections, how='difference')
     # Check if the non-intersecting area is empty
-    if non_intersection_area.empty:
+    if non_intersection_area["geometry"][0].is_empty:
         raise NoNonIntersectionError(
             f"'{table_name}' data for the requested catchment area is already in the database.")
     else:
@@ -252,6 +499,7 @@ def process_new_non_nz_geospatial_layers(
         data_provider: str,
         layer_id: int,
         table_name: str,
+        unique_column_name: str,
         area_of_interest: gpd.GeoDataFrame,
         crs: int = 2193,
         verbose: bool = False) -> None:
@@ -268,6 +516,8 @@ def process_new_non_nz_geospatial_layers(
         The ID of the geospatial layer.
     table_name : str
         The database table name of the geospatial layer.
+    unique_column_name : str
+        The unique column name used for record identification in the database table.
     area_of_interest : gpd.GeoDataFrame
         A GeoDataFrame representing the area of interest.
     crs : int = 2193
@@ -282,7 +532,8 @@ def process_new_non_nz_geospatial_layers(
     """
     # Fetch vector data using geoapis
     log.info(f"Fetching '{table_name}' data ({data_provider} {layer_id}) for the catchment area.")
-    vector_data = fetch_vector_data_using_geoapis(data_provider, layer_id, crs, verbose, area_of_interest)
+    vector_data = fetch_vector_data_in_tiles_using_geoapis(
+        data_provider, layer_id, area_of_interest, unique_column_name, crs, verbose)
     # Check if the fetched vector data is empty
     if vector_data.empty:
         log.info(f"The requested catchment area does not contain any '{table_name}' data ({data_provider} {layer_id}).")
@@ -290,6 +541,7 @@ def process_new_non_nz_geospatial_layers(
         # Insert vector data into the database
         log.info(f"Adding '{table_name}' data ({data_provider} {layer_id}) for the catchment area to the database.")
         vector_data.to_postgis(table_name, engine, index=False, if_exists="replace")
+        create_unique_column_index(engine, table_name, unique_column_name)
 
 
 def process_existing_non_nz_geospatial_layers(
@@ -330,26 +582,22 @@ def process_existing_non_nz_geospatial_layers(
     """
     # Fetch vector data using geoapis
     log.info(f"Fetching '{table_name}' data ({data_provider} {layer_id}) for the catchment area.")
-    vector_data = fetch_vector_data_using_geoapis(data_provider, layer_id, crs, verbose, area_of_interest)
+    vector_data = fetch_vector_data_in_tiles_using_geoapis(
+        data_provider, layer_id, area_of_interest, unique_column_name, crs, verbose)
     # Check if the fetched vector data is empty
     if vector_data.empty:
         log.info(f"The requested catchment area does not contain any '{table_name}' data ({data_provider} {layer_id}).")
     else:
-        # Get IDs from the vector data that are not in the database
-        ids_not_in_db = get_vector_data_id_not_in_db(
-            engine, vector_data, table_name, unique_column_name, area_of_interest)
-        # Check if there are IDs not in the database
-        if ids_not_in_db:
-            # Get vector data that contains only the IDs not present in the database
-            vector_data_not_in_db = vector_data[vector_data[unique_column_name].isin(ids_not_in_db)]
-            # Insert vector data into the database
-            log.info(
-                f"Adding new '{table_name}' data ({data_provider} {layer_id}) for the catchment area to the database.")
-            vector_data_not_in_db.to_postgis(table_name, engine, index=False, if_exists="append")
+        # Insert vector data into the database, skipping records that are already in the database
+        new_records = copy_vector_data_to_db(engine, vector_data, table_name, unique_column_name)
+        if new_records:
+            log.info(f"Added {new_records} new '{table_name}' records ({data_provider} {layer_id}) "
+                     f"for the catchment area to the database.")
         else:
             log.info(f"'{table_name}' data for the requested catchment area is already in the database.")
 
 
+@track_stage("non_nz_geospatial_layers_data_to_db")
 def non_nz_geospatial_layers_data_to_db(
         engine: Engine,
         catchment_area: gpd.GeoDataFrame,
@@ -397,7 +645,7 @@ def non_nz_geospatial_layers_data_to_db(
         else:
             # Process new non-NZ geospatial layers
             process_new_non_nz_geospatial_layers(
-                engine, data_provider, layer_id, table_name, non_intersection_area, crs, verbose)
+                engine, data_provider, layer_id, table_name, unique_column_name, non_intersection_area, crs, verbose)
 
 
 def store_geospatial_layers_data_to_db(
@@ -430,9 +678,11 @@ def store_geospatial_layers_data_to_db(
     non_nz_geospatial_layers_data_to_db(engine, catchment_area, crs, verbose)
 
 
+@track_stage("user_log_info_to_db")
 def user_log_info_to_db(engine: Engine, catchment_area: gpd.GeoDataFrame) -> None:
     """
-    Store user log information to the database.
+    Store user log information to the database, and add the catchment area to the coverage of each non-NZ
+    geospatial layer.
 
     Parameters
     ----------
@@ -446,8 +696,9 @@ def user_log_info_to_db(engine: Engine, catchment_area: gpd.GeoDataFrame) -> Non
     None
         This function does not return any value.
     """
-    # Create the 'user_log_information' table if it doesn't exist
+    # Create the 'user_log_information' and 'geospatial_layer_coverage' tables if they don't exist
     create_table(engine, UserLogInfo)
+    create_geospatial_layer_coverage_table(engine)
     # Get the list of table names for non-NZ geospatial layers
     non_nz_geo_layers = get_non_nz_geospatial_layers(engine)
     table_list = non_nz_geo_layers["table_name"].tolist()
@@ -457,3 +708,15 @@ def user_log_info_to_db(engine: Engine, catchment_area: gpd.GeoDataFrame) -> Non
     query = UserLogInfo(source_table_list=table_list, geometry=catchment_geom)
     # Execute the query
     execute_query(engine, query)
+    # Extend the coverage of each layer with the catchment area
+    command_text = f"""
+    INSERT INTO {GeospatialLayerCoverage.__tablename__} (table_name, updated_at, geometry)
+    SELECT table_name, now(), ST_Multi(ST_GeomFromText(:catchment_geom, 2193))
+    FROM unnest(CAST(:table_list AS VARCHAR[])) AS table_name
+    ON CONFLICT (table_name) DO UPDATE
+    SET updated_at = EXCLUDED.updated_at,
+        geometry = ST_Multi(ST_CollectionExtract(
+            ST_Union({GeospatialLayerCoverage.__tablename__}.geometry, EXCLUDED.geometry), 3));
+    """
+    with engine.begin() as conn:
+        conn.execute(text(command_text), {"catchment_geom": catchment_geom, "table_list": table_list})
@@ -5,12 +5,20 @@ LRIS, and MFE, using the 'geoapis' library. To access data from each provider, y
 API key in the environment variables.
 """
 
-from typing import Optional
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 from geoapis.vector import StatsNz, Linz, Lris, WfsQueryBase
 
 from src import config
+from src.pipeline_metrics import propagate_context
+
+log = logging.getLogger(__name__)
 
 
 class MFE(WfsQueryBase):
@@ -105,3 +113,89 @@ def fetch_vector_data_using_geoapis(
         # Create an empty GeoDataFrame to indicate no returned vector data
         vector_data = gpd.GeoDataFrame()
     return vector_data
+
+
+def split_area_into_tiles(area_of_interest: gpd.GeoDataFrame, tile_size: float) -> List[gpd.GeoDataFrame]:
+    """
+    Split an area of interest into square tiles, clipped to the area, so that the data for each tile can be fetched
+    separately.
+
+    Parameters
+    ----------
+    area_of_interest : gpd.GeoDataFrame
+        A GeoDataFrame representing the area of interest.
+    tile_size : float
+        The width and height of each tile, in the units of the area of interest's CRS.
+
+    Returns
+    -------
+    List[gpd.GeoDataFrame]
+        A GeoDataFrame with a single polygon for each non-empty tile of the area.
+    """
+    area_polygon = area_of_interest.unary_union
+    min_x, min_y, max_x, max_y = area_polygon.bounds
+    tile_min_xs, tile_min_ys = np.meshgrid(np.arange(min_x, max_x, tile_size), np.arange(min_y, max_y, tile_size))
+    tile_boxes = shapely.box(tile_min_xs, tile_min_ys, tile_min_xs + tile_size, tile_min_ys + tile_size).ravel()
+    tiles = shapely.intersection(tile_boxes, area_polygon)
+    return [
+        gpd.GeoDataFrame(geometry=[tile], crs=area_of_interest.crs)
+        for tile in tiles
+        if not tile.is_empty and tile.area > 0
+    ]
+
+
+def fetch_vector_data_in_tiles_using_geoapis(
+        data_provider: str,
+        layer_id: int,
+        area_of_interest: gpd.GeoDataFrame,
+        unique_column_name: Optional[str] = None,
+        crs: int = 2193,
+        verbose: bool = False) -> gpd.GeoDataFrame:
+    """
+    Fetch vector data for an area of interest using 'geoapis', splitting the area into tiles that are fetched
+    concurrently. The tile size and number of concurrent fetches are set by the VECTOR_FETCH_TILE_SIZE and
+    VECTOR_FETCH_MAX_WORKERS environment variables.
+
+    Parameters
+    -----------
+    data_provider : str
+        The data provider to use. Supported values: "StatsNZ", "LINZ", "LRIS", "MFE".
+    layer_id : int
+        The ID of the layer to fetch.
+    area_of_interest : gpd.GeoDataFrame
+        A GeoDataFrame representing the area of interest, in a projected CRS with units of metres.
+    unique_column_name : Optional[str] = None
+        The unique column of the layer, used to remove features fetched by more than one tile.
+        Default is to not remove duplicates.
+    crs : int = 2193
+        The coordinate reference system (CRS) code to use. Default is 2193.
+    verbose : bool = False
+        Whether to print messages. Default is False.
+
+    Returns
+    --------
+    gpd.GeoDataFrame
+        A GeoDataFrame containing the fetched vector data, or an empty GeoDataFrame if there is no data.
+
+    Raises
+    -------
+    ValueError
+        If an unsupported 'data_provider' value is provided.
+    """
+    tile_size = config.get_env_variable("VECTOR_FETCH_TILE_SIZE", default=5000.0, cast_to=float)
+    max_workers = config.get_env_variable("VECTOR_FETCH_MAX_WORKERS", default=4, cast_to=int)
+    tiles = split_area_into_tiles(area_of_interest, tile_size)
+    log.debug(f"Fetching {data_provider} {layer_id} in {len(tiles)} tiles with up to {max_workers} at once.")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Run in the caller's context, so that the requests of each tile are measured in the caller's stage
+        tiles_data = list(executor.map(propagate_context(
+            lambda tile: fetch_vector_data_using_geoapis(data_provider, layer_id, crs, verbose, tile)), tiles))
+    non_empty_tiles_data = [tile_data for tile_data in tiles_data if not tile_data.empty]
+    if not non_empty_tiles_data:
+        return gpd.GeoDataFrame()
+    vector_data = gpd.GeoDataFrame(
+        pd.concat(non_empty_tiles_data, ignore_index=True), crs=non_empty_tiles_data[0].crs)
+    if unique_column_name is not None:
+        # Features crossing the edges of tiles are fetched by each of those tiles
+        vector_data = vector_data.drop_duplicates(subset=unique_column_name, ignore_index=True)
+    return vector_data
@@ -8,8 +8,10 @@ import geopandas as gpd
 
 from src.digitaltwin import setup_environment, instructions_records_to_db, data_to_db
 from src.digitaltwin.utils import LogLevel, setup_logging, get_catchment_area
+from src.pipeline_metrics import track_stage
 
 
+@track_stage("retrieve_static_boundaries")
 def main(
         selected_polygon_gdf: gpd.GeoDataFrame,
         log_level: LogLevel = LogLevel.DEBUG) -> None:
@@ -2,14 +2,21 @@
 """
 This script provides functions to set up the database connection using SQLAlchemy and environment variables,
 as well as to create an SQLAlchemy engine for database operations.
+Engines are shared by the whole process, so that each process keeps one pool of connections to the database rather
+than connecting again for every query.
 """
 
 import logging
+import os
+import threading
+import time
+from typing import Dict, NamedTuple
 
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
 
 from src import config
 
@@ -17,6 +24,81 @@ log = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Engines shared by the whole process, keyed by database URL
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+class PoolCheckoutMetrics(NamedTuple):
+    """
+    Represents the time spent waiting to check out connections from the connection pools of this process.
+
+    Attributes
+    ----------
+    checkouts : int
+        The number of connections checked out.
+    total_wait_seconds : float
+        The total time spent waiting for connections to be checked out, in seconds.
+    max_wait_seconds : float
+        The longest time spent waiting for a single connection to be checked out, in seconds.
+    """
+    checkouts: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+
+
+_checkout_metrics = PoolCheckoutMetrics(0, 0.0, 0.0)
+_checkout_metrics_lock = threading.Lock()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records the time spent waiting to check out each connection.
+    Long waits show that the pool is too small for the number of concurrent queries.
+    """
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_checkout_wait(time.perf_counter() - start_time)
+
+
+def _record_checkout_wait(wait_seconds: float) -> None:
+    """
+    Add the time spent waiting for a connection checkout to the checkout metrics of this process.
+
+    Parameters
+    ----------
+    wait_seconds : float
+        The time spent waiting for the connection to be checked out, in seconds.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    global _checkout_metrics
+    with _checkout_metrics_lock:
+        _checkout_metrics = PoolCheckoutMetrics(
+            checkouts=_checkout_metrics.checkouts + 1,
+            total_wait_seconds=_checkout_metrics.total_wait_seconds + wait_seconds,
+            max_wait_seconds=max(_checkout_metrics.max_wait_seconds, wait_seconds),
+        )
+
+
+def get_pool_checkout_metrics() -> PoolCheckoutMetrics:
+    """
+    Get the time spent waiting to check out connections from the connection pools of this process.
+
+    Returns
+    -------
+    PoolCheckoutMetrics
+        The number of checkouts, and the total and longest time spent waiting for them.
+    """
+    return _checkout_metrics
+
 
 def get_database() -> Engine:
     """
@@ -67,6 +149,8 @@ def get_connection_from_profile() -> Engine:
 def get_engine(host: str, port: str, db: str, username: str, password: str) -> Engine:
     """
     Get SQLAlchemy engine using credentials.
+    The engine is created, and the database schema set up, the first time it is requested in this process.
+    Later requests with the same credentials return the same engine, sharing its connection pool.
 
     Parameters
     ----------
@@ -87,6 +171,36 @@ def get_engine(host: str, port: str, db: str, username: str, password: str) -> E
         The engine used to connect to the database.
     """
     url = f'postgresql://{username}:{password}@{host}:{port}/{db}'
-    engine = create_engine(url)
-    Base.metadata.create_all(engine)
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = create_engine(
+                url,
+                poolclass=InstrumentedQueuePool,
+                pool_size=config.get_env_variable("DATABASE_POOL_SIZE", default=5, cast_to=int),
+                max_overflow=config.get_env_variable("DATABASE_MAX_OVERFLOW", default=10, cast_to=int),
+                pool_pre_ping=config.get_env_variable("DATABASE_POOL_PRE_PING", default=True, cast_to=bool),
+                pool_recycle=config.get_env_variable("DATABASE_POOL_RECYCLE_SECONDS", default=1800, cast_to=int),
+            )
+            # Only register the engine once the schema is set up, so a failed connection is retried on the next call
+            Base.metadata.create_all(engine)
+            _engines[url] = engine
     return engine
+
+
+def _reset_engines_after_fork() -> None:
+    """
+    Replace the connection pools of the shared engines in a forked child process (e.g. a Celery worker process),
+    so the child does not use connections that belong to the parent process.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    for engine in _engines.values():
+        # close=False leaves the parent's connections open for the parent to keep using
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_reset_engines_after_fork)
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Exports the static data tables of the database, fetched from external providers (StatsNZ, LINZ, MFE, HIRDS, NIWA),
+to a versioned snapshot, and restores a database from such a snapshot.
+This lets a new deployment, or a test environment without internet access, start without fetching the data again.
+
+A snapshot is a directory holding one compressed (Geo)Parquet file per table, and a 'manifest.json' recording the
+snapshot version, the tables and the checksum of each file.
+Run with `python -m src.digitaltwin.static_data_snapshot export <snapshot_dir>` or
+`python -m src.digitaltwin.static_data_snapshot import <snapshot_dir>`.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from sqlalchemy import Integer
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import text
+
+from src.digitaltwin import setup_environment
+from src.digitaltwin.data_to_db import vector_data_to_csv_buffer
+from src.digitaltwin.tables import (
+    Base,
+    GeospatialLayers,
+    GeospatialLayerCoverage,
+    SeaLevelRiseParameters,
+    UserLogInfo,
+    check_table_exists,
+    create_table
+)
+from src.digitaltwin.utils import LogLevel, setup_logging
+
+log = logging.getLogger(__name__)
+
+# Version of the layout of snapshots, increased when snapshots written by older versions can no longer be imported
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Tables of static data that are not listed in the 'geospatial_layers' table
+STATIC_TABLES = (
+    GeospatialLayers.__tablename__,
+    UserLogInfo.__tablename__,
+    GeospatialLayerCoverage.__tablename__,
+    SeaLevelRiseParameters.__tablename__,
+    "sea_level_rise",
+    "rainfall_sites",
+    "rainfall_sites_voronoi",
+    "rainfall_depth",
+    "rainfall_intensity",
+    "rec_data",
+)
+
+# Tables created from SQLAlchemy models, which are restored with the schema of the model
+_MODEL_TABLES: Dict[str, Base] = {
+    table.__tablename__: table
+    for table in (GeospatialLayers, UserLogInfo, GeospatialLayerCoverage, SeaLevelRiseParameters)
+}
+
+
+def get_static_table_names(engine: Engine) -> List[str]:
+    """
+    Get the names of all static data tables that exist in the database, including the tables of the geospatial
+    layers.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    List[str]
+        The names of the static data tables in the database.
+    """
+    table_names = list(STATIC_TABLES)
+    if check_table_exists(engine, GeospatialLayers.__tablename__):
+        layer_tables = pd.read_sql(f"SELECT table_name FROM {GeospatialLayers.__tablename__};", engine)["table_name"]
+        table_names.extend(layer_tables)
+    return [table_name for table_name in dict.fromkeys(table_names) if check_table_exists(engine, table_name)]
+
+
+def get_geometry_columns(engine: Engine) -> Dict[str, str]:
+    """
+    Get the geometry column of each spatial table in the database.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    Dict[str, str]
+        The name of the geometry column of each spatial table, by table name.
+    """
+    geometry_columns = pd.read_sql(
+        "SELECT f_table_name, f_geometry_column FROM geometry_columns WHERE f_table_schema = 'public';", engine)
+    return dict(zip(geometry_columns["f_table_name"], geometry_columns["f_geometry_column"]))
+
+
+def _file_sha256(file_path: pathlib.Path) -> str:
+    """
+    Calculate the SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    file_path : pathlib.Path
+        The path of the file.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 checksum of the file.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def export_table(
+        engine: Engine,
+        table_name: str,
+        geometry_column: Optional[str],
+        snapshot_dir: pathlib.Path) -> Dict[str, Any]:
+    """
+    Export a table to a compressed Parquet file in the snapshot directory, as GeoParquet if the table is spatial.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    table_name : str
+        The name of the table to export.
+    geometry_column : Optional[str]
+        The name of the geometry column of the table, or None if the table is not spatial.
+    snapshot_dir : pathlib.Path
+        The directory of the snapshot.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The manifest entry of the table.
+    """
+    file_name = f"{table_name}.parquet"
+    query = f'SELECT * FROM "{table_name}";'
+    if geometry_column is None:
+        table_data = pd.read_sql(query, engine)
+    else:
+        table_data = gpd.read_postgis(query, engine, geom_col=geometry_column)
+    table_data.to_parquet(snapshot_dir / file_name, index=False, compression="zstd")
+    log.info(f"Exported {len(table_data)} '{table_name}' records.")
+    return {
+        "file": file_name,
+        "records": len(table_data),
+        "geometry_column": geometry_column,
+        "sha256": _file_sha256(snapshot_dir / file_name),
+    }
+
+
+def export_snapshot(
+        engine: Engine,
+        snapshot_dir: Union[str, pathlib.Path],
+        snapshot_version: Optional[str] = None,
+        max_workers: int = 4) -> pathlib.Path:
+    """
+    Export all static data tables in the database to a snapshot.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    snapshot_dir : Union[str, pathlib.Path]
+        The directory to write the snapshot to. It is created if it does not exist.
+    snapshot_version : Optional[str] = None
+        The version to record in the snapshot manifest. Defaults to the current UTC date and time.
+    max_workers : int = 4
+        The maximum number of tables to export at once. Defaults to 4.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the snapshot manifest.
+    """
+    snapshot_dir = pathlib.Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    created_at = datetime.now(timezone.utc)
+    table_names = get_static_table_names(engine)
+    geometry_columns = get_geometry_columns(engine)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        table_entries = list(executor.map(
+            lambda table_name: export_table(engine, table_name, geometry_columns.get(table_name), snapshot_dir),
+            table_names))
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "snapshot_version": snapshot_version or created_at.strftime("%Y%m%dT%H%M%SZ"),
+        "created_at": created_at.isoformat(),
+        "tables": dict(zip(table_names, table_entries)),
+    }
+    manifest_path = snapshot_dir / MANIFEST_FILE_NAME
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    log.info(f"Exported snapshot '{manifest['snapshot_version']}' of {len(table_names)} tables to {snapshot_dir}.")
+    return manifest_path
+
+
+def read_manifest(snapshot_dir: Union[str, pathlib.Path]) -> Dict[str, Any]:
+    """
+    Read the manifest of a snapshot, checking that it can be imported.
+
+    Parameters
+    ----------
+    snapshot_dir : Union[str, pathlib.Path]
+        The directory of the snapshot.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The snapshot manifest.
+
+    Raises
+    ------
+    ValueError
+        If the snapshot was written with an unsupported format version.
+    """
+    with open(pathlib.Path(snapshot_dir) / MANIFEST_FILE_NAME) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest["format_version"] != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Snapshot format version {manifest['format_version']} is not supported, "
+                         f"expected version {SNAPSHOT_FORMAT_VERSION}.")
+    return manifest
+
+
+def _to_postgres_array_literal(values) -> Optional[str]:
+    """
+    Format a list of values as a PostgreSQL array literal, to be loaded with COPY.
+
+    Parameters
+    ----------
+    values
+        The list of values, or None.
+
+    Returns
+    -------
+    Optional[str]
+        The array literal, e.g. '{"a","b"}', or None if values is None.
+    """
+    if values is None:
+        return None
+    quoted_values = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'"{value}"' for value in quoted_values) + "}"
+
+
+def _prepare_table_data(table_data: pd.DataFrame, table_name: str) -> pd.DataFrame:
+    """
+    Convert the columns of table data read from a snapshot into values that COPY loads into the table's columns.
+
+    Parameters
+    ----------
+    table_data : pd.DataFrame
+        The table data read from the snapshot.
+    table_name : str
+        The name of the table.
+
+    Returns
+    -------
+    pd.DataFrame
+        The table data, with array columns as PostgreSQL array literals, and integer columns of model tables with
+        nullable integer types.
+    """
+    for column in table_data.columns:
+        non_null_values = table_data[column].dropna()
+        if not non_null_values.empty and isinstance(non_null_values.iloc[0], (list, tuple, np.ndarray)):
+            table_data[column] = table_data[column].map(_to_postgres_array_literal)
+    if table_name in _MODEL_TABLES:
+        # Integer columns with NULL values are read as floats, which COPY will not load into integer columns
+        for column in _MODEL_TABLES[table_name].__table__.columns:
+            if isinstance(column.type, Integer) and column.name in table_data.columns:
+                table_data[column.name] = table_data[column.name].astype("Int64")
+    return table_data
+
+
+def import_table(
+        engine: Engine,
+        snapshot_dir: pathlib.Path,
+        table_name: str,
+        table_entry: Dict[str, Any],
+        overwrite: bool = False) -> int:
+    """
+    Import a table from a snapshot into the database with COPY.
+    Tables that already contain data are skipped, unless overwrite is True, in which case their data is replaced.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    snapshot_dir : pathlib.Path
+        The directory of the snapshot.
+    table_name : str
+        The name of the table to import.
+    table_entry : Dict[str, Any]
+        The manifest entry of the table.
+    overwrite : bool = False
+        Whether to replace the data of tables that already contain data. Defaults to False.
+
+    Returns
+    -------
+    int
+        The number of records imported.
+
+    Raises
+    ------
+    ValueError
+        If the checksum of the table's file does not match the manifest.
+    """
+    table_path = snapshot_dir / table_entry["file"]
+    if _file_sha256(table_path) != table_entry["sha256"]:
+        raise ValueError(f"Snapshot file '{table_entry['file']}' does not match its checksum in the manifest.")
+    if check_table_exists(engine, table_name) and not overwrite:
+        with engine.connect() as conn:
+            if conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM "{table_name}");')).scalar():
+                log.info(f"'{table_name}' data already exists in the database.")
+                return 0
+
+    if table_entry["geometry_column"] is None:
+        table_data = pd.read_parquet(table_path)
+    else:
+        table_data = gpd.read_parquet(table_path)
+    table_data = _prepare_table_data(table_data, table_name)
+    # Create the table if it is missing, with the schema of its model if it has one. Existing tables are only
+    # truncated below, keeping their indexes and the database views that depend on them
+    if table_name in _MODEL_TABLES:
+        create_table(engine, _MODEL_TABLES[table_name])
+    elif not check_table_exists(engine, table_name):
+        if isinstance(table_data, gpd.GeoDataFrame):
+            table_data.iloc[:0].to_postgis(table_name, engine, index=False)
+        else:
+            table_data.iloc[:0].to_sql(table_name, engine, index=False)
+
+    columns = list(table_data.columns)
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    if isinstance(table_data, gpd.GeoDataFrame):
+        csv_buffer = vector_data_to_csv_buffer(table_data, columns)
+    else:
+        csv_buffer = io.StringIO()
+        table_data.to_csv(csv_buffer, header=False, index=False)
+        csv_buffer.seek(0)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE "{table_name}";')
+            cursor.copy_expert(f'COPY "{table_name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', csv_buffer)
+            if "unique_id" in columns:
+                # Continue the ID sequence after the imported records
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%(table_name)s, 'unique_id'), max(unique_id)) "
+                    f'FROM "{table_name}" HAVING max(unique_id) IS NOT NULL;',
+                    {"table_name": table_name})
+            cursor.execute(f'ANALYZE "{table_name}";')
+        connection.commit()
+    finally:
+        connection.close()
+    log.info(f"Imported {len(table_data)} '{table_name}' records.")
+    return len(table_data)
+
+
+def import_snapshot(
+        engine: Engine,
+        snapshot_dir: Union[str, pathlib.Path],
+        overwrite: bool = False,
+        max_workers: int = 4) -> int:
+    """
+    Import all tables of a snapshot into the database, loading several tables at once.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    snapshot_dir : Union[str, pathlib.Path]
+        The directory of the snapshot.
+    overwrite : bool = False
+        Whether to replace the data of tables that already contain data. Defaults to False.
+    max_workers : int = 4
+        The maximum number of tables to import at once. Defaults to 4.
+
+    Returns
+    -------
+    int
+        The total number of records imported.
+    """
+    snapshot_dir = pathlib.Path(snapshot_dir)
+    manifest = read_manifest(snapshot_dir)
+    log.info(f"Importing snapshot '{manifest['snapshot_version']}' from {snapshot_dir}.")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        imported_records = list(executor.map(
+            lambda table: import_table(engine, snapshot_dir, table[0], table[1], overwrite),
+            manifest["tables"].items()))
+    return sum(imported_records)
+
+
+def main() -> None:
+    """
+    Command line interface to export or import a static data snapshot.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the static data tables.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("snapshot_dir", type=pathlib.Path)
+    parser.add_argument("--snapshot-version", help="Version to record in the manifest of an exported snapshot.")
+    parser.add_argument("--overwrite", action="store_true", help="Replace tables that already contain data.")
+    parser.add_argument("--max-workers", type=int, default=4, help="Number of tables to export or import at once.")
+    args = parser.parse_args()
+
+    setup_logging(LogLevel.INFO)
+    start_time = time.perf_counter()
+    engine = setup_environment.get_database()
+    if args.command == "export":
+        export_snapshot(engine, args.snapshot_dir, args.snapshot_version, args.max_workers)
+    else:
+        imported_records = import_snapshot(engine, args.snapshot_dir, args.overwrite, args.max_workers)
+        log.info(f"Imported {imported_records} records.")
+    log.info(f"Finished in {time.perf_counter() - start_time:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,12 @@ This script contains SQLAlchemy models for various database tables and utility f
 from datetime import datetime, timezone
 
 from geoalchemy2 import Geometry
-from sqlalchemy import Boolean, Column, DateTime, inspect, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Float, inspect, Integer, String
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
-from sqlalchemy.schema import CheckConstraint, PrimaryKeyConstraint
+from sqlalchemy.schema import CheckConstraint, Index, PrimaryKeyConstraint
 
 Base = declarative_base()
 
@@ -81,6 +81,62 @@ class UserLogInfo(Base):
     geometry = Column(Geometry("POLYGON", srid=2193))
 
 
+class GeospatialLayerCoverage(Base):
+    """
+    Class representing the 'geospatial_layer_coverage' table.
+    The union of all areas fetched for each non-NZ geospatial layer, maintained from 'user_log_information'.
+
+    Attributes
+    ----------
+    __tablename__ : str
+        Name of the database table.
+    table_name : str
+        Name of the table containing the geospatial layer data (primary key).
+    updated_at : datetime
+        Timestamp indicating when the coverage was last extended.
+    geometry : MultiPolygon
+        Geometric representation of the area covered by the data in the table, with a spatial index.
+    """
+    __tablename__ = "geospatial_layer_coverage"
+    table_name = Column(String, primary_key=True, comment="table containing the geospatial layer data")
+    updated_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc),
+                        comment="coverage updated datetime")
+    geometry = Column(Geometry("MULTIPOLYGON", srid=2193, spatial_index=True))
+
+
+class HirdsIngestProgress(Base):
+    """
+    Class representing the 'hirds_ingest_progress' table.
+    Records which rainfall sites have been ingested from HIRDS by the nationwide ingest, so that it can resume after
+    being interrupted, and which sites have failed.
+
+    Attributes
+    ----------
+    __tablename__ : str
+        Name of the database table.
+    table_name : str
+        Name of the rainfall data table the site is ingested into (primary key).
+    site_id : str
+        HIRDS rainfall site ID (primary key).
+    status : str
+        Whether the ingest of the site is "done" or "failed".
+    attempts : int
+        Number of times the ingest of the site has been attempted.
+    error : str
+        The error of the last failed attempt, if any.
+    updated_at : datetime
+        Timestamp indicating when the site was last attempted.
+    """
+    __tablename__ = "hirds_ingest_progress"
+    table_name = Column(String, primary_key=True, comment="rainfall data table the site is ingested into")
+    site_id = Column(String, primary_key=True, comment="HIRDS rainfall site ID")
+    status = Column(String, nullable=False, comment="'done' or 'failed'")
+    attempts = Column(Integer, nullable=False, default=1, comment="number of ingest attempts")
+    error = Column(String, comment="error of the last failed attempt")
+    updated_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc),
+                        comment="last attempted datetime")
+
+
 class RiverNetworkExclusions(Base):
     """
     Class representing the 'rec_network_exclusions' table.
@@ -166,6 +222,57 @@ class BGFloodModelOutput(Base):
     geometry = Column(Geometry("POLYGON", srid=2193))
 
 
+class FloodModelCache(Base):
+    """
+    Class representing the 'flood_model_cache' table.
+    Maps a hash of the inputs used to generate a flood model to the flood model output produced from them.
+
+    Attributes
+    ----------
+    __tablename__ : str
+        Name of the database table.
+    cache_key : str
+        Hash of the area of interest, module parameters and scenario options of the flood model (primary key).
+    flood_model_id : int
+        Foreign key matching the unique_id from bg_flood_model_output table.
+    created_at : datetime
+        Timestamp indicating when the cache entry was created.
+    """
+    __tablename__ = "flood_model_cache"
+    cache_key = Column(String, primary_key=True, comment="hash of the inputs used to generate the flood model")
+    flood_model_id = Column(Integer, comment="The flood model id matching from bg_flood_model_output table")
+    created_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc), comment="cache created datetime")
+
+
+class SeaLevelRiseParameters(Base):
+    """
+    Class representing the 'sea_level_rise_parameters' table.
+    Catalogue of the valid sea level rise parameters for each confidence level, precomputed from the
+    'sea_level_rise' table.
+
+    Attributes
+    ----------
+    __tablename__ : str
+        Name of the database table.
+    confidence_level : str
+        The confidence level of the sea level rise data (primary key).
+    ssp_scenarios : List[str]
+        The valid Shared Socioeconomic Pathways (SSP) scenarios for the confidence level, e.g. 'SSP1-2.6'.
+    percentiles : List[int]
+        The valid percentiles of the sea level rise data.
+    max_year : int
+        The latest year of the sea level rise projections for the confidence level.
+    created_at : datetime
+        Timestamp indicating when the catalogue entry was created.
+    """
+    __tablename__ = "sea_level_rise_parameters"
+    confidence_level = Column(String, primary_key=True, comment="confidence level of the sea level rise data")
+    ssp_scenarios = Column(ARRAY(String), comment="valid SSP scenarios for the confidence level")
+    percentiles = Column(ARRAY(Integer), comment="valid percentiles of the sea level rise data")
+    max_year = Column(Integer, comment="latest projection year for the confidence level")
+    created_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc), comment="entry created datetime")
+
+
 class BuildingFloodStatus(Base):
     """
     Class representing the 'building_flood_status' table.
@@ -181,6 +288,16 @@ class BuildingFloodStatus(Base):
         Foreign key building outline id matching from nz_building_outlines table
     is_flooded : bool
         If the building is flooded or not
+    max_depth : float
+        The maximum flood depth in m under the building
+    mean_depth : float
+        The mean flood depth in m under the building
+    flooded_fraction : float
+        The fraction of the building's area that is flooded
+    peak_time : float
+        The time in s when the building first reaches its maximum flood depth
+    first_inundation_time : float
+        The time in s when the building is first flooded
     flood_model_id: int.
         Foreign key mathing the unique_id from bg_flood_model_output table
     """
@@ -188,8 +305,17 @@ class BuildingFloodStatus(Base):
     unique_id = Column(Integer, primary_key=True, autoincrement=True)
     building_outline_id = Column(Integer, comment="The building outline id matching from nz_building_outlines table")
     is_flooded = Column(Boolean, comment="If the building is flooded or not")
+    max_depth = Column(Float, comment="The maximum flood depth in m under the building")
+    mean_depth = Column(Float, comment="The mean flood depth in m under the building")
+    flooded_fraction = Column(Float, comment="The fraction of the building's area that is flooded")
+    peak_time = Column(Float, comment="The time in s when the building first reaches its maximum flood depth")
+    first_inundation_time = Column(Float, comment="The time in s when the building is first flooded")
     flood_model_id = Column(Integer)
 
+    __table_args__ = (
+        Index("building_flood_status_model_building_idx", "flood_model_id", "building_outline_id"),
+    )
+
 
 def create_table(engine: Engine, table: Base) -> None:
     """
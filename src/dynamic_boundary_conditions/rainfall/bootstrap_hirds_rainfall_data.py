@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+This script stores the rainfall depth and intensity data of every HIRDS rainfall site in New Zealand in the database,
+so that requests for new catchment areas never have to wait for HIRDS. Progress is recorded in the
+'hirds_ingest_progress' table, so the script can be run again to resume after being interrupted.
+Run with `python -m src.dynamic_boundary_conditions.rainfall.bootstrap_hirds_rainfall_data`.
+"""
+
+import logging
+import time
+
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import text
+
+from src.digitaltwin import setup_environment
+from src.digitaltwin.utils import LogLevel, setup_logging
+from src.dynamic_boundary_conditions.rainfall import hirds_rainfall_data_to_db, rainfall_data_from_hirds, rainfall_sites
+
+log = logging.getLogger(__name__)
+
+# The name of the advisory lock held while ingesting, so that only one ingest runs at a time
+HIRDS_INGEST_LOCK_NAME = "hirds_ingest"
+
+
+class HirdsIngestRunningError(Exception):
+    """Exception raised when the HIRDS rainfall data is ingested while another ingest is already running."""
+    pass
+
+
+def try_lock_hirds_ingest(connection: Connection) -> bool:
+    """
+    Try to take the HIRDS ingest advisory lock for the session of a connection, without waiting for it.
+    The lock is released when the connection's session ends, even if the process holding it dies.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection whose session holds the lock.
+
+    Returns
+    -------
+    bool
+        True if the lock was taken, False if another session holds it.
+    """
+    query = text("SELECT pg_try_advisory_lock(hashtext(:lock_name));").bindparams(lock_name=HIRDS_INGEST_LOCK_NAME)
+    return bool(connection.execute(query).scalar())
+
+
+def unlock_hirds_ingest(connection: Connection) -> None:
+    """
+    Release the HIRDS ingest advisory lock held by the session of a connection.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection whose session holds the lock.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    connection.execute(text("SELECT pg_advisory_unlock(hashtext(:lock_name));").bindparams(
+        lock_name=HIRDS_INGEST_LOCK_NAME))
+
+
+def is_hirds_ingest_running(engine: Engine) -> bool:
+    """
+    Check whether the HIRDS rainfall data is being ingested, by another process or thread.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    bool
+        True if an ingest holds the HIRDS ingest lock, otherwise False.
+    """
+    with engine.connect() as connection:
+        if not try_lock_hirds_ingest(connection):
+            return True
+        unlock_hirds_ingest(connection)
+    return False
+
+
+def ingest_all_hirds_rainfall_data(
+        engine: Engine,
+        batch_size: int = hirds_rainfall_data_to_db.HIRDS_INGEST_BATCH_SIZE,
+        max_concurrent_requests: int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS) -> None:
+    """
+    Stores the rainfall sites, then the rainfall depth and intensity data of every site that is not yet in the
+    database. Only one ingest runs at a time.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    batch_size : int = hirds_rainfall_data_to_db.HIRDS_INGEST_BATCH_SIZE
+        The number of sites fetched and stored together.
+    max_concurrent_requests : int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS
+        The maximum number of requests sent to HIRDS at once.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+
+    Raises
+    ------
+    HirdsIngestRunningError
+        If another ingest of the HIRDS rainfall data is already running.
+    """
+    # Hold the ingest lock on its own connection for the whole ingest
+    with engine.connect() as lock_connection:
+        if not try_lock_hirds_ingest(lock_connection):
+            raise HirdsIngestRunningError("An ingest of the HIRDS rainfall data is already running.")
+        try:
+            # Store the rainfall sites data in the database, if not already stored
+            rainfall_sites.rainfall_sites_to_db(engine)
+            # Store the rainfall depth data, used by the flood model, before the rainfall intensity data
+            for idf in (False, True):
+                hirds_rainfall_data_to_db.all_sites_rainfall_data_to_db(
+                    engine, idf, batch_size, max_concurrent_requests)
+        finally:
+            unlock_hirds_ingest(lock_connection)
+
+
+def main(
+        batch_size: int = hirds_rainfall_data_to_db.HIRDS_INGEST_BATCH_SIZE,
+        max_concurrent_requests: int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS,
+        log_level: LogLevel = LogLevel.INFO) -> None:
+    """
+    Stores the rainfall depth and intensity data of every HIRDS rainfall site in the database, logging the time taken.
+
+    Parameters
+    ----------
+    batch_size : int = hirds_rainfall_data_to_db.HIRDS_INGEST_BATCH_SIZE
+        The number of sites fetched and stored together.
+    max_concurrent_requests : int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS
+        The maximum number of requests sent to HIRDS at once.
+    log_level : LogLevel = LogLevel.INFO
+        The log level to set for the root logger. Defaults to LogLevel.INFO.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    # Set up logging with the specified log level
+    setup_logging(log_level)
+    start_time = time.perf_counter()
+    # Connect to the database
+    engine = setup_environment.get_database()
+    ingest_all_hirds_rainfall_data(engine, batch_size, max_concurrent_requests)
+    log.info(f"Ingested HIRDS rainfall data in {time.perf_counter() - start_time:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,10 @@ Retrieve all rainfall data for sites within the catchment area from the database
 """
 
 import logging
-from typing import Optional
+from typing import List, Optional, Sequence, Union
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import text
@@ -39,30 +40,32 @@ def filter_for_duration(rain_data: pd.DataFrame, duration: str) -> pd.DataFrame:
     return rain_data
 
 
-def get_one_site_rainfall_data(
+def get_sites_rainfall_data(
         engine: Engine,
-        site_id: str,
+        site_ids: List[str],
         rcp: Optional[float],
         time_period: Optional[str],
-        ari: float,
+        aris: Sequence[float],
         duration: str,
         idf: bool) -> pd.DataFrame:
     """
-    Retrieve rainfall data from the database for the requested site based on the user-requested scenario.
+    Retrieve rainfall data from the database for the requested sites and ARIs based on the user-requested scenario,
+    within a single query.
 
     Parameters
     ----------
     engine : Engine
         The engine used to connect to the database.
-    site_id : str
-        HIRDS rainfall site ID.
+    site_ids : List[str]
+        HIRDS rainfall site IDs.
     rcp : Optional[float]
         Representative Concentration Pathway (RCP) value. Valid options are 2.6, 4.5, 6.0, 8.5, or None
         for historical data.
     time_period : Optional[str]
         Future time period. Valid options are "2031-2050", "2081-2100", or None for historical data.
-    ari : float
-        Average Recurrence Interval (ARI) value. Valid options are 1.58, 2, 5, 10, 20, 30, 40, 50, 60, 80, 100, or 250.
+    aris : Sequence[float]
+        Average Recurrence Interval (ARI) values. Valid options are 1.58, 2, 5, 10, 20, 30, 40, 50, 60, 80, 100,
+        or 250.
     duration : str
         Storm duration. Valid options are: '10m', '20m', '30m', '1h', '2h', '6h', '12h', '24h', '48h', '72h',
         '96h', '120h', or 'all'.
@@ -72,7 +75,8 @@ def get_one_site_rainfall_data(
     Returns
     -------
     pd.DataFrame
-        Rainfall data for the requested site based on the user-requested scenario.
+        Rainfall data for the requested sites and ARIs based on the user-requested scenario, ordered by site in the
+        order requested, then by ARI in the order requested.
 
     Raises
     ------
@@ -81,52 +85,84 @@ def get_one_site_rainfall_data(
     """
     # Get the relevant rainfall data table name from the idf parameter
     rain_table_name = hirds_rainfall_data_to_db.db_rain_table_name(idf)
-    log.info(f"Retrieving the requested '{rain_table_name}' scenario data for site {site_id} from the database.")
+    log.info(f"Retrieving the requested '{rain_table_name}' scenario data for {len(site_ids)} sites from the database.")
     # Check for inconsistent rcp and time_period arguments
     if (rcp is None and time_period is not None) or (rcp is not None and time_period is None):
         raise ValueError("Inconsistent arguments provided. "
                          "For historical data, both 'rcp' and 'time_period' should be None. "
                          "If 'rcp' is None, 'time_period' should also be None, and vice versa.")
     elif rcp is not None and time_period is not None:
-        # Query for specific rcp and time_period
-        command_text = f"""
-        SELECT *
-        FROM {rain_table_name}
-        WHERE site_id=:site_id AND rcp=:rcp AND time_period=:time_period AND ari=:ari
-        """
-        query = text(command_text).bindparams(
-            site_id=site_id,
-            rcp=rcp,
-            time_period=time_period,
-            ari=ari
-        )
-        rain_data = pd.read_sql_query(query, engine)
-
+        # Filter for specific rcp and time_period
+        scenario_filter = "rcp=:rcp AND time_period=:time_period"
+        scenario_params = {"rcp": rcp, "time_period": time_period}
     else:
-        # Query for historical data (rcp is None and time_period is None)
-        command_text = f"""
-        SELECT *
-        FROM {rain_table_name}
-        WHERE site_id=:site_id AND rcp IS NULL AND time_period IS NULL AND ari=:ari
-        """
-        query = text(command_text).bindparams(
-            site_id=site_id,
-            ari=ari
-        )
-        rain_data = pd.read_sql_query(query, engine)
-        # Filter for historical data
-        rain_data.query("category == 'hist'", inplace=True)
+        # Filter for historical data (rcp is None and time_period is None)
+        scenario_filter = "rcp IS NULL AND time_period IS NULL AND category='hist'"
+        scenario_params = {}
+    # Filters on the columns of the composite index on (site_id, rcp, time_period, ari)
+    command_text = f"""
+    SELECT *
+    FROM {rain_table_name}
+    WHERE site_id = ANY(CAST(:site_ids AS text[])) AND {scenario_filter} AND ari = ANY(CAST(:aris AS float8[]))
+    ORDER BY array_position(CAST(:site_ids AS text[]), site_id), array_position(CAST(:aris AS float8[]), ari);
+    """
+    query = text(command_text).bindparams(site_ids=list(site_ids), aris=[float(ari) for ari in aris],
+                                          **scenario_params)
+    rain_data = pd.read_sql_query(query, engine)
     # Filter for duration
     rain_data = filter_for_duration(rain_data, duration)
     return rain_data
 
 
+def get_one_site_rainfall_data(
+        engine: Engine,
+        site_id: str,
+        rcp: Optional[float],
+        time_period: Optional[str],
+        ari: float,
+        duration: str,
+        idf: bool) -> pd.DataFrame:
+    """
+    Retrieve rainfall data from the database for the requested site based on the user-requested scenario.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    site_id : str
+        HIRDS rainfall site ID.
+    rcp : Optional[float]
+        Representative Concentration Pathway (RCP) value. Valid options are 2.6, 4.5, 6.0, 8.5, or None
+        for historical data.
+    time_period : Optional[str]
+        Future time period. Valid options are "2031-2050", "2081-2100", or None for historical data.
+    ari : float
+        Average Recurrence Interval (ARI) value. Valid options are 1.58, 2, 5, 10, 20, 30, 40, 50, 60, 80, 100, or 250.
+    duration : str
+        Storm duration. Valid options are: '10m', '20m', '30m', '1h', '2h', '6h', '12h', '24h', '48h', '72h',
+        '96h', '120h', or 'all'.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+
+    Returns
+    -------
+    pd.DataFrame
+        Rainfall data for the requested site based on the user-requested scenario.
+
+    Raises
+    ------
+    ValueError
+        If rcp and time_period arguments are inconsistent.
+    """
+    return get_sites_rainfall_data(engine, [site_id], rcp, time_period, [ari], duration, idf)
+
+
 def rainfall_data_from_db(
         engine: Engine,
         sites_in_catchment: gpd.GeoDataFrame,
         rcp: Optional[float],
         time_period: Optional[str],
-        ari: float,
+        ari: Union[float, Sequence[float], np.ndarray],
         idf: bool = False,
         duration: str = "all") -> pd.DataFrame:
     """
@@ -143,8 +179,9 @@ def rainfall_data_from_db(
         for historical data.
     time_period : Optional[str]
         Future time period. Valid options are "2031-2050", "2081-2100", or None for historical data.
-    ari : float
+    ari : Union[float, Sequence[float], np.ndarray]
         Average Recurrence Interval (ARI) value. Valid options are 1.58, 2, 5, 10, 20, 30, 40, 50, 60, 80, 100, or 250.
+        Several ARI values can be given to retrieve the data of all of them at once, e.g. for a sweep of scenarios.
     idf : bool = False
         Set to False for rainfall depth data, and True for rainfall intensity data.
     duration : str = "all"
@@ -159,12 +196,9 @@ def rainfall_data_from_db(
     """
     # Get the site IDs within the catchment area
     site_ids_in_catchment = hirds_rainfall_data_to_db.get_site_ids_in_catchment(sites_in_catchment)
-    # Initialize an empty DataFrame to store the rainfall data
-    rain_data_in_catchment = pd.DataFrame()
-    # Iterate over each site ID in the catchment area
-    for site_id in site_ids_in_catchment:
-        # Retrieve the rainfall data for the site
-        rain_data = get_one_site_rainfall_data(engine, site_id, rcp, time_period, ari, duration, idf)
-        # Concatenate the site's rainfall data to the overall catchment data
-        rain_data_in_catchment = pd.concat([rain_data_in_catchment, rain_data], ignore_index=True)
+    # Accept a single ARI, or any sequence or array of ARIs
+    aris = np.atleast_1d(ari).astype(float).tolist()
+    # Retrieve the rainfall data for all sites in the catchment area at once
+    rain_data_in_catchment = get_sites_rainfall_data(
+        engine, site_ids_in_catchment, rcp, time_period, aris, duration, idf)
     return rain_data_in_catchment
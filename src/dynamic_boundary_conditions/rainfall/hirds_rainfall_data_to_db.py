@@ -3,18 +3,27 @@
 Store the rainfall data for all the sites within the catchment area in the database.
 """
 
+import io
 import logging
-from typing import List
+from typing import List, Optional
 
 import pandas as pd
 import geopandas as gpd
 from sqlalchemy.engine import Engine
+from sqlalchemy.sql import text
 
+from src import config
 from src.digitaltwin import tables
 from src.dynamic_boundary_conditions.rainfall import rainfall_data_from_hirds
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
+# Number of sites fetched and stored together by the nationwide ingest, progress is recorded after each batch
+HIRDS_INGEST_BATCH_SIZE = config.get_env_variable("HIRDS_INGEST_BATCH_SIZE", default=50, cast_to=int)
+# Number of times the nationwide ingest attempts a site before skipping it in later runs
+HIRDS_INGEST_MAX_ATTEMPTS = config.get_env_variable("HIRDS_INGEST_MAX_ATTEMPTS", default=3, cast_to=int)
+
 
 def db_rain_table_name(idf: bool) -> str:
     """
@@ -85,16 +94,21 @@ def get_site_ids_not_in_db(engine: Engine, site_ids_in_catchment: List[str], idf
     return site_ids_not_in_db
 
 
-def add_rainfall_data_to_db(engine: Engine, site_id: str, idf: bool) -> None:
+def create_rainfall_data_table(engine: Engine, rain_data: pd.DataFrame, idf: bool) -> None:
     """
-    Store the rainfall data for a specific site in the database.
+    Create the relevant rainfall data table if it does not already exist, together with a unique index identifying
+    each row by site, category, RCP, time period and ARI, so that storing the data of a site again does not duplicate
+    it, and a composite index on (site_id, rcp, time_period, ari), so that the scenario data of many sites can be
+    retrieved in a single query. Tables created before the indexes existed are given them, with duplicate rows,
+    e.g. from loads that were interrupted and retried, removed first. Concurrent calls are serialised with a
+    transaction-level advisory lock, so only one of them creates the table and indexes.
 
     Parameters
     ----------
     engine : Engine
         The engine used to connect to the database.
-    site_id : str
-        HIRDS rainfall site ID.
+    rain_data : pd.DataFrame
+        Rainfall data in tabular format, whose columns the table is created with.
     idf : bool
         Set to False for rainfall depth data, and True for rainfall intensity data.
 
@@ -105,24 +119,145 @@ def add_rainfall_data_to_db(engine: Engine, site_id: str, idf: bool) -> None:
     """
     # Get the relevant rainfall data table name from the idf parameter
     rain_table_name = db_rain_table_name(idf)
-    # Retrieve the rainfall data for the specified site from HIRDS
-    log.info(f"Fetching '{rain_table_name}' data for site {site_id} from the HIRDS website https://hirds.niwa.co.nz/.")
-    site_data = rainfall_data_from_hirds.get_data_from_hirds(site_id, idf)
+    index_name = f"{rain_table_name}_scenario_key"
+    scenario_index_name = f"{rain_table_name}_site_id_rcp_time_period_ari_idx"
+    with engine.begin() as conn:
+        # Held until the transaction ends, so other tasks wait here and then see the table created by this one
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table_name));"), {"table_name": rain_table_name})
+        table_exists = conn.execute(
+            text("SELECT to_regclass(:table_name) IS NOT NULL;"), {"table_name": rain_table_name}).scalar()
+        if not table_exists:
+            conn.execute(text(pd.io.sql.get_schema(rain_data.iloc[:0], rain_table_name, con=conn)))
+        index_exists = conn.execute(
+            text("SELECT to_regclass(:index_name) IS NOT NULL;"), {"index_name": index_name}).scalar()
+        if not index_exists:
+            # Keep one row for each scenario, rcp and time_period are NULL for historical data
+            conn.execute(text(f"""
+            DELETE FROM {rain_table_name} AS a
+            USING {rain_table_name} AS b
+            WHERE a.site_id = b.site_id AND a.category = b.category AND a.ari = b.ari
+            AND a.rcp IS NOT DISTINCT FROM b.rcp AND a.time_period IS NOT DISTINCT FROM b.time_period
+            AND a.ctid > b.ctid;
+            """))
+            # NULLs are never equal in a unique index, so index them as placeholder values
+            conn.execute(text(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS {index_name}
+            ON {rain_table_name} (site_id, category, COALESCE(rcp, -1), COALESCE(time_period, ''), ari);
+            """))
+        # Checked first, so that the table is only locked against writes when the index is actually created
+        scenario_index_exists = conn.execute(
+            text("SELECT to_regclass(:index_name) IS NOT NULL;"), {"index_name": scenario_index_name}).scalar()
+        if not scenario_index_exists:
+            conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {scenario_index_name}
+            ON {rain_table_name} (site_id, rcp, time_period, ari);
+            """))
+
+
+def get_site_rainfall_data(site_id: str, site_data: str) -> Optional[pd.DataFrame]:
+    """
+    Convert all blocks of the rainfall data fetched from HIRDS for a specific site into a single Pandas DataFrame.
+
+    Parameters
+    ----------
+    site_id : str
+        HIRDS rainfall site ID.
+    site_data : str
+        Fetched rainfall data text string from the HIRDS website for the site.
+
+    Returns
+    -------
+    Optional[pd.DataFrame]
+        Rainfall data for the site in tabular format, or None if no blocks of data could be found for the site.
+    """
     # Extract the layout structure of the data
     layout_structure = rainfall_data_from_hirds.get_layout_structure_of_data(site_data)
+    if not layout_structure:
+        log.warning(f"No rainfall data found in the HIRDS response for site {site_id}, skipping it.")
+        return None
+    # Convert each block of the data to a tabular format
+    rain_data_blocks = [
+        rainfall_data_from_hirds.convert_to_tabular_data(site_data, site_id, block_structure)
+        for block_structure in layout_structure
+    ]
+    return pd.concat(rain_data_blocks, ignore_index=True)
 
-    log.info(f"Adding '{rain_table_name}' data for site {site_id} to the database.")
-    # Iterate over each block structure in the layout structure
-    for block_structure in layout_structure:
-        # Convert the data to a tabular format
-        rain_data = rainfall_data_from_hirds.convert_to_tabular_data(site_data, site_id, block_structure)
-        # Store the tabular data in the relevant rainfall data table in the database
-        rain_data.to_sql(rain_table_name, engine, index=False, if_exists="append")
 
+def copy_rainfall_data_to_db(engine: Engine, rain_data: pd.DataFrame, idf: bool) -> int:
+    """
+    Bulk load rainfall data into the relevant rainfall data table with a single COPY in one transaction, through a
+    staging table so that rows already in the table are skipped by the database.
 
-def add_each_site_rainfall_data(engine: Engine, site_ids_list: List[str], idf: bool) -> None:
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    rain_data : pd.DataFrame
+        Rainfall data of one or more sites in tabular format.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+
+    Returns
+    -------
+    int
+        The number of new rows added to the table.
+    """
+    # Get the relevant rainfall data table name from the idf parameter
+    rain_table_name = db_rain_table_name(idf)
+    # Create the table and its unique index if they do not exist yet
+    create_rainfall_data_table(engine, rain_data, idf)
+    csv_buffer = io.StringIO()
+    rain_data.to_csv(csv_buffer, index=False, header=False)
+    csv_buffer.seek(0)
+    # Duration column names such as "10m" must be quoted
+    column_list = ", ".join(f'"{column}"' for column in rain_data.columns)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE staging ON COMMIT DROP AS SELECT {column_list} FROM {rain_table_name} LIMIT 0;")
+            cursor.copy_expert(f"COPY staging ({column_list}) FROM STDIN WITH (FORMAT csv)", csv_buffer)
+            cursor.execute(f"""
+            INSERT INTO {rain_table_name} ({column_list})
+            SELECT {column_list} FROM staging
+            ON CONFLICT DO NOTHING;
+            """)
+            new_rows = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+    return new_rows
+
+
+def add_rainfall_data_to_db(engine: Engine, site_id: str, idf: bool) -> None:
+    """
+    Store the rainfall data for a specific site in the database.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    site_id : str
+        HIRDS rainfall site ID.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    add_each_site_rainfall_data(engine, [site_id], idf)
+
+
+def add_each_site_rainfall_data(
+        engine: Engine,
+        site_ids_list: List[str],
+        idf: bool,
+        max_concurrent_requests: int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS) -> None:
     """
     Add rainfall data for each site in the site_ids_list to the database.
+    The data of all sites is fetched from HIRDS concurrently, then stored together in a single transaction.
 
     Parameters
     ----------
@@ -132,16 +267,34 @@ def add_each_site_rainfall_data(engine: Engine, site_ids_list: List[str], idf: b
         List of rainfall sites' IDs.
     idf : bool
         Set to False for rainfall depth data, and True for rainfall intensity data.
+    max_concurrent_requests : int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS
+        The maximum number of requests sent to HIRDS at once.
 
     Returns
     -------
     None
         This function does not return any value.
     """
-    for site_id in site_ids_list:
-        add_rainfall_data_to_db(engine, site_id, idf)
+    rain_table_name = db_rain_table_name(idf)
+    log.info(f"Fetching '{rain_table_name}' data for {len(site_ids_list)} sites from the HIRDS website "
+             f"https://hirds.niwa.co.nz/.")
+    sites_data = rainfall_data_from_hirds.get_data_from_hirds_for_sites(site_ids_list, idf, max_concurrent_requests)
+    # Skip sites without any data, so that they do not stop the other sites from being stored
+    sites_rain_data = []
+    for site_id, site_data in sites_data.items():
+        site_rain_data = get_site_rainfall_data(site_id, site_data)
+        if site_rain_data is not None:
+            sites_rain_data.append(site_rain_data)
+    if not sites_rain_data:
+        log.warning(f"No '{rain_table_name}' data found for any of the {len(site_ids_list)} sites.")
+        return
+    rain_data = pd.concat(sites_rain_data, ignore_index=True)
+    log.info(f"Adding '{rain_table_name}' data for {len(site_ids_list)} sites to the database.")
+    new_rows = copy_rainfall_data_to_db(engine, rain_data, idf)
+    log.info(f"Added {new_rows} rows of '{rain_table_name}' data to the database.")
 
 
+@track_stage("rainfall_data_to_db")
 def rainfall_data_to_db(engine: Engine, sites_in_catchment: gpd.GeoDataFrame, idf: bool = False) -> None:
     """
     Store rainfall data of all the sites within the catchment area in the database.
@@ -181,3 +334,171 @@ def rainfall_data_to_db(engine: Engine, sites_in_catchment: gpd.GeoDataFrame, id
             add_each_site_rainfall_data(engine, site_ids_in_catchment, idf)
         else:
             log.info("No rainfall sites found within the requested catchment area.")
+
+
+def get_all_rainfall_site_ids(engine: Engine) -> List[str]:
+    """
+    Get the IDs of all HIRDS rainfall sites in New Zealand from the 'rainfall_sites' table.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    List[str]
+        The IDs of all rainfall sites, in order.
+    """
+    site_ids = pd.read_sql_query("SELECT site_id FROM rainfall_sites ORDER BY site_id;", engine)
+    return site_ids["site_id"].tolist()
+
+
+def get_site_ids_to_ingest(engine: Engine, site_ids: List[str], idf: bool) -> List[str]:
+    """
+    Get the rainfall site IDs that the nationwide ingest still has to store in the database.
+    Sites whose data is already in the database are left out, as are sites that have failed too many times.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    site_ids : List[str]
+        The IDs of all rainfall sites to ingest.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+
+    Returns
+    -------
+    List[str]
+        The IDs of the rainfall sites still to ingest, in the order given.
+    """
+    rain_table_name = db_rain_table_name(idf)
+    pending_site_ids = set(site_ids)
+    if tables.check_table_exists(engine, rain_table_name):
+        pending_site_ids = set(get_site_ids_not_in_db(engine, site_ids, idf))
+    query = text(f"""
+    SELECT site_id
+    FROM {tables.HirdsIngestProgress.__tablename__}
+    WHERE table_name = :table_name AND status = 'failed' AND attempts >= :max_attempts;
+    """).bindparams(table_name=rain_table_name, max_attempts=HIRDS_INGEST_MAX_ATTEMPTS)
+    abandoned_site_ids = set(pd.read_sql_query(query, engine)["site_id"])
+    if abandoned_site_ids & pending_site_ids:
+        log.warning(f"Skipping {len(abandoned_site_ids & pending_site_ids)} '{rain_table_name}' sites that failed "
+                    f"{HIRDS_INGEST_MAX_ATTEMPTS} times: {sorted(abandoned_site_ids & pending_site_ids)}.")
+    return [site_id for site_id in site_ids if site_id in pending_site_ids - abandoned_site_ids]
+
+
+def record_ingest_progress(
+        engine: Engine,
+        site_ids: List[str],
+        idf: bool,
+        status: str,
+        error: Optional[str] = None) -> None:
+    """
+    Record the outcome of the nationwide ingest of rainfall sites in the 'hirds_ingest_progress' table.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    site_ids : List[str]
+        The IDs of the rainfall sites attempted.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+    status : str
+        Whether the ingest of the sites is "done" or "failed".
+    error : Optional[str] = None
+        The error the ingest failed with, if any.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    progress_table_name = tables.HirdsIngestProgress.__tablename__
+    query = text(f"""
+    INSERT INTO {progress_table_name} (table_name, site_id, status, attempts, error, updated_at)
+    VALUES (:table_name, :site_id, :status, 1, :error, now())
+    ON CONFLICT (table_name, site_id) DO UPDATE
+    SET status = EXCLUDED.status, attempts = {progress_table_name}.attempts + 1, error = EXCLUDED.error,
+        updated_at = EXCLUDED.updated_at;
+    """)
+    rain_table_name = db_rain_table_name(idf)
+    with engine.begin() as conn:
+        conn.execute(query, [
+            {"table_name": rain_table_name, "site_id": site_id, "status": status, "error": error}
+            for site_id in site_ids
+        ])
+
+
+def ingest_site_batch(engine: Engine, site_ids: List[str], idf: bool, max_concurrent_requests: int) -> None:
+    """
+    Store the rainfall data of a batch of sites in the database for the nationwide ingest, recording the outcome.
+    If the batch fails, each site is retried on its own, so that one failing site does not hold back the others.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    site_ids : List[str]
+        The IDs of the rainfall sites in the batch.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+    max_concurrent_requests : int
+        The maximum number of requests sent to HIRDS at once.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    try:
+        add_each_site_rainfall_data(engine, site_ids, idf, max_concurrent_requests)
+    except Exception as error:  # Any failure is recorded, so that the ingest can continue with the other sites
+        if len(site_ids) > 1:
+            log.warning(f"Failed to ingest a batch of {len(site_ids)} sites ({error!r}), retrying each site.")
+            for site_id in site_ids:
+                ingest_site_batch(engine, [site_id], idf, max_concurrent_requests)
+        else:
+            log.error(f"Failed to ingest site {site_ids[0]}: {error!r}")
+            record_ingest_progress(engine, site_ids, idf, "failed", repr(error))
+        return
+    record_ingest_progress(engine, site_ids, idf, "done")
+
+
+@track_stage("all_sites_rainfall_data_to_db")
+def all_sites_rainfall_data_to_db(
+        engine: Engine,
+        idf: bool = False,
+        batch_size: int = HIRDS_INGEST_BATCH_SIZE,
+        max_concurrent_requests: int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS) -> None:
+    """
+    Store rainfall data of every HIRDS rainfall site in New Zealand in the database, so that requests never have to
+    wait for HIRDS. Progress is recorded after each batch of sites, so an interrupted ingest resumes where it stopped.
+    Requires the 'rainfall_sites' table.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    idf : bool = False
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+    batch_size : int = HIRDS_INGEST_BATCH_SIZE
+        The number of sites fetched and stored together.
+    max_concurrent_requests : int = rainfall_data_from_hirds.HIRDS_MAX_CONCURRENT_REQUESTS
+        The maximum number of requests sent to HIRDS at once.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    rain_table_name = db_rain_table_name(idf)
+    tables.create_table(engine, tables.HirdsIngestProgress)
+    site_ids = get_site_ids_to_ingest(engine, get_all_rainfall_site_ids(engine), idf)
+    log.info(f"Ingesting '{rain_table_name}' data for {len(site_ids)} sites from the HIRDS website.")
+    for batch_start in range(0, len(site_ids), batch_size):
+        ingest_site_batch(engine, site_ids[batch_start:batch_start + batch_size], idf, max_concurrent_requests)
+        log.info(f"Ingested '{rain_table_name}' data for "
+                 f"{min(batch_start + batch_size, len(site_ids))}/{len(site_ids)} sites.")
@@ -3,7 +3,7 @@
 Get hyetograph data and generate interactive hyetograph plots for sites located within the catchment area.
 """
 
-from typing import Union
+from typing import List, Tuple, Union
 from math import floor, ceil
 
 import pandas as pd
@@ -12,6 +12,30 @@ from scipy.interpolate import interp1d
 import plotly.express as px
 
 from src.dynamic_boundary_conditions.rainfall.rainfall_enum import HyetoMethod
+from src.pipeline_metrics import track_stage
+
+
+def get_duration_mins(column_name: str) -> Union[str, int]:
+    """
+    Convert the name of a HIRDS storm duration column to the duration in minutes.
+
+    Parameters
+    ----------
+    column_name : str
+        The column name, e.g. '10m' or '24h'.
+
+    Returns
+    -------
+    Union[str, int]
+        The duration in minutes, or the column name unchanged if it is not a duration column.
+    """
+    # Convert duration column names in minutes (text) to duration in minutes (integer)
+    if column_name.endswith("m"):
+        return int(column_name[:-1])
+    # Convert duration column names in hours (text) to duration in minutes (integer)
+    if column_name.endswith("h"):
+        return int(column_name[:-1]) * 60
+    return column_name
 
 
 def get_transposed_data(rain_depth_in_catchment: pd.DataFrame) -> pd.DataFrame:
@@ -32,13 +56,7 @@ def get_transposed_data(rain_depth_in_catchment: pd.DataFrame) -> pd.DataFrame:
     # Drop unnecessary columns
     catchment_data = rain_depth_in_catchment.drop(columns=["category", "rcp", "time_period", "ari", "aep"])
     # Convert duration column names from text to duration columns in minutes
-    for index, column_name in enumerate(catchment_data.columns):
-        # Convert duration column names in minutes (text) to duration columns in minutes (integer)
-        if column_name.endswith("m"):
-            catchment_data.columns.values[index] = int(column_name[:-1])
-        # Convert duration column names in hours (text) to duration columns in minutes (integer)
-        elif column_name.endswith("h"):
-            catchment_data.columns.values[index] = int(column_name[:-1]) * 60
+    catchment_data = catchment_data.rename(columns=get_duration_mins)
     # Transpose the DataFrame
     transposed_catchment_data = (
         catchment_data.set_index("site_id").rename_axis("").transpose().rename_axis("duration_mins").reset_index()
@@ -46,6 +64,58 @@ def get_transposed_data(rain_depth_in_catchment: pd.DataFrame) -> pd.DataFrame:
     return transposed_catchment_data
 
 
+def interpolate_site_depths(
+        duration_mins: np.ndarray,
+        depths: np.ndarray,
+        increment_mins: int,
+        interp_method: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Perform temporal interpolation of the cumulative rainfall depths of all sites to the desired time interval,
+    in a single call.
+
+    Parameters
+    ----------
+    duration_mins : np.ndarray
+        Storm durations in minutes, in ascending order.
+    depths : np.ndarray
+        Cumulative rainfall depths for each storm duration, with a row for each site (n_sites x n_durations).
+    increment_mins : int
+        Time interval in minutes.
+    interp_method : str
+        Temporal interpolation method to be used. Refer to 'scipy.interpolate.interp1d()' for available methods.
+        One of 'linear', 'nearest', 'nearest-up', 'zero', 'slinear', 'quadratic', 'cubic', 'previous', or 'next'.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The storm durations in minutes at the desired time interval, and the interpolated rainfall depths for each,
+        with a row for each site (n_sites x n_steps).
+
+    Raises
+    ------
+    ValueError
+        - If the specified 'increment_mins' is out of range.
+        - If the specified 'interp_method' is not supported.
+    """
+    # Check if increment_mins is within the valid range
+    if increment_mins < duration_mins[0] or increment_mins > duration_mins[-1]:
+        raise ValueError(f"Increment minute {increment_mins} is out of range, "
+                         f"needs to be between {duration_mins[0]} and {duration_mins[-1]}.")
+    # Create a new array of duration minutes to interpolate the data for
+    duration_new = np.arange(increment_mins, duration_mins[-1] + increment_mins, increment_mins)
+    # Drop the last element of 'duration_new' if it is bigger than the last element of the original 'duration'
+    # because it would throw a ValueError as it is above the interpolation range's maximum value
+    duration_new = duration_new[:-1] if duration_new[-1] > duration_mins[-1] else duration_new
+    try:
+        # Create an interpolation function for all sites at once, interpolating along the durations of each site
+        f_func = interp1d(duration_mins, depths, kind=interp_method, axis=1)
+    except NotImplementedError as e:
+        # Raise an error if the specified interpolation method is not supported
+        raise ValueError(f"Invalid interpolation method: '{interp_method}'. "
+                         f"Refer to 'scipy.interpolate.interp1d()' for available methods.") from e
+    return duration_new, f_func(duration_new)
+
+
 def get_interpolated_data(
         transposed_catchment_data: pd.DataFrame,
         increment_mins: int,
@@ -76,36 +146,14 @@ def get_interpolated_data(
         - If the specified 'increment_mins' is out of range.
         - If the specified 'interp_method' is not supported.
     """
-    # Extract the duration column from the transposed catchment data
-    duration = transposed_catchment_data['duration_mins']
-    # Check if increment_mins is within the valid range
-    if increment_mins < duration.iloc[0] or increment_mins > duration.iloc[-1]:
-        raise ValueError(f"Increment minute {increment_mins} is out of range, "
-                         f"needs to be between {duration.iloc[0]} and {duration.iloc[-1]}.")
-    # Create a new array of duration minutes to interpolate the data for
-    duration_new = np.arange(increment_mins, duration.iloc[-1] + increment_mins, increment_mins)
-    # Drop the last element of 'duration_new' if it is bigger than the last element of the original 'duration'
-    # because it would throw a ValueError as it is above the interpolation range's maximum value
-    duration_new = duration_new[:-1] if duration_new[-1] > duration.iloc[-1] else duration_new
+    # Extract the duration column and the depths of each site from the transposed catchment data
+    duration = transposed_catchment_data["duration_mins"].to_numpy()
+    site_depths = transposed_catchment_data.iloc[:, 1:]
+    duration_new, depths_new = interpolate_site_depths(
+        duration, site_depths.to_numpy().T, increment_mins, interp_method)
     # Create a DataFrame to hold the interpolated data with 'duration_mins' as the first column
-    interp_catchment_data = pd.DataFrame(duration_new, columns=["duration_mins"])
-    # Perform interpolation for each site in the transposed catchment data
-    for column_num in range(1, len(transposed_catchment_data.columns)):
-        # Get the depth values for the current site
-        depth = transposed_catchment_data.iloc[:, column_num]
-        try:
-            # Create an interpolation function using the duration and depth values
-            f_func = interp1d(duration, depth, kind=interp_method)
-        except NotImplementedError as e:
-            # Raise an error if the specified interpolation method is not supported
-            raise ValueError(f"Invalid interpolation method: '{interp_method}'. "
-                             f"Refer to 'scipy.interpolate.interp1d()' for available methods.") from e
-        # Get the site ID associated with the current depth values
-        site_id = depth.name
-        # Interpolate the depth values for the new duration range
-        depth_new = pd.Series(f_func(duration_new), name=site_id)
-        # Concatenate the interpolated depth values with the duration column in the interpolated catchment data
-        interp_catchment_data = pd.concat([interp_catchment_data, depth_new], axis=1)
+    interp_catchment_data = pd.DataFrame(depths_new.T, columns=site_depths.columns.tolist())
+    interp_catchment_data.insert(0, "duration_mins", duration_new)
     return interp_catchment_data
 
 
@@ -245,6 +293,201 @@ def add_time_information(
     return site_data
 
 
+def get_alt_block_order(step_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the order of the incremental rainfall depths, ranked from largest to smallest, in time for the Alternating
+    Block Method. The largest depth is placed at the peak, and the remaining depths alternately after and before it.
+
+    Parameters
+    ----------
+    step_count : int
+        The number of incremental rainfall depths.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The offset of each ranked depth from the peak, in time steps, and the rank of the depth placed at each time
+        step, in time order.
+    """
+    ranks = np.arange(step_count)
+    # Ranks 0, 1, 2, 3, 4, ... are placed at 0, +1, -1, +2, -2, ... time steps from the peak
+    steps_from_peak = (ranks + 1) // 2 * np.where(ranks % 2 == 1, 1, -1)
+    return steps_from_peak, np.argsort(steps_from_peak)
+
+
+def order_site_increments(
+        duration_mins: np.ndarray,
+        increment_depths: np.ndarray,
+        storm_length_mins: int,
+        time_to_peak_mins: Union[int, float],
+        increment_mins: int,
+        hyeto_method: HyetoMethod) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Arrange the storm length incremental rainfall depths of all sites in time based on the selected hyetograph
+    method, using array indexing for all sites at once.
+
+    Parameters
+    ----------
+    duration_mins : np.ndarray
+        Storm durations in minutes of the incremental rainfall depths, within the storm duration.
+    increment_depths : np.ndarray
+        Incremental rainfall depths, with a row for each site (n_sites x n_steps).
+    storm_length_mins : int
+        Storm duration in minutes.
+    time_to_peak_mins : Union[int, float]
+        The time in minutes when rainfall is at its greatest (reaches maximum).
+    increment_mins : int
+        Time interval in minutes.
+    hyeto_method : HyetoMethod
+        Hyetograph method to be used.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The time in minutes of each hyetograph step, and the hyetograph depths at each time, with a row for each site.
+
+    Raises
+    ------
+    ValueError
+        If the specified 'time_to_peak_mins' is less than half of the storm duration.
+    """
+    # Check if the specified time to peak is valid
+    if time_to_peak_mins < storm_length_mins / 2:
+        raise ValueError(
+            "'time_to_peak_mins' (time in minutes when rainfall is at its greatest) needs to be "
+            "at least half of 'storm_length_mins' (storm duration).")
+    if hyeto_method == HyetoMethod.ALT_BLOCK:
+        # Alternating Block Method: Place the maximum incremental rainfall depth at the peak position (center),
+        # arrange the remaining incremental rainfall depths alternatively in descending order after and before
+        # the peak.
+        steps_from_peak, rank_at_step = get_alt_block_order(increment_depths.shape[1])
+        # Sort the depths of each site in descending order, with missing values last
+        ranked_depths = -np.sort(-increment_depths, axis=1)
+        mins = time_to_peak_mins + np.sort(steps_from_peak) * increment_mins
+        return mins, ranked_depths[:, rank_at_step]
+    # Chicago Method: Place the initial incremental rainfall depth at the peak position and split it in half
+    # (left and right), further split the next incremental rainfall depths in half and arrange them before and after
+    # (left and right) of the previous split incremental rainfall depths.
+    half_depths = increment_depths / 2
+    depths = np.concatenate([half_depths[:, ::-1], half_depths], axis=1)
+    # Add time (minutes) information to allocate the split incremental rainfall depths
+    mins_start = time_to_peak_mins - duration_mins[-1] / 2 + increment_mins / 2
+    mins_end = time_to_peak_mins + duration_mins[-1] / 2 + increment_mins / 2
+    mins = np.arange(mins_start, mins_end, increment_mins / 2)
+    return mins, depths
+
+
+def get_hyetograph_depth_matrix(
+        duration_mins: np.ndarray,
+        increment_depths: np.ndarray,
+        storm_length_mins: int,
+        time_to_peak_mins: Union[int, float],
+        increment_mins: int,
+        hyeto_method: HyetoMethod) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the hyetograph depths of all sites for a storm from their incremental rainfall depths, as an array.
+    The incremental rainfall depths can be reused for many storms, e.g. to generate an ensemble of storms.
+
+    Parameters
+    ----------
+    duration_mins : np.ndarray
+        Storm durations in minutes of the incremental rainfall depths.
+    increment_depths : np.ndarray
+        Incremental rainfall depths, with a row for each site (n_sites x n_steps).
+    storm_length_mins : int
+        Storm duration in minutes.
+    time_to_peak_mins : Union[int, float]
+        The time in minutes when rainfall is at its greatest (reaches maximum).
+    increment_mins : int
+        Time interval in minutes.
+    hyeto_method : HyetoMethod
+        Hyetograph method to be used.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The time in minutes of each hyetograph step, and the hyetograph depths at each time, with a row for each site.
+
+    Raises
+    ------
+    ValueError
+        - If the specified 'storm_length_mins' is less than the minimum storm duration available in the data.
+        - If the specified 'time_to_peak_mins' is less than half of the storm duration.
+    """
+    # Check if the specified storm duration is valid
+    if storm_length_mins < duration_mins[0]:
+        raise ValueError(f"Storm duration (storm_length_mins) needs to be at least '{int(duration_mins[0])}'.")
+    # Keep only the durations within the specified storm duration
+    storm_length_filter = duration_mins <= storm_length_mins
+    return order_site_increments(
+        duration_mins[storm_length_filter], increment_depths[:, storm_length_filter],
+        storm_length_mins, time_to_peak_mins, increment_mins, hyeto_method)
+
+
+def get_increment_depth_matrix(
+        rain_depth_in_catchment: pd.DataFrame,
+        increment_mins: int,
+        interp_method: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Get the incremental rainfall depths of all sites within the catchment area at the desired time interval, as an
+    array, to be arranged into hyetographs with `get_hyetograph_depth_matrix`.
+
+    Parameters
+    ----------
+    rain_depth_in_catchment : pd.DataFrame
+        Rainfall depths for sites within the catchment area for a specified scenario retrieved from the database.
+    increment_mins : int
+        Time interval in minutes.
+    interp_method : str
+        Temporal interpolation method to be used. Refer to 'scipy.interpolate.interp1d()' for available methods.
+        One of 'linear', 'nearest', 'nearest-up', 'zero', 'slinear', 'quadratic', 'cubic', 'previous', or 'next'.
+
+    Returns
+    -------
+    Tuple[List[str], np.ndarray, np.ndarray]
+        The site IDs, the storm durations in minutes at the desired time interval, and the incremental rainfall depths
+        for each, with a row for each site (n_sites x n_steps).
+
+    Raises
+    ------
+    ValueError
+        - If the specified 'increment_mins' is out of range.
+        - If the specified 'interp_method' is not supported.
+    """
+    # Rename the duration columns to durations in minutes, and keep only them
+    catchment_data = rain_depth_in_catchment.rename(columns=get_duration_mins)
+    duration_columns = [column for column in catchment_data.columns if isinstance(column, int)]
+    duration_mins = np.array(duration_columns)
+    depths = catchment_data[duration_columns].to_numpy(dtype=float)
+    duration_new, depths_new = interpolate_site_depths(duration_mins, depths, increment_mins, interp_method)
+    # The first incremental depth is the cumulative depth of the first interval
+    increment_depths = np.diff(depths_new, axis=1, prepend=0)
+    return rain_depth_in_catchment["site_id"].tolist(), duration_new, increment_depths
+
+
+def hyetograph_depth_matrix_to_data(site_ids: List[str], mins: np.ndarray, depths: np.ndarray) -> pd.DataFrame:
+    """
+    Convert the hyetograph depths array of all sites to hyetograph depths data in Pandas DataFrame format.
+
+    Parameters
+    ----------
+    site_ids : List[str]
+        The site IDs, in the order of the rows of the depths array.
+    mins : np.ndarray
+        The time in minutes of each hyetograph step.
+    depths : np.ndarray
+        The hyetograph depths at each time, with a row for each site (n_sites x n_steps).
+
+    Returns
+    -------
+    pd.DataFrame
+        Hyetograph depths data with a column for each site, followed by the 'mins', 'hours' and 'seconds' columns.
+    """
+    hyetograph_depth = pd.DataFrame(depths.T, columns=site_ids)
+    # Add time information, i.e., minutes, hours and seconds columns
+    return hyetograph_depth.assign(mins=mins, hours=mins / 60, seconds=mins * 60)
+
+
 def transform_data_for_selected_method(
         interp_increment_data: pd.DataFrame,
         storm_length_mins: int,
@@ -276,34 +519,12 @@ def transform_data_for_selected_method(
     """
     # Get the incremental rainfall depths data within the specified storm duration
     storm_length_data = get_storm_length_increment_data(interp_increment_data, storm_length_mins)
-    # Initialize a list to hold the hyetograph data
-    hyetograph_sites_data = []
-    # Iterate over each site in the storm length data
-    for column_num in range(1, len(storm_length_data.columns)):
-        # Extract the duration and depth data for the current site
-        site_data = storm_length_data.iloc[:, [0, column_num]]
-        # Apply the selected hyetograph method to transform the data
-        if hyeto_method == HyetoMethod.ALT_BLOCK:
-            # Alternating Block Method: Place the maximum incremental rainfall depth at the peak position (center),
-            # arrange the remaining incremental rainfall depths alternatively in descending order after and before
-            # the peak.
-            site_data = site_data.sort_values(by=site_data.columns[1], ascending=False)
-        else:
-            # Chicago Method: Place the initial incremental rainfall depth at the peak position and split it in half
-            # (left and right), further split the next incremental rainfall depths in half and arrange them before and
-            # after (left and right) of the previous split incremental rainfall depths.
-            site_data_right = site_data.div(2)
-            site_data_left = site_data_right[::-1]
-            site_data = pd.concat([site_data_left, site_data_right]).reset_index(drop=True)
-        # Add time information to the transformed site_data
-        site_data = add_time_information(site_data, storm_length_mins, time_to_peak_mins, increment_mins, hyeto_method)
-        # Append the transformed site_data to the list
-        hyetograph_sites_data.append(site_data)
-    # Concatenate the transformed site data into a single DataFrame
-    hyetograph_depth = pd.concat(hyetograph_sites_data, axis=1, ignore_index=False)
-    # Remove any duplicated columns in the DataFrame
-    hyetograph_depth = hyetograph_depth.loc[:, ~hyetograph_depth.columns.duplicated(keep="last")]
-    return hyetograph_depth
+    site_increments = storm_length_data.iloc[:, 1:]
+    # Apply the selected hyetograph method to all sites at once
+    mins, depths = order_site_increments(
+        storm_length_data["duration_mins"].to_numpy(), site_increments.to_numpy().T,
+        storm_length_mins, time_to_peak_mins, increment_mins, hyeto_method)
+    return hyetograph_depth_matrix_to_data(site_increments.columns.tolist(), mins, depths)
 
 
 def hyetograph_depth_to_intensity(
@@ -340,6 +561,7 @@ def hyetograph_depth_to_intensity(
     return hyetograph_intensity
 
 
+@track_stage("get_hyetograph_data")
 def get_hyetograph_data(
         rain_depth_in_catchment: pd.DataFrame,
         storm_length_mins: int,
@@ -371,16 +593,14 @@ def get_hyetograph_data(
     pd.DataFrame
         Hyetograph intensities data for all sites within the catchment area.
     """
-    # Clean and transpose the rainfall depths data
-    transposed_catchment_data = get_transposed_data(rain_depth_in_catchment)
-    # Interpolate the rainfall depths data to the desired time interval
-    interp_catchment_data = get_interpolated_data(transposed_catchment_data, increment_mins, interp_method)
-    # Compute the incremental rainfall depths for the catchment area
-    interp_increment_data = get_interp_incremental_data(interp_catchment_data)
-    # Transform the storm length incremental rainfall depths for sites within the catchment area
-    # using the selected hyetograph method
-    hyetograph_depth = transform_data_for_selected_method(
-        interp_increment_data, storm_length_mins, time_to_peak_mins, increment_mins, hyeto_method)
+    # Interpolate the rainfall depths data of all sites to the desired time interval, and compute the incremental
+    # rainfall depths
+    site_ids, duration_mins, increment_depths = get_increment_depth_matrix(
+        rain_depth_in_catchment, increment_mins, interp_method)
+    # Arrange the storm length incremental rainfall depths of all sites using the selected hyetograph method
+    mins, depths = get_hyetograph_depth_matrix(
+        duration_mins, increment_depths, storm_length_mins, time_to_peak_mins, increment_mins, hyeto_method)
+    hyetograph_depth = hyetograph_depth_matrix_to_data(site_ids, mins, depths)
     # Convert the hyetograph depths data to hyetograph intensities data
     hyetograph_data = hyetograph_depth_to_intensity(hyetograph_depth, increment_mins, hyeto_method)
     return hyetograph_data
@@ -21,6 +21,7 @@ from src.dynamic_boundary_conditions.rainfall import (
     hyetograph,
     rainfall_model_input,
 )
+from src.pipeline_metrics import track_stage
 
 
 def remove_existing_rain_inputs(bg_flood_dir: pathlib.Path) -> None:
@@ -43,6 +44,7 @@ def remove_existing_rain_inputs(bg_flood_dir: pathlib.Path) -> None:
         rain_input_file.unlink()
 
 
+@track_stage("main_rainfall")
 def main(
         selected_polygon_gdf: gpd.GeoDataFrame,
         rcp: Optional[float],
@@ -53,6 +55,7 @@ def main(
         increment_mins: int,
         hyeto_method: HyetoMethod,
         input_type: RainInputType,
+        bg_flood_dir: Optional[pathlib.Path] = None,
         log_level: LogLevel = LogLevel.DEBUG) -> None:
     """
     Fetch and store rainfall data in the database, and generate the requested rainfall model input for BG-Flood.
@@ -79,6 +82,8 @@ def main(
     input_type: RainInputType
         The type of rainfall model input to be generated. Valid options are 'uniform' or 'varying',
         representing spatially uniform rain input (text file) or spatially varying rain input (NetCDF file).
+    bg_flood_dir : Optional[pathlib.Path] = None
+        The directory to write the rainfall model input to. Defaults to the BG-Flood model directory.
     log_level : LogLevel = LogLevel.DEBUG
         The log level to set for the root logger. Defaults to LogLevel.DEBUG.
         The available logging levels and their corresponding numeric values are:
@@ -101,8 +106,9 @@ def main(
     # Get catchment area
     catchment_area = get_catchment_area(selected_polygon_gdf, to_crs=4326)
 
-    # BG-Flood Model Directory
-    bg_flood_dir = config.get_env_variable("FLOOD_MODEL_DIR", cast_to=pathlib.Path)
+    # BG-Flood Model Directory, unless a different directory to write the model input to has been given
+    if bg_flood_dir is None:
+        bg_flood_dir = config.get_env_variable("FLOOD_MODEL_DIR", cast_to=pathlib.Path)
     # Remove any existing rainfall model inputs in the BG-Flood directory
     remove_existing_rain_inputs(bg_flood_dir)
 
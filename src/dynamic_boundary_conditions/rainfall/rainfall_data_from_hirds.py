@@ -3,14 +3,76 @@
 Fetch rainfall data from the HIRDS website.
 """
 
+import asyncio
+import logging
+import random
 import re
-from typing import List, NamedTuple, Optional
+import time
+from typing import Dict, List, NamedTuple, Optional
 from io import StringIO
 
+import aiohttp
 import requests
 from requests.structures import CaseInsensitiveDict
 import pandas as pd
 
+from src import config
+from src.pipeline_metrics import get_aiohttp_trace_config
+
+log = logging.getLogger(__name__)
+
+# URL of the HIRDS API on the NIWA API
+HIRDS_API_URL = f"{config.get_env_variable('NIWA_API_URL', default='https://api.niwa.co.nz')}/hirds"
+# Maximum number of requests sent to HIRDS at once when fetching several sites
+HIRDS_MAX_CONCURRENT_REQUESTS = config.get_env_variable("HIRDS_MAX_CONCURRENT_REQUESTS", default=8, cast_to=int)
+# Number of times a failed HIRDS request is retried, and the base delay between attempts, doubled after each attempt
+HIRDS_MAX_RETRIES = config.get_env_variable("HIRDS_MAX_RETRIES", default=4, cast_to=int)
+HIRDS_RETRY_BASE_DELAY_SECONDS = config.get_env_variable("HIRDS_RETRY_BASE_DELAY_SECONDS", default=1.0, cast_to=float)
+# Timeout of a single HIRDS request
+HIRDS_REQUEST_TIMEOUT_SECONDS = 120
+# Response statuses that indicate a temporary failure, for which requests are retried
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Headers sent with every request to HIRDS, matching those sent by the HIRDS website
+HIRDS_HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-GB,en-US;q=0.9,en;q=0.8",
+    "Connection": "keep-alive",
+    "Origin": "https://hirds.niwa.co.nz",
+    "Referer": "https://hirds.niwa.co.nz/",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-site",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)\
+        Chrome/96.0.4664.110 Safari/537.36",
+    "sec-ch-ua": '"" Not A;Brand";v="99", "Chromium";v="96", "Google Chrome";v="96""',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '""Windows""',
+}
+
+
+def get_site_url_key_from_report(report: str) -> str:
+    """
+    Extract the unique URL key of a rainfall site from the HIRDS report response.
+
+    Parameters
+    ----------
+    report : str
+        The JSON response of the HIRDS report request for the rainfall site.
+
+    Returns
+    -------
+    str
+        Unique URL key of the rainfall site.
+    """
+    # Convert the response to a DataFrame
+    rainfall_results = pd.read_json(StringIO(report))
+    # Get the unique URL key of the requested rainfall site
+    site_url = rainfall_results["url"][0]
+    pattern = re.compile(r"(?<=/asset/)\w*(?=/)")
+    site_url_key = re.findall(pattern, site_url)[0]
+    return site_url_key
+
 
 def get_site_url_key(site_id: str, idf: bool) -> str:
     """
@@ -28,33 +90,16 @@ def get_site_url_key(site_id: str, idf: bool) -> str:
     str
         Unique URL key of the requested rainfall site.
     """
-    url = "https://api.niwa.co.nz/hirds/report"
-    headers = CaseInsensitiveDict()
-    headers["Accept"] = "application/json, text/plain, */*"
-    headers["Accept-Language"] = "en-GB,en-US;q=0.9,en;q=0.8"
-    headers["Connection"] = "keep-alive"
+    url = f"{HIRDS_API_URL}/report"
+    headers = CaseInsensitiveDict(HIRDS_HEADERS)
     headers["Content-Type"] = "application/json"
-    headers["Origin"] = "https://hirds.niwa.co.nz"
-    headers["Referer"] = "https://hirds.niwa.co.nz/"
-    headers["Sec-Fetch-Dest"] = "empty"
-    headers["Sec-Fetch-Mode"] = "cors"
-    headers["Sec-Fetch-Site"] = "same-site"
-    headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)\
-        Chrome/96.0.4664.110 Safari/537.36"
-    headers["sec-ch-ua"] = '"" Not A;Brand";v="99", "Chromium";v="96", "Google Chrome";v="96""'
-    headers["sec-ch-ua-mobile"] = "?0"
-    headers["sec-ch-ua-platform"] = '""Windows""'
     # Convert idf parameter to lowercase string
     idf = str(idf).lower()
     data = f'{{"site_id":"{site_id}","idf":{idf}}}'
     # Make a POST request
     resp = requests.post(url, headers=headers, data=data)
-    # Convert the response to a DataFrame
-    rainfall_results = pd.read_json(resp.text)
     # Get the unique URL key of the requested rainfall site
-    site_url = rainfall_results["url"][0]
-    pattern = re.compile(r"(?<=/asset/)\w*(?=/)")
-    site_url_key = re.findall(pattern, site_url)[0]
+    site_url_key = get_site_url_key_from_report(resp.text)
     return site_url_key
 
 
@@ -77,21 +122,8 @@ def get_data_from_hirds(site_id: str, idf: bool) -> str:
     # Get the unique URL key of the requested rainfall site
     site_url_key = get_site_url_key(site_id, idf)
 
-    url = rf"https://api.niwa.co.nz/hirds/report/{site_url_key}/export"
-    headers = CaseInsensitiveDict()
-    headers["Accept"] = "application/json, text/plain, */*"
-    headers["Accept-Language"] = "en-GB,en-US;q=0.9,en;q=0.8"
-    headers["Connection"] = "keep-alive"
-    headers["Origin"] = "https://hirds.niwa.co.nz"
-    headers["Referer"] = "https://hirds.niwa.co.nz/"
-    headers["Sec-Fetch-Dest"] = "empty"
-    headers["Sec-Fetch-Mode"] = "cors"
-    headers["Sec-Fetch-Site"] = "same-site"
-    headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)\
-        Chrome/96.0.4664.110 Safari/537.36"
-    headers["sec-ch-ua"] = '"" Not A;Brand";v="99", "Chromium";v="96", "Google Chrome";v="96""'
-    headers["sec-ch-ua-mobile"] = "?0"
-    headers["sec-ch-ua-platform"] = '""Windows""'
+    url = f"{HIRDS_API_URL}/report/{site_url_key}/export"
+    headers = CaseInsensitiveDict(HIRDS_HEADERS)
     # Send HTTP GET request to the specified URL with headers
     response = requests.get(url, headers=headers)
     # Return the response content as a text string
@@ -99,6 +131,172 @@ def get_data_from_hirds(site_id: str, idf: bool) -> str:
     return rainfall_data
 
 
+def get_retry_delay(attempt: int, base_delay: float = HIRDS_RETRY_BASE_DELAY_SECONDS) -> float:
+    """
+    Get a random delay before retrying a failed request, up to a limit that doubles with each attempt, so that
+    requests that failed together are not retried together.
+
+    Parameters
+    ----------
+    attempt : int
+        The number of the attempt that failed, starting from 0.
+    base_delay : float = HIRDS_RETRY_BASE_DELAY_SECONDS
+        The limit of the delay after the first attempt, in seconds.
+
+    Returns
+    -------
+    float
+        The delay in seconds.
+    """
+    return random.uniform(0, base_delay * 2 ** attempt)
+
+
+async def request_hirds_with_retry(
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        method: str,
+        url: str,
+        **kwargs) -> str:
+    """
+    Send a request to HIRDS, retrying with a random backoff if it fails temporarily.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        An instance of `aiohttp.ClientSession` used for making HTTP requests.
+    semaphore : asyncio.Semaphore
+        Limits the number of requests sent to HIRDS at once.
+    method : str
+        The HTTP method of the request.
+    url : str
+        The URL of the request.
+    **kwargs
+        Further arguments of the request, e.g. data.
+
+    Returns
+    -------
+    str
+        The response body.
+
+    Raises
+    ------
+    aiohttp.ClientError
+        If the request still fails after the last retry.
+    asyncio.TimeoutError
+        If the request still times out after the last retry.
+    """
+    for attempt in range(HIRDS_MAX_RETRIES + 1):
+        try:
+            # Only hold the semaphore while the request is in flight, not while waiting to retry
+            async with semaphore:
+                async with session.request(method, url, **kwargs) as resp:
+                    if resp.status not in _RETRY_STATUSES:
+                        resp.raise_for_status()
+                        return await resp.text()
+                    error = aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status, message=resp.reason)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            error = e
+        if attempt == HIRDS_MAX_RETRIES:
+            raise error
+        delay = get_retry_delay(attempt)
+        log.warning(f"HIRDS request {method} {url} failed ({error!r}), retrying in {delay:.1f}s.")
+        await asyncio.sleep(delay)
+
+
+async def fetch_site_data_from_hirds(
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        site_id: str,
+        idf: bool) -> str:
+    """
+    Fetch rainfall data for a single rainfall site from the HIRDS website, within a shared session.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        An instance of `aiohttp.ClientSession` used for making HTTP requests.
+    semaphore : asyncio.Semaphore
+        Limits the number of requests sent to HIRDS at once.
+    site_id : str
+        HIRDS rainfall site ID.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+
+    Returns
+    -------
+    str
+        Rainfall data for the requested site as a string.
+    """
+    start_time = time.perf_counter()
+    data = f'{{"site_id":"{site_id}","idf":{str(idf).lower()}}}'
+    report = await request_hirds_with_retry(
+        session, semaphore, "POST", f"{HIRDS_API_URL}/report", data=data, headers={"Content-Type": "application/json"})
+    site_url_key = get_site_url_key_from_report(report)
+    rainfall_data = await request_hirds_with_retry(
+        session, semaphore, "GET", f"{HIRDS_API_URL}/report/{site_url_key}/export")
+    log.info(f"Fetched HIRDS data for site {site_id} in {time.perf_counter() - start_time:.2f}s.")
+    return rainfall_data
+
+
+async def fetch_sites_data_from_hirds(
+        site_ids: List[str],
+        idf: bool,
+        max_concurrent_requests: int = HIRDS_MAX_CONCURRENT_REQUESTS) -> Dict[str, str]:
+    """
+    Fetch rainfall data for several rainfall sites from the HIRDS website concurrently, through one pooled session.
+
+    Parameters
+    ----------
+    site_ids : List[str]
+        HIRDS rainfall site IDs.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+    max_concurrent_requests : int = HIRDS_MAX_CONCURRENT_REQUESTS
+        The maximum number of requests sent to HIRDS at once.
+
+    Returns
+    -------
+    Dict[str, str]
+        Rainfall data for each requested site as a string, by site ID.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+    connector = aiohttp.TCPConnector(limit=max_concurrent_requests)
+    timeout = aiohttp.ClientTimeout(total=HIRDS_REQUEST_TIMEOUT_SECONDS)
+    async with aiohttp.ClientSession(headers=HIRDS_HEADERS, connector=connector, timeout=timeout,
+                                     trace_configs=[get_aiohttp_trace_config()]) as session:
+        tasks = [fetch_site_data_from_hirds(session, semaphore, site_id, idf) for site_id in site_ids]
+        sites_data = await asyncio.gather(*tasks)
+    return dict(zip(site_ids, sites_data))
+
+
+def get_data_from_hirds_for_sites(
+        site_ids: List[str],
+        idf: bool,
+        max_concurrent_requests: int = HIRDS_MAX_CONCURRENT_REQUESTS) -> Dict[str, str]:
+    """
+    Fetch rainfall data for several rainfall sites from the HIRDS website concurrently.
+
+    Parameters
+    ----------
+    site_ids : List[str]
+        HIRDS rainfall site IDs.
+    idf : bool
+        Set to False for rainfall depth data, and True for rainfall intensity data.
+    max_concurrent_requests : int = HIRDS_MAX_CONCURRENT_REQUESTS
+        The maximum number of requests sent to HIRDS at once.
+
+    Returns
+    -------
+    Dict[str, str]
+        Rainfall data for each requested site as a string, by site ID.
+    """
+    start_time = time.perf_counter()
+    sites_data = asyncio.run(fetch_sites_data_from_hirds(site_ids, idf, max_concurrent_requests))
+    log.info(f"Fetched HIRDS data for {len(site_ids)} sites in {time.perf_counter() - start_time:.2f}s.")
+    return sites_data
+
+
 class BlockStructure(NamedTuple):
     """
     Represents the layout structure of fetched rainfall data.
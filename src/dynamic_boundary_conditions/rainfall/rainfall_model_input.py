@@ -15,6 +15,7 @@ from geocube.api.core import make_geocube
 
 from src.dynamic_boundary_conditions.rainfall.rainfall_enum import RainInputType
 from src.dynamic_boundary_conditions.rainfall import main_rainfall, hyetograph
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -211,6 +212,7 @@ def spatial_varying_rain_input(
     rain_data_cube.to_netcdf(bg_flood_dir / "rain_forcing.nc")
 
 
+@track_stage("generate_rain_model_input")
 def generate_rain_model_input(
         hyetograph_data: pd.DataFrame,
         sites_coverage: gpd.GeoDataFrame,
@@ -12,6 +12,8 @@ import geopandas as gpd
 from sqlalchemy.engine import Engine
 
 from src.digitaltwin import tables
+from src.dynamic_boundary_conditions.rainfall.rainfall_data_from_hirds import HIRDS_API_URL
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -25,7 +27,7 @@ def get_rainfall_sites_data() -> str:
     str
         The rainfall sites data as a string.
     """
-    url = "https://api.niwa.co.nz/hirds/sites"
+    url = f"{HIRDS_API_URL}/sites"
     headers = CaseInsensitiveDict()
     headers["Accept"] = "application/json, text/plain, */*"
     headers["Accept-Language"] = "en-GB,en-US;q=0.9,en;q=0.8"
@@ -67,6 +69,7 @@ def get_rainfall_sites_in_df() -> gpd.GeoDataFrame:
     return sites_with_geometry
 
 
+@track_stage("rainfall_sites_to_db")
 def rainfall_sites_to_db(engine: Engine) -> None:
     """
     Store rainfall sites data from the HIRDS website in the database.
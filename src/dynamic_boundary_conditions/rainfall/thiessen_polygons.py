@@ -14,6 +14,7 @@ from sqlalchemy.sql import text
 
 from src.digitaltwin import tables
 from src.digitaltwin.utils import get_nz_boundary
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -101,6 +102,7 @@ def thiessen_polygons_calculator(
     return rainfall_sites_voronoi
 
 
+@track_stage("thiessen_polygons_to_db")
 def thiessen_polygons_to_db(engine: Engine) -> None:
     """
     Store the data representing the Thiessen polygons, site information, and the area covered by
@@ -28,6 +28,7 @@ from src.dynamic_boundary_conditions.river import (
     river_model_input
 )
 from src.dynamic_boundary_conditions.river.river_enum import BoundType
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -119,6 +120,7 @@ def remove_existing_river_inputs(bg_flood_dir: pathlib.Path) -> None:
         river_input_file.unlink()
 
 
+@track_stage("main_river")
 def main(
         selected_polygon_gdf: gpd.GeoDataFrame,
         flow_length_mins: int,
@@ -126,6 +128,7 @@ def main(
         maf: bool = True,
         ari: Optional[int] = None,
         bound: BoundType = BoundType.MIDDLE,
+        bg_flood_dir: Optional[pathlib.Path] = None,
         log_level: LogLevel = LogLevel.DEBUG) -> None:
     """
     Read and store REC data in the database, fetch OSM waterways data, create a river network and its associated data,
@@ -147,6 +150,8 @@ def main(
     bound : BoundType = BoundType.MIDDLE
         Set the type of bound (estimate) for the REC river inflow scenario data.
         Valid options include: 'BoundType.LOWER', 'BoundType.MIDDLE', or 'BoundType.UPPER'.
+    bg_flood_dir : Optional[pathlib.Path] = None
+        The directory to write the river model input to. Defaults to the BG-Flood model directory.
     log_level : LogLevel = LogLevel.DEBUG
         The log level to set for the root logger. Defaults to LogLevel.DEBUG.
         The available logging levels and their corresponding numeric values are:
@@ -168,8 +173,9 @@ def main(
     engine = setup_environment.get_database()
     # Get catchment area
     catchment_area = get_catchment_area(selected_polygon_gdf, to_crs=2193)
-    # BG-Flood Model Directory
-    bg_flood_dir = config.get_env_variable("FLOOD_MODEL_DIR", cast_to=pathlib.Path)
+    # BG-Flood Model Directory, unless a different directory to write the model input to has been given
+    if bg_flood_dir is None:
+        bg_flood_dir = config.get_env_variable("FLOOD_MODEL_DIR", cast_to=pathlib.Path)
     # Remove any existing river model inputs in the BG-Flood directory
     remove_existing_river_inputs(bg_flood_dir)
 
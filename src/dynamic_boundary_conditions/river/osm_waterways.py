@@ -59,7 +59,8 @@ def fetch_osm_waterways(catchment_area: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         out="body",
         includeGeometry=True)
     # Execute the Overpass query to retrieve waterway elements
-    waterways = Overpass().query(query, timeout=600)
+    overpass_endpoint = config.get_env_variable("OVERPASS_API_URL", default="http://overpass-api.de/api/")
+    waterways = Overpass(endpoint=overpass_endpoint).query(query, timeout=600)
     # Initialize an empty dictionary to store element information
     element_dict = dict(id=[], waterway=[], geometry=[])
     # Iterate over the retrieved waterway elements
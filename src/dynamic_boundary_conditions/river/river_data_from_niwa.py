@@ -14,12 +14,16 @@ import requests
 from shapely.geometry import LineString
 from sqlalchemy.engine import Engine
 
+from src import config
 from src.digitaltwin.utils import get_nz_boundary
+from src.pipeline_metrics import get_aiohttp_trace_config
 
 log = logging.getLogger(__name__)
 
 # URL for retrieving REC data from NIWA using the ArcGIS REST API
-REC_API_URL = "https://gis.niwa.co.nz/server/rest/services/HYDRO/Flood_Statistics_Henderson_Collins_V2/MapServer/2"
+REC_API_URL = config.get_env_variable(
+    "REC_API_URL",
+    default="https://gis.niwa.co.nz/server/rest/services/HYDRO/Flood_Statistics_Henderson_Collins_V2/MapServer/2")
 
 
 class RecordCounts(NamedTuple):
@@ -178,7 +182,7 @@ async def fetch_rec_data_for_nz(
     gpd.GeoDataFrame
         A GeoDataFrame containing the fetched REC data in New Zealand.
     """
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(trace_configs=[get_aiohttp_trace_config()]) as session:
         # Construct the query URL for the REC feature layer
         query_url = f"{url}/query"
         # Create a list of tasks to fetch REC data for each query parameter
@@ -14,10 +14,12 @@ from sqlalchemy.sql import text
 from src.digitaltwin.tables import check_table_exists
 from src.dynamic_boundary_conditions.river import river_data_from_niwa
 from src.dynamic_boundary_conditions.river.river_network_to_from_db import add_network_exclusions_to_db
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
 
+@track_stage("store_rec_data_to_db")
 def store_rec_data_to_db(engine: Engine) -> None:
     """
     Store REC data in the database.
@@ -15,6 +15,7 @@ import pyproj
 from newzealidar.utils import get_dem_band_and_resolution_by_geometry
 
 from src.dynamic_boundary_conditions.river import main_river, align_rec_osm
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -108,6 +109,7 @@ def get_min_elevation_river_input_point(rec_inflows_row: pd.Series, hydro_dem: x
     return min_elevation_entry_point
 
 
+@track_stage("get_rec_inflows_with_input_points")
 def get_rec_inflows_with_input_points(
         engine: Engine,
         catchment_area: gpd.GeoDataFrame,
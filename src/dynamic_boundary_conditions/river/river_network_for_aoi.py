@@ -20,6 +20,7 @@ from src.dynamic_boundary_conditions.river.river_network_to_from_db import (
     get_existing_network_metadata_from_db,
     get_existing_network
 )
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -509,6 +510,7 @@ def build_rec_river_network(
     return rec_network, rec_network_data
 
 
+@track_stage("get_rec_river_network")
 def get_rec_river_network(engine: Engine, catchment_area: gpd.GeoDataFrame) -> Tuple[nx.Graph, gpd.GeoDataFrame]:
     """
     Retrieve or create REC river network for the specified catchment area.
@@ -6,14 +6,13 @@ and generate the requested tide uniform boundary model input for BG-Flood etc.
 
 import logging
 import pathlib
+from datetime import datetime
 from typing import Dict, NamedTuple, Union, Optional
 
 import geopandas as gpd
-import pandas as pd
-from sqlalchemy import text
 
 from src import config
-from src.digitaltwin import setup_environment, tables
+from src.digitaltwin import setup_environment
 from src.digitaltwin.utils import LogLevel, setup_logging, get_catchment_area
 
 from src.dynamic_boundary_conditions.tide.tide_enum import ApproachType
@@ -24,6 +23,7 @@ from src.dynamic_boundary_conditions.tide import (
     tide_slr_combine,
     tide_slr_model_input
 )
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
@@ -123,66 +123,26 @@ def get_valid_parameters_based_on_confidence_level() -> Dict[str, Dict[str, Unio
     """
     Get information on valid tide and sea-level-rise parameters based on the valid values in the database.
     These parameters are mostly dependent on the "confidence_level" parameter, so that is the key in the returned dict.
+    Uses the precomputed catalogue of valid parameters, cached in-process, rather than querying the
+    'sea_level_rise' table.
 
     Returns
     -------
     Dict[str, Dict[str, Union[str, int]]]
         Dictionary with confidence_level as the key, and 2nd level dict with allowed values for dependent values.
     """
-    # Connect to database
-    engine = setup_environment.get_database()
-    slr_table_name = 'sea_level_rise'
-    if not tables.check_table_exists(engine, slr_table_name):
-        # Sea Level Rise data has not been initialised, so initialise it.
-        sea_level_rise_data.store_slr_data_to_db(engine)
-
-    # Find all distinct combinations of confidence_level with the dependant columns.
-    query = text(f"""
-        SELECT DISTINCT
-            confidence_level,
-            CONCAT(ssp, '-', scenario) AS ssp_scenarios,
-            (DATE_PART('year', now()) + 1)::NUMERIC::BIGINT AS min_year,
-            MAX(year) AS max_year
-        FROM {slr_table_name}
-        GROUP BY
-            confidence_level,
-            ssp,
-            scenario
-    """)
-    query_result = pd.read_sql(query, engine)
-
-    # Get the list of percentiles from the column names
-    column_names_query = text(r"""
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE
-            table_name = 'sea_level_rise'
-            AND table_catalog=:db_name
-            AND column_name ~ '^p\d+'
-        """).bindparams(db_name=config.get_env_variable("POSTGRES_DB"))
-    percentile_col_tuples = engine.execute(column_names_query).fetchall()
-    # Flatten the result of the query
-    percentile_cols = [col_tuple[0] for col_tuple in percentile_col_tuples]
-    # Remove the leading 'p'
-    valid_percentiles = [int(col[1:]) for col in percentile_cols]
-
-    # Construct result dict pairing confidence level to dependant variables.
-    # noinspection PyTypeChecker
-    confidence_level_to_valid_params: Dict[str, Dict[str, Union[str, int]]] = {}
-    for confidence_level, group in query_result.groupby(['confidence_level']):
-        # Create nested dict of valid parameter values for each confidence level value
-        confidence_level = str(confidence_level)  # Only for type-checking purposes, does not functionally change str
-        valid_params = {"percentiles": valid_percentiles}
-        for column in group:
-            # We already have confidence_level at the highest level in the dict
-            if column != 'confidence_level':
-                # List all different unique values for the column and given confidence level
-                unique_values = group[column].unique().tolist()
-                # Get the first value if it is a single value list (e.g. max_year)
-                unique_values = unique_values[0] if len(unique_values) == 1 else unique_values
-                valid_params[column] = unique_values
-        confidence_level_to_valid_params[confidence_level] = valid_params
-    return confidence_level_to_valid_params
+    slr_parameters = sea_level_rise_data.get_slr_parameters()
+    # Projections can only be made for future years
+    min_year = datetime.now().year + 1
+    return {
+        confidence_level: {
+            "ssp_scenarios": valid_params["ssp_scenarios"],
+            "percentiles": valid_params["percentiles"],
+            "min_year": min_year,
+            "max_year": valid_params["max_year"],
+        }
+        for confidence_level, valid_params in slr_parameters.items()
+    }
 
 
 def remove_existing_boundary_inputs(bg_flood_dir: pathlib.Path) -> None:
@@ -205,6 +165,7 @@ def remove_existing_boundary_inputs(bg_flood_dir: pathlib.Path) -> None:
         boundary_file.unlink()
 
 
+@track_stage("main_tide_slr")
 def main(
     selected_polygon_gdf: gpd.GeoDataFrame,
     tide_length_mins: int,
@@ -215,6 +176,7 @@ def main(
     ssp_scenario: str,
     add_vlm: bool,
     percentile: int,
+    bg_flood_dir: Optional[pathlib.Path] = None,
     log_level: LogLevel = LogLevel.DEBUG
 ) -> None:
     """
@@ -244,6 +206,8 @@ def main(
         Set to True if VLM should be included, False otherwise.
     percentile : int
         The desired percentile for the sea level rise data. Valid values are 17, 50, or 83.
+    bg_flood_dir : Optional[pathlib.Path] = None
+        The directory to write the uniform boundary model input to. Defaults to the BG-Flood model directory.
     log_level : LogLevel = LogLevel.DEBUG
         The log level to set for the root logger. Defaults to LogLevel.DEBUG.
         The available logging levels and their corresponding numeric values are:
@@ -266,8 +230,9 @@ def main(
         engine = setup_environment.get_database()
         # Get catchment area
         catchment_area = get_catchment_area(selected_polygon_gdf, to_crs=2193)
-        # BG-Flood Model Directory
-        bg_flood_dir = config.get_env_variable("FLOOD_MODEL_DIR", cast_to=pathlib.Path)
+        # BG-Flood Model Directory, unless a different directory to write the model input to has been given
+        if bg_flood_dir is None:
+            bg_flood_dir = config.get_env_variable("FLOOD_MODEL_DIR", cast_to=pathlib.Path)
         # Remove any existing uniform boundary model inputs in the BG-Flood directory
         remove_existing_boundary_inputs(bg_flood_dir)
 
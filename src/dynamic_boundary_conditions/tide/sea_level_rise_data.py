@@ -8,7 +8,9 @@ in the provided tide data.
 from io import StringIO
 import logging
 import pathlib
-from typing import Dict
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
 
 import geopandas as gpd
 import pandas as pd
@@ -16,10 +18,16 @@ import requests
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import text
 
-from src.digitaltwin import tables
+from src import config
+from src.digitaltwin import setup_environment, tables
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
+# Catalogue of valid sea level rise parameters cached in this process, and the time it was read from the database
+_slr_parameters_cache: Tuple[float, Optional[Dict[str, Dict[str, Union[List[str], List[int], int]]]]] = (0.0, None)
+_slr_parameters_cache_lock = threading.Lock()
+
 
 def modify_slr_data_from_takiwa(slr_nz_dict: Dict[str, pd.DataFrame]) -> gpd.GeoDataFrame:
     """
@@ -93,7 +101,8 @@ def get_slr_data_from_takiwa() -> gpd.GeoDataFrame:
         A GeoDataFrame containing the sea level rise data from the NZ Sea level rise datasets.
     """
     #  The URL for retrieving the sea level rise files
-    url = 'https://zenodo.org/records/11398538/export/json'
+    url = config.get_env_variable("SEA_LEVEL_RISE_RECORD_URL",
+                                  default="https://zenodo.org/records/11398538/export/json")
 
     # Log that the fetching of sea level rise data from NZ SeaRise Takiwa has started
     log.info("Fetching 'sea_level_rise' data from NZ SeaRise Takiwa.")
@@ -126,6 +135,7 @@ def get_slr_data_from_takiwa() -> gpd.GeoDataFrame:
     return slr_nz_with_geom
 
 
+@track_stage("store_slr_data_to_db")
 def store_slr_data_to_db(engine: Engine) -> None:
     """
     Store sea level rise data to the database.
@@ -140,12 +150,143 @@ def store_slr_data_to_db(engine: Engine) -> None:
     # Check if the table already exists in the database
     if tables.check_table_exists(engine, table_name):
         log.info(f"'{table_name}' data already exists in the database.")
+        # Build the catalogue of valid parameters if the data was stored before the catalogue existed
+        if not tables.check_table_exists(engine, tables.SeaLevelRiseParameters.__tablename__):
+            store_slr_parameters_to_db(engine)
     else:
         # Read sea level rise data from the NZ Sea level rise datasets
         slr_nz = get_slr_data_from_takiwa()
         # Store the sea level rise data to the database table
         log.info(f"Adding '{table_name}' data to the database.")
         slr_nz.to_postgis(table_name, engine, index=False, if_exists="replace")
+        # The stored data has changed, so the catalogue of valid parameters needs to be rebuilt
+        store_slr_parameters_to_db(engine)
+
+
+def store_slr_parameters_to_db(engine: Engine) -> None:
+    """
+    Precompute the catalogue of valid sea level rise parameters for each confidence level from the 'sea_level_rise'
+    table, and store it in the 'sea_level_rise_parameters' table, replacing any existing catalogue.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    # Find the valid scenarios and latest projection year for each confidence level
+    query = text("""
+        SELECT
+            confidence_level,
+            ARRAY_AGG(DISTINCT CONCAT(ssp, '-', scenario)) AS ssp_scenarios,
+            MAX(year) AS max_year
+        FROM sea_level_rise
+        GROUP BY confidence_level
+    """)
+    parameter_rows = engine.execute(query).fetchall()
+
+    # Get the list of percentiles from the column names
+    column_names_query = text(r"""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE
+            table_name = 'sea_level_rise'
+            AND table_catalog=:db_name
+            AND column_name ~ '^p\d+'
+        """).bindparams(db_name=config.get_env_variable("POSTGRES_DB"))
+    percentile_col_tuples = engine.execute(column_names_query).fetchall()
+    # Remove the leading 'p' from each column name
+    valid_percentiles = sorted(int(col_tuple[0][1:]) for col_tuple in percentile_col_tuples)
+
+    tables.create_table(engine, tables.SeaLevelRiseParameters)
+    insert_query = text("""
+        INSERT INTO sea_level_rise_parameters (confidence_level, ssp_scenarios, percentiles, max_year, created_at)
+        VALUES (:confidence_level, :ssp_scenarios, :percentiles, :max_year, now());
+    """)
+    # Replace the catalogue in a single transaction, so readers never see a partial catalogue
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM sea_level_rise_parameters;"))
+        for row in parameter_rows:
+            conn.execute(insert_query.bindparams(
+                confidence_level=row["confidence_level"],
+                ssp_scenarios=sorted(row["ssp_scenarios"]),
+                percentiles=valid_percentiles,
+                max_year=int(row["max_year"]),
+            ))
+    log.info(f"Stored the catalogue of valid sea level rise parameters for {len(parameter_rows)} confidence levels.")
+    clear_slr_parameters_cache()
+
+
+def clear_slr_parameters_cache() -> None:
+    """
+    Clear the catalogue of valid sea level rise parameters cached in this process, so that the next read fetches it
+    from the database. Other processes pick up changes to the catalogue once their cache expires.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    global _slr_parameters_cache
+    with _slr_parameters_cache_lock:
+        _slr_parameters_cache = (0.0, None)
+
+
+def get_slr_parameters() -> Dict[str, Dict[str, Union[List[str], List[int], int]]]:
+    """
+    Get the catalogue of valid sea level rise parameters, reading it from the database only if the copy cached in
+    this process is older than SLR_PARAMETERS_CACHE_TTL_SECONDS. Stores the sea level rise data and catalogue in the
+    database first if they do not yet exist.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Union[List[str], List[int], int]]]
+        Dictionary with confidence_level as the key, and 2nd level dict with the valid ssp_scenarios,
+        percentiles, and max_year.
+    """
+    global _slr_parameters_cache
+    cache_ttl = config.get_env_variable("SLR_PARAMETERS_CACHE_TTL_SECONDS", default=300, cast_to=int)
+    with _slr_parameters_cache_lock:
+        cached_at, slr_parameters = _slr_parameters_cache
+        if slr_parameters is not None and time.time() - cached_at < cache_ttl:
+            return slr_parameters
+    # Read the catalogue outside the lock, since storing it may clear the cache
+    engine = setup_environment.get_database()
+    store_slr_data_to_db(engine)
+    slr_parameters = get_slr_parameters_from_db(engine)
+    with _slr_parameters_cache_lock:
+        _slr_parameters_cache = (time.time(), slr_parameters)
+    return slr_parameters
+
+
+def get_slr_parameters_from_db(engine: Engine) -> Dict[str, Dict[str, Union[List[str], List[int], int]]]:
+    """
+    Retrieve the precomputed catalogue of valid sea level rise parameters from the database.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    Dict[str, Dict[str, Union[List[str], List[int], int]]]
+        Dictionary with confidence_level as the key, and 2nd level dict with the valid ssp_scenarios,
+        percentiles, and max_year.
+    """
+    query = text("SELECT confidence_level, ssp_scenarios, percentiles, max_year FROM sea_level_rise_parameters;")
+    return {
+        row["confidence_level"]: {
+            "ssp_scenarios": list(row["ssp_scenarios"]),
+            "percentiles": list(row["percentiles"]),
+            "max_year": row["max_year"],
+        }
+        for row in engine.execute(query).fetchall()
+    }
 
 
 def get_closest_slr_data(engine: Engine, single_query_loc: pd.Series) -> gpd.GeoDataFrame:
@@ -17,12 +17,14 @@ import pandas as pd
 
 from src import config
 from src.dynamic_boundary_conditions.tide.tide_enum import DatumType, ApproachType
+from src.pipeline_metrics import get_aiohttp_trace_config, track_stage
 
 log = logging.getLogger(__name__)
 
 # URLs for retrieving tide data from the NIWA Tide API in JSON and CSV formats, respectively
-TIDE_API_URL_DATA = "https://api.niwa.co.nz/tides/data"
-TIDE_API_URL_DATA_CSV = "https://api.niwa.co.nz/tides/data.csv"
+NIWA_API_URL = config.get_env_variable("NIWA_API_URL", default="https://api.niwa.co.nz")
+TIDE_API_URL_DATA = f"{NIWA_API_URL}/tides/data"
+TIDE_API_URL_DATA_CSV = f"{NIWA_API_URL}/tides/data.csv"
 
 
 def get_query_loc_coords_position(query_loc_row: gpd.GeoDataFrame) -> Tuple[float, float, str]:
@@ -264,7 +266,7 @@ async def fetch_tide_data_for_requested_period(
     while True:
         try:
             tasks = []
-            async with aiohttp.ClientSession() as session:
+            async with aiohttp.ClientSession(trace_configs=[get_aiohttp_trace_config()]) as session:
                 # Create a list of tasks to fetch tide data for each query parameter
                 for query_param in query_param_list:
                     tasks.append(fetch_tide_data(session, query_param=query_param, url=url))
@@ -637,6 +639,7 @@ def add_time_information(
     return tide_data_w_time
 
 
+@track_stage("get_tide_data")
 def get_tide_data(
         tide_query_loc: gpd.GeoDataFrame,
         time_to_peak_mins: Union[int, float],
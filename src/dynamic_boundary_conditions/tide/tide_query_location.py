@@ -10,6 +10,8 @@ from shapely.geometry import LineString, Point
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import text
 
+from src.pipeline_metrics import track_stage
+
 log = logging.getLogger(__name__)
 
 
@@ -226,6 +228,7 @@ def get_non_intersection_centroid_position(
     return non_intersections
 
 
+@track_stage("get_tide_query_locations")
 def get_tide_query_locations(
         engine: Engine,
         catchment_area: gpd.GeoDataFrame,
@@ -5,12 +5,13 @@ resulting model output metadata in the database, and incorporates the model outp
 """
 
 import logging
-import os
 import pathlib
 import platform
+import shutil
 import subprocess
+import uuid
 from datetime import datetime
-from typing import Tuple, Union, Optional, TextIO
+from typing import List, Tuple, Union, Optional, TextIO
 
 import geopandas as gpd
 import xarray as xr
@@ -26,12 +27,17 @@ from src.digitaltwin.tables import BGFloodModelOutput, create_table, check_table
 from src.digitaltwin.utils import LogLevel, setup_logging, get_catchment_area
 from src.flood_model.flooded_buildings import find_flooded_buildings
 from src.flood_model.flooded_buildings import store_flooded_buildings_in_database
+from src.flood_model.cloud_optimised_output import write_cloud_optimised_outputs
 from src.flood_model.serve_model import add_model_output_to_geoserver
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# File name patterns of the rain, uniform boundary and river input files used by the BG-Flood Model
+MODEL_INPUT_FILE_PATTERNS = ("rain_forcing.*", "*_bnd.txt", "river[0-9]*.txt")
+
 
 def get_valid_bg_flood_dir() -> pathlib.Path:
     """
@@ -56,6 +62,126 @@ def get_valid_bg_flood_dir() -> pathlib.Path:
     raise FileNotFoundError(f"BG-Flood Model not found at: '{bg_flood_dir}'")
 
 
+def get_bg_flood_executable_name() -> str:
+    """
+    Get the file name of the BG-Flood Model executable, accounting for OS differences.
+
+    Returns
+    -------
+    str
+        The file name of the BG-Flood Model executable.
+    """
+    operating_system = platform.system()
+    if operating_system == "Windows":
+        # Run the .exe
+        return "BG_flood.exe"
+    if operating_system != "Linux":
+        # Other OSs are not officially supported, but we can attempt to try the Linux one.
+        log.warning(f"{operating_system} is not officially supported. Only Windows and Linux are officially supported.")
+        log.warning(f"Attempting to run BG_Flood linux script in {operating_system}")
+    # Run the executable linux script
+    return "BG_Flood"
+
+
+def create_model_run_dir(bg_flood_dir: pathlib.Path) -> pathlib.Path:
+    """
+    Create an isolated working directory for a single BG-Flood Model run, containing its own copy of the BG-Flood
+    Model executable. This allows multiple models to run concurrently without overwriting each other's files.
+
+    Parameters
+    ----------
+    bg_flood_dir : pathlib.Path
+        The BG-Flood Model directory containing the BG-Flood Model executable.
+
+    Returns
+    -------
+    pathlib.Path
+        The working directory for the model run.
+    """
+    data_dir = config.get_env_variable("DATA_DIR", cast_to=pathlib.Path)
+    # Use an absolute path, because the executable is run from within this directory
+    model_run_dir = (data_dir / "model_runs" / uuid.uuid4().hex).absolute()
+    model_run_dir.mkdir(parents=True)
+    # Copy the executable, keeping file permissions so that it can still be executed
+    executable_name = get_bg_flood_executable_name()
+    shutil.copy2(bg_flood_dir / executable_name, model_run_dir / executable_name)
+    # On Windows the executable also needs the libraries it is distributed with
+    for library_file in bg_flood_dir.glob("*.dll"):
+        shutil.copy2(library_file, model_run_dir / library_file.name)
+    log.debug(f"Created BG-Flood model run directory {model_run_dir}")
+    return model_run_dir
+
+
+def get_model_inputs_staging_dir(run_id: str, stage: str) -> pathlib.Path:
+    """
+    Get the directory used to stage the model input files generated by one stage of a model run, creating it if it
+    does not already exist. Each stage writes to its own directory so that stages can run concurrently.
+
+    Parameters
+    ----------
+    run_id : str
+        The unique identifier of the model run.
+    stage : str
+        The name of the stage generating the model input files, e.g. 'rainfall'.
+
+    Returns
+    -------
+    pathlib.Path
+        The staging directory for the model input files of the stage.
+    """
+    data_dir = config.get_env_variable("DATA_DIR", cast_to=pathlib.Path)
+    staging_dir = data_dir / "model_inputs" / run_id / stage
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    return staging_dir
+
+
+def remove_model_inputs_staging_dirs(run_id: str) -> None:
+    """
+    Remove all staging directories of a model run, once the model inputs are no longer needed.
+
+    Parameters
+    ----------
+    run_id : str
+        The unique identifier of the model run.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    data_dir = config.get_env_variable("DATA_DIR", cast_to=pathlib.Path)
+    shutil.rmtree(data_dir / "model_inputs" / run_id, ignore_errors=True)
+
+
+def stage_model_inputs(model_input_dirs: List[pathlib.Path], bg_flood_dir: pathlib.Path) -> None:
+    """
+    Replace any existing model input files in the BG-Flood Model run directory with the model input files from the
+    staging directories.
+
+    Parameters
+    ----------
+    model_input_dirs : List[pathlib.Path]
+        The staging directories containing the model input files generated for this model run.
+    bg_flood_dir : pathlib.Path
+        The BG-Flood Model run directory.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    # Remove model input files left over from previous model runs
+    for pattern in MODEL_INPUT_FILE_PATTERNS:
+        for existing_input_file in bg_flood_dir.glob(pattern):
+            existing_input_file.unlink()
+    # Copy model input files from each of the staging directories
+    for model_input_dir in model_input_dirs:
+        for pattern in MODEL_INPUT_FILE_PATTERNS:
+            for model_input_file in model_input_dir.glob(pattern):
+                shutil.copy2(model_input_file, bg_flood_dir / model_input_file.name)
+    log.debug(f"Staged model inputs from {len(model_input_dirs)} directories into {bg_flood_dir}")
+
+
 def get_new_model_output_path() -> pathlib.Path:
     """
     Get a new file path for saving the BG Flood model output with the current timestamp included in the filename.
@@ -71,8 +197,9 @@ def get_new_model_output_path() -> pathlib.Path:
     model_output_dir.mkdir(parents=True, exist_ok=True)
     # Get the current timestamp in "YYYY_MM_DD_HH_MM_SS" format
     dt_string = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    # Create the BG Flood model output path with the current timestamp
-    model_output_path = (model_output_dir / f"output_{dt_string}.nc")
+    # Create the BG Flood model output path with the current timestamp, and a random suffix in case multiple models
+    # are started within the same second
+    model_output_path = (model_output_dir / f"output_{dt_string}_{uuid.uuid4().hex[:8]}.nc")
     return model_output_path
 
 
@@ -396,7 +523,7 @@ def prepare_bg_flood_model_inputs(
                          f"mask = {mask};\n"
                          f"gpudevice = {gpu_device};\n"
                          f"smallnc = {small_nc};\n"
-                         f"outfile = {model_output_path.as_posix()};\n"
+                         f"outfile = {model_output_path.absolute().as_posix()};\n"
                          f"outvars = h, hmax, zb, zs, u, v;\n")
 
         # Process rain input files and write their parameter values to the parameter file
@@ -407,6 +534,7 @@ def prepare_bg_flood_model_inputs(
         process_river_input_files(bg_flood_dir, param_file)
 
 
+@track_stage("run_bg_flood_model")
 def run_bg_flood_model(
         engine: Engine,
         catchment_area: gpd.GeoDataFrame,
@@ -416,7 +544,8 @@ def run_bg_flood_model(
         resolution: Optional[Union[int, float]] = None,
         mask: Union[int, float] = 9999,
         gpu_device: int = 0,
-        small_nc: int = 0) -> None:
+        small_nc: int = 0,
+        model_input_dirs: Optional[List[pathlib.Path]] = None) -> None:
     """
     Run the BG-Flood Model for the specified catchment area.
 
@@ -446,6 +575,9 @@ def run_bg_flood_model(
         Specify whether the output should be saved as short integers to reduce the size of the output file.
         Set the value to 1 to enable short integer conversion, or set it to 0 to save all variables as floats.
         Default value is 0.
+    model_input_dirs : Optional[List[pathlib.Path]] = None
+        The staging directories containing the model input files generated for this model run.
+        If not provided (default is None), the model input files already in the BG-Flood Model directory are used.
 
     Returns
     -------
@@ -454,6 +586,11 @@ def run_bg_flood_model(
     """
     # Get the valid BG-Flood Model directory
     bg_flood_dir = get_valid_bg_flood_dir()
+    # Create a separate working directory for this model run, so that concurrent model runs do not interfere
+    model_run_dir = create_model_run_dir(bg_flood_dir)
+    # Bring the model input files for this model run into the model run directory. If there are no staging
+    # directories then use the model input files that have been generated into the BG-Flood Model directory.
+    stage_model_inputs(model_input_dirs if model_input_dirs is not None else [bg_flood_dir], model_run_dir)
     # Get the file path of the Hydro DEM for the catchment area
     hydro_dem_path_str, _, _, dem_resolution = get_dem_by_geometry(engine, catchment_area)
     hydro_dem_path = pathlib.Path(hydro_dem_path_str)
@@ -462,7 +599,7 @@ def run_bg_flood_model(
 
     # Prepare inputs for the BG-Flood Model
     prepare_bg_flood_model_inputs(
-        bg_flood_dir=bg_flood_dir,
+        bg_flood_dir=model_run_dir,
         model_output_path=model_output_path,
         hydro_dem_path=hydro_dem_path,
         resolution=resolution,
@@ -472,28 +609,15 @@ def run_bg_flood_model(
         gpu_device=gpu_device,
         small_nc=small_nc)
 
-    # Get the current working directory (cwd)
-    cwd = pathlib.Path.cwd()
-    # Change the current working directory to the BG-Flood Model directory
-    os.chdir(bg_flood_dir)
-    # Run the BG-Flood Model executable, accounting for OS differences
-    operating_system = platform.system()
-    if operating_system == "Windows":
-        # Run the .exe
-        subprocess.run([bg_flood_dir / "BG_flood.exe"], check=True)
-    elif operating_system == "Linux":
-        # Run the executable linux script
-        subprocess.run([bg_flood_dir / "BG_Flood"], check=True)
-    else:
-        # Other OSs are not officially supported, but we can attempt to try the Linux one.
-        log.warning(f"{operating_system} is not officially supported. Only Windows and Linux are officially supported.")
-        log.warning(f"Attempting to run BG_Flood linux script in {operating_system}")
-        subprocess.run([bg_flood_dir / "BG_Flood"], check=True)
-    # Change the current working directory back to the original directory (cwd)
-    os.chdir(cwd)
+    # Run the BG-Flood Model executable from within the model run directory
+    subprocess.run([model_run_dir / get_bg_flood_executable_name()], cwd=model_run_dir, check=True)
+    # The model run directory is no longer needed once the output has been saved. It is kept if the model fails so
+    # that the BG-Flood logs can be inspected.
+    shutil.rmtree(model_run_dir, ignore_errors=True)
     log.info(f"Saved new flood model to {model_output_path}")
 
 
+@track_stage("bg_flood_model")
 def main(
         selected_polygon_gdf: gpd.GeoDataFrame,
         output_timestep: Union[int, float],
@@ -502,6 +626,7 @@ def main(
         mask: Union[int, float] = 9999,
         gpu_device: int = 0,
         small_nc: int = 0,
+        model_input_dirs: Optional[List[pathlib.Path]] = None,
         log_level: LogLevel = LogLevel.DEBUG) -> int:
     """
     Generate BG-Flood model output for the requested catchment area, and incorporate the model output to GeoServer
@@ -529,6 +654,9 @@ def main(
         Specify whether the output should be saved as short integers to reduce the size of the output file.
         Set the value to 1 to enable short integer conversion, or set it to 0 to save all variables as floats.
         Default value is 0.
+    model_input_dirs : Optional[List[pathlib.Path]] = None
+        The staging directories containing the model input files generated for this model run.
+        If not provided (default is None), the model input files already in the BG-Flood Model directory are used.
     log_level : LogLevel = LogLevel.DEBUG
         The log level to set for the root logger. Defaults to LogLevel.DEBUG.
         The available logging levels and their corresponding numeric values are:
@@ -563,13 +691,16 @@ def main(
         resolution=resolution,
         mask=mask,
         gpu_device=gpu_device,
-        small_nc=small_nc
+        small_nc=small_nc,
+        model_input_dirs=model_input_dirs
     )
 
     # Store metadata related to the BG Flood model output in the database
     model_id = store_model_output_metadata_to_db(engine, model_output_path, catchment_area)
     # Add CRS to the latest BG-Flood model output
     add_crs_to_model_output(engine, model_id)
+    # Write copies of the model output that clients can read in parts, e.g. with HTTP range requests
+    write_cloud_optimised_outputs(model_output_path)
     # Find buildings that are flooded to a depth greater than or equal to 0.1m
     log.info("Analysing flooded buildings")
     flooded_buildings = find_flooded_buildings(engine, catchment_area, model_output_path, flood_depth_threshold=0.1)
@@ -0,0 +1,223 @@
+"""
+Converts BG-Flood model outputs into cloud-optimised formats, so that clients and GeoServer can read only the parts
+of an output they need instead of the whole NetCDF file.
+Every spatial output variable with a single raster for the whole model run, such as the maximum depth, is written as a
+Cloud Optimised GeoTiff (COG), tiled and with overviews. Every output variable, including the instantaneous variables
+that change with each time step, is written into a chunked, compressed Zarr store that keeps the time axis.
+"""
+
+import logging
+import pathlib
+import shutil
+from typing import Dict, List, Tuple
+
+import xarray as xr
+
+from src.pipeline_metrics import track_stage
+
+log = logging.getLogger(__name__)
+
+# Names of the spatial dimensions of the BG-Flood model output
+X_DIM = "xx_P0"
+Y_DIM = "yy_P0"
+# Size of the square tiles of the COGs, and of the spatial chunks of the Zarr store
+TILE_SIZE = 512
+
+
+def get_model_output_zarr_path(model_output_path: pathlib.Path) -> pathlib.Path:
+    """
+    Get the path of the Zarr store for a model output, stored beside the model output.
+
+    Parameters
+    ----------
+    model_output_path : pathlib.Path
+        The file path to the model output NetCDF file.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the Zarr store directory.
+    """
+    return model_output_path.with_suffix(".zarr")
+
+
+def get_model_output_cog_path(model_output_path: pathlib.Path, variable: str) -> pathlib.Path:
+    """
+    Get the path of the COG for a variable of a model output, stored beside the model output.
+
+    Parameters
+    ----------
+    model_output_path : pathlib.Path
+        The file path to the model output NetCDF file.
+    variable : str
+        The name of the model output variable, e.g. "hmax_P0".
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the COG file.
+    """
+    return model_output_path.with_name(f"{model_output_path.stem}_{variable}.tif")
+
+
+def get_spatial_variables(ds: xr.Dataset) -> List[str]:
+    """
+    Find the names of the variables of a model output that are rasters, i.e. have both spatial dimensions.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        The model output dataset.
+
+    Returns
+    -------
+    List[str]
+        The names of the spatial variables.
+    """
+    return [str(name) for name, variable in ds.data_vars.items() if {X_DIM, Y_DIM}.issubset(variable.dims)]
+
+
+def is_running_maximum(variable: str) -> bool:
+    """
+    Check whether a model output variable is a running maximum over the model run, e.g. "hmax_P0" or "zsmax_P0",
+    so that its last time step holds the maximum over the whole run.
+
+    Parameters
+    ----------
+    variable : str
+        The name of the model output variable.
+
+    Returns
+    -------
+    bool
+        True if the variable is a running maximum, False if it is an instantaneous value such as "h_P0".
+    """
+    return variable.split("_")[0].endswith("max")
+
+
+def write_raster_to_cog(raster: xr.DataArray, cog_path: pathlib.Path) -> None:
+    """
+    Write a single band raster as a tiled, compressed Cloud Optimised GeoTiff with overviews.
+
+    Parameters
+    ----------
+    raster : xr.DataArray
+        The raster to write, with spatial dimensions and CRS set.
+    cog_path : pathlib.Path
+        The file path to write the COG to.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    raster.rio.to_raster(
+        cog_path,
+        driver="COG",
+        blocksize=TILE_SIZE,
+        compress="DEFLATE",
+        predictor="YES",
+        overview_resampling="AVERAGE",
+    )
+
+
+def write_model_output_cogs(model_output_path: pathlib.Path) -> List[pathlib.Path]:
+    """
+    Write the spatial variables of a model output that have a single raster for the whole model run as COGs.
+    Running maximums such as "hmax_P0" are written at their last time step, which holds the maximum over the whole run.
+    Instantaneous variables such as "h_P0", "u_P0" and "v_P0" are left out, since they are served by the Zarr store.
+
+    Parameters
+    ----------
+    model_output_path : pathlib.Path
+        The file path to the model output NetCDF file.
+
+    Returns
+    -------
+    List[pathlib.Path]
+        The file paths of the COGs written.
+    """
+    cog_paths = []
+    with xr.open_dataset(model_output_path, decode_coords="all") as ds:
+        for variable in get_spatial_variables(ds):
+            raster = ds[variable]
+            if "time" in raster.dims:
+                if not is_running_maximum(variable):
+                    continue
+                raster = raster.isel(time=-1)
+            raster = raster.rio.set_spatial_dims(x_dim=X_DIM, y_dim=Y_DIM)
+            cog_path = get_model_output_cog_path(model_output_path, variable)
+            write_raster_to_cog(raster, cog_path)
+            cog_paths.append(cog_path)
+    log.debug(f"Wrote {len(cog_paths)} COGs for {model_output_path.name}")
+    return cog_paths
+
+
+def get_zarr_chunks(variable: xr.DataArray) -> Tuple[int, ...]:
+    """
+    Choose the chunk shape of a variable in the Zarr store.
+    Spatial dimensions are split into tiles, while other dimensions (e.g. time) are kept whole in each chunk,
+    so that reading the time series of a point only reads one chunk.
+
+    Parameters
+    ----------
+    variable : xr.DataArray
+        The model output variable to be written.
+
+    Returns
+    -------
+    Tuple[int, ...]
+        The size of the chunks along each dimension of the variable.
+    """
+    return tuple(
+        min(size, TILE_SIZE) if dim in (X_DIM, Y_DIM) else size
+        for dim, size in zip(variable.dims, variable.shape)
+    )
+
+
+def write_model_output_zarr(model_output_path: pathlib.Path) -> pathlib.Path:
+    """
+    Write all variables of a model output to a chunked Zarr store, compressed with the default Zarr compressor.
+    Replaces any existing Zarr store for the model output.
+
+    Parameters
+    ----------
+    model_output_path : pathlib.Path
+        The file path to the model output NetCDF file.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the Zarr store directory.
+    """
+    zarr_path = get_model_output_zarr_path(model_output_path)
+    if zarr_path.exists():
+        shutil.rmtree(zarr_path)
+    with xr.open_dataset(model_output_path, decode_coords="all") as ds:
+        encoding: Dict[str, Dict[str, Tuple[int, ...]]] = {
+            str(name): {"chunks": get_zarr_chunks(variable)} for name, variable in ds.data_vars.items()
+        }
+        # Consolidated metadata lets clients open the store with a single request
+        ds.to_zarr(zarr_path, encoding=encoding, consolidated=True)
+    log.debug(f"Wrote Zarr store {zarr_path.name}")
+    return zarr_path
+
+
+@track_stage("write_cloud_optimised_outputs")
+def write_cloud_optimised_outputs(model_output_path: pathlib.Path) -> None:
+    """
+    Write a model output to all cloud-optimised formats: COGs for each raster and a Zarr store for all variables.
+
+    Parameters
+    ----------
+    model_output_path : pathlib.Path
+        The file path to the model output NetCDF file.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    log.info(f"Writing cloud-optimised copies of {model_output_path.name}")
+    write_model_output_cogs(model_output_path)
+    write_model_output_zarr(model_output_path)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+This script handles caching of flood model outputs, so that repeated requests for the same area and scenario can be
+served from an existing model output instead of running the whole flood model pipeline again.
+"""
+
+import hashlib
+import json
+import logging
+import pathlib
+from enum import Enum
+from types import ModuleType
+from typing import Dict, Optional, Union
+
+import geopandas as gpd
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import text
+
+from src.digitaltwin.tables import FloodModelCache, check_table_exists, create_table
+
+log = logging.getLogger(__name__)
+
+# Parameters that do not change the flood model output, and so are not part of the cache key
+_PARAMETERS_EXCLUDED_FROM_KEY = {"log_level"}
+
+
+def get_model_cache_key(
+        selected_polygon_gdf: gpd.GeoDataFrame,
+        scenario_options: Dict[str, Union[str, float, int, bool]],
+        modules_to_parameters: Dict[ModuleType, Dict[str, Union[str, int, float, bool, None, Enum]]]) -> str:
+    """
+    Create a canonical hash of all of the inputs used to generate a flood model.
+
+    Parameters
+    ----------
+    selected_polygon_gdf : gpd.GeoDataFrame
+        A GeoDataFrame representing the selected polygon, i.e., the catchment area.
+    scenario_options : Dict[str, Union[str, float, int, bool]]
+        Options for scenario modelling inputs, coming from JSON body.
+    modules_to_parameters : Dict[ModuleType, Dict[str, Union[str, int, float, bool, None, Enum]]]
+        A dictionary that associates each module with the parameters used for its main function.
+
+    Returns
+    -------
+    str
+        The SHA-256 hex digest identifying the flood model inputs.
+    """
+    # Round the bounds of the area in NZTM to the centimetre, so that floating point noise does not change the key
+    bounds = [round(float(bound), 2) for bound in selected_polygon_gdf.to_crs(2193).total_bounds]
+    # Use module names so that the parameters can be serialised, dropping any that do not affect the model output
+    parameters = {
+        module.__name__: {
+            name: value for name, value in module_parameters.items() if name not in _PARAMETERS_EXCLUDED_FROM_KEY
+        }
+        for module, module_parameters in modules_to_parameters.items()
+    }
+    cache_inputs = {
+        "bounds_2193": bounds,
+        "parameters": parameters,
+        "scenario_options": scenario_options,
+    }
+    # Sort keys so that the same inputs always serialise to the same string
+    serialised_inputs = json.dumps(cache_inputs, sort_keys=True, default=str)
+    return hashlib.sha256(serialised_inputs.encode("utf-8")).hexdigest()
+
+
+def get_cached_flood_model_id(engine: Engine, cache_key: str) -> Optional[int]:
+    """
+    Find the id of an existing flood model output that was generated from the same inputs.
+    Cache entries pointing to model outputs that no longer exist are removed.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    cache_key : str
+        The hash of the flood model inputs, from get_model_cache_key.
+
+    Returns
+    -------
+    Optional[int]
+        The id of the cached flood model output, or None if there is no valid cached output.
+    """
+    if not check_table_exists(engine, FloodModelCache.__tablename__) or \
+            not check_table_exists(engine, "bg_flood_model_output"):
+        return None
+    query = text("""
+        SELECT cache.flood_model_id, model_output.file_path
+        FROM flood_model_cache AS cache
+        JOIN bg_flood_model_output AS model_output ON model_output.unique_id = cache.flood_model_id
+        WHERE cache.cache_key = :cache_key;
+        """).bindparams(cache_key=cache_key)
+    row = engine.execute(query).fetchone()
+    if row is None:
+        return None
+    # The model output file may have been removed since it was cached
+    if not pathlib.Path(row["file_path"]).exists():
+        log.info(f"Cached flood model output {row['flood_model_id']} no longer exists, removing from cache.")
+        remove_query = text("DELETE FROM flood_model_cache WHERE cache_key = :cache_key;").bindparams(
+            cache_key=cache_key)
+        with engine.begin() as conn:
+            conn.execute(remove_query)
+        return None
+    return row["flood_model_id"]
+
+
+def store_flood_model_in_cache(engine: Engine, cache_key: str, flood_model_id: int) -> None:
+    """
+    Store the id of a newly generated flood model output against the hash of its inputs.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    cache_key : str
+        The hash of the flood model inputs, from get_model_cache_key.
+    flood_model_id : int
+        The id of the flood model output generated from the inputs.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    create_table(engine, FloodModelCache)
+    query = text("""
+        INSERT INTO flood_model_cache (cache_key, flood_model_id, created_at)
+        VALUES (:cache_key, :flood_model_id, now())
+        ON CONFLICT (cache_key) DO UPDATE
+        SET flood_model_id = EXCLUDED.flood_model_id, created_at = EXCLUDED.created_at;
+        """).bindparams(cache_key=cache_key, flood_model_id=flood_model_id)
+    with engine.begin() as conn:
+        conn.execute(query)
+    log.info(f"Stored flood model output {flood_model_id} in the flood model cache.")
+
+
+def clear_flood_model_cache(engine: Engine) -> None:
+    """
+    Remove all entries from the flood model cache.
+    Needs to be run when the data sources the models are built from (e.g. LiDAR datasets or static layers) are
+    refreshed, so that new requests generate models from the refreshed data.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    if check_table_exists(engine, FloodModelCache.__tablename__):
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM flood_model_cache;"))
+        log.info("Cleared the flood model cache.")
@@ -1,26 +1,67 @@
+import io
+import logging
 import pathlib
+from typing import Tuple
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import rasterio as rio
-import shapely
 import xarray
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import text
 
+from src.digitaltwin.tables import BuildingFloodStatus, create_table
 from src.flood_model.serve_model import create_building_database_views_if_not_exists
+from src.pipeline_metrics import track_stage
 
+log = logging.getLogger(__name__)
 
+# Columns of building flood depth statistics, which may be missing from tables created before they were added
+_BUILDING_DEPTH_COLUMNS = ("max_depth", "mean_depth", "flooded_fraction", "peak_time", "first_inundation_time")
+# Columns written to building_flood_status, in order
+_BUILDING_FLOOD_STATUS_COLUMNS = ("building_outline_id", "is_flooded") + _BUILDING_DEPTH_COLUMNS + ("flood_model_id",)
+
+
+def create_building_flood_status_table(engine: Engine) -> None:
+    """
+    Creates the building_flood_status table and its index if they do not exist, and adds any columns missing from
+    tables created by earlier versions.
+
+    Parameters
+    ----------
+    engine: Engine
+        The sqlalchemy database connection engine
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    create_table(engine, BuildingFloodStatus)
+    with engine.begin() as conn:
+        for column in _BUILDING_DEPTH_COLUMNS:
+            conn.execute(text(f"ALTER TABLE building_flood_status ADD COLUMN IF NOT EXISTS {column} DOUBLE PRECISION;"))
+        # Index the columns the GeoServer building_flood_status view filters and joins on
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS building_flood_status_model_building_idx "
+            "ON building_flood_status (flood_model_id, building_outline_id);"
+        ))
+
+
+@track_stage("store_flooded_buildings_in_database")
 def store_flooded_buildings_in_database(engine: Engine, buildings: pd.DataFrame, flood_model_id: int) -> None:
     """
-    Appends the details of which buildings are flooded for a given flood_model_id to the database
+    Appends the details of which buildings are flooded for a given flood_model_id to the database,
+    using a single bulk COPY.
 
     Parameters
     ----------
     engine: Engine
         The sqlalchemy database connection engine
     buildings : pd.DataFrame
-        DataFrame containing a mapping of building_ids to their flood status for the current model run
+        DataFrame indexed by building_outline_id, containing the flood status and depths of each building for the
+        current model run, as returned by find_flooded_buildings.
     flood_model_id : float
         The id of the current flood model run, to associate with the building flood data.
 
@@ -29,14 +70,175 @@ def store_flooded_buildings_in_database(engine: Engine, buildings: pd.DataFrame,
     None
         This function does not return anything
     """
+    create_building_flood_status_table(engine)
     # Associate the building flood status dataframe with the current model id
-    buildings["flood_model_id"] = flood_model_id
-    # Append the dataframe to the database
-    buildings.to_sql("building_flood_status", engine, if_exists="append", index=True)
+    buildings = buildings.assign(flood_model_id=flood_model_id).reset_index()
+    # Write the rows as CSV in memory, with empty values for NULL, to be bulk loaded with COPY
+    csv_buffer = io.StringIO()
+    buildings.to_csv(csv_buffer, columns=list(_BUILDING_FLOOD_STATUS_COLUMNS), header=False, index=False)
+    csv_buffer.seek(0)
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            column_list = ", ".join(_BUILDING_FLOOD_STATUS_COLUMNS)
+            cursor.copy_expert(f"COPY building_flood_status ({column_list}) FROM STDIN WITH (FORMAT csv)", csv_buffer)
+        connection.commit()
+    finally:
+        connection.close()
+    # Precompute the building layer for this model, so building queries only read this model's buildings
+    materialise_model_buildings(engine, flood_model_id)
+    # Also precompute the layers of models stored before building layers were precomputed, which GeoServer reads from
+    materialise_missing_model_buildings(engine)
     # Create geoserver endpoints for database views if they do not already exist
     create_building_database_views_if_not_exists()
 
 
+def get_model_buildings_query() -> str:
+    """
+    SQL query for the building outlines and their flood statuses for a flood model, with parameter :flood_model_id.
+    Only buildings that are current and inside the area of the flood model are included.
+
+    Returns
+    -------
+    str
+        The SQL query text.
+    """
+    return """
+        SELECT
+            buildings.*,
+            flood_statuses.is_flooded,
+            flood_statuses.max_depth,
+            flood_statuses.mean_depth,
+            flood_statuses.flooded_fraction,
+            flood_statuses.peak_time,
+            flood_statuses.first_inundation_time,
+            flood_statuses.flood_model_id
+        FROM building_flood_status AS flood_statuses
+        JOIN nz_building_outlines AS buildings USING (building_outline_id)
+        WHERE flood_statuses.flood_model_id = :flood_model_id
+            AND buildings.building_outline_lifecycle ILIKE 'current'
+    """
+
+
+def get_model_buildings_table_name(flood_model_id: int) -> str:
+    """
+    Get the name of the partition of model_building_flood_status holding the buildings for a flood model.
+
+    Parameters
+    ----------
+    flood_model_id : int
+        The id of the flood model.
+
+    Returns
+    -------
+    str
+        The name of the partition table.
+    """
+    return f"model_building_flood_status_{int(flood_model_id)}"
+
+
+def create_model_buildings_table(engine: Engine) -> None:
+    """
+    Creates the spatially indexed model_building_flood_status table, partitioned by flood model, if it does not exist.
+    Concurrent calls are serialised with a transaction-level advisory lock, so only one of them creates the table
+    and its indexes.
+
+    Parameters
+    ----------
+    engine: Engine
+        The sqlalchemy database connection engine
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    with engine.begin() as conn:
+        # Held until the transaction ends, so other tasks wait here and then see the table created by this one
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('model_building_flood_status'));"))
+        if conn.execute(text("SELECT to_regclass('model_building_flood_status') IS NOT NULL;")).scalar():
+            return
+        # Take the columns of the partitioned table from the query, since they depend on nz_building_outlines
+        conn.execute(text(f"""
+            CREATE TEMP TABLE model_buildings_template ON COMMIT DROP AS
+            {get_model_buildings_query()}
+            WITH NO DATA;
+            """).bindparams(flood_model_id=-1))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS model_building_flood_status (LIKE model_buildings_template)
+            PARTITION BY LIST (flood_model_id);
+            """))
+        # Indexes on the partitioned table are created on every partition
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS model_building_flood_status_geometry_idx
+            ON model_building_flood_status USING GIST (geometry);
+            """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS model_building_flood_status_building_idx
+            ON model_building_flood_status (building_outline_id);
+            """))
+
+
+def materialise_model_buildings(engine: Engine, flood_model_id: int) -> None:
+    """
+    Precomputes the building outlines joined with their flood statuses for a flood model, into a partition of the
+    spatially indexed model_building_flood_status table.
+    Each flood model has its own partition, so queries for one flood model do not read the buildings of any other,
+    or the national building outlines table.
+
+    Parameters
+    ----------
+    engine: Engine
+        The sqlalchemy database connection engine
+    flood_model_id : int
+        The id of the flood model to precompute the building layer for.
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    create_model_buildings_table(engine)
+    partition_name = get_model_buildings_table_name(flood_model_id)
+    with engine.begin() as conn:
+        # Replace any existing partition for this flood model
+        conn.execute(text(f"DROP TABLE IF EXISTS {partition_name};"))
+        conn.execute(text(f"""
+            CREATE TABLE {partition_name} PARTITION OF model_building_flood_status
+            FOR VALUES IN ({int(flood_model_id)});
+            """))
+        conn.execute(text(f"INSERT INTO {partition_name} {get_model_buildings_query()};").bindparams(
+            flood_model_id=int(flood_model_id)))
+        conn.execute(text(f"ANALYZE {partition_name};"))
+
+
+def materialise_missing_model_buildings(engine: Engine) -> None:
+    """
+    Precomputes the building layers of flood models stored before building layers were precomputed, so that they can
+    be served from model_building_flood_status like newer flood models.
+
+    Parameters
+    ----------
+    engine: Engine
+        The sqlalchemy database connection engine
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    # Check each flood model output, so that the index on building_flood_status is used instead of scanning it
+    missing_flood_model_ids = engine.execute(text("""
+        SELECT unique_id FROM bg_flood_model_output AS outputs
+        WHERE to_regclass('model_building_flood_status_' || outputs.unique_id) IS NULL
+            AND EXISTS (SELECT 1 FROM building_flood_status WHERE flood_model_id = outputs.unique_id);
+        """)).scalars().all()
+    for flood_model_id in missing_flood_model_ids:
+        log.info(f"Precomputing the building layer of flood model {flood_model_id}.")
+        materialise_model_buildings(engine, flood_model_id)
+
+
+@track_stage("find_flooded_buildings")
 def find_flooded_buildings(engine: Engine,
                            area_of_interest: gpd.GeoDataFrame,
                            flood_model_output_path: pathlib.Path,
@@ -44,6 +246,8 @@ def find_flooded_buildings(engine: Engine,
     """
     Creates a building DataFrame with attribute "is_flooded",
     depending on if the area for each building is flooded to a depth greater than or equal to flood_depth_threshold.
+    Also includes the max and mean depth, the fraction of the area flooded, the time of the peak depth, and the time
+    first flooded, for each building.
     the index, building_outline_id, matches building_outline_id from nz_building_outline table.
 
     Parameters
@@ -60,47 +264,202 @@ def find_flooded_buildings(engine: Engine,
     Returns
     -------
     pd.DataFrame
-        A pd.DataFrame specifying if each building is flooded or not.
+        A pd.DataFrame specifying if each building is flooded or not, and the flood depths for each building.
     """
-    # Open flood output and read the maximum depth raster
-    with xarray.open_dataset(flood_model_output_path, decode_coords="all") as ds:
-        max_depth_raster = ds["hmax_P0"]
-    # Find areas flooded in a polygon format, if they are deeper than flood_depth_threshold
-    thresholded_flood_polygons = polygonize_flooded_area(max_depth_raster, flood_depth_threshold)
     # Get building outlines from database
     buildings = retrieve_building_outlines(engine, area_of_interest)
-    # Categorise buildings as flooded or not flooded
-    return categorise_buildings_as_flooded(buildings, thresholded_flood_polygons)
+    # Open flood output lazily, keeping times as seconds since the start of the model, so that the depth raster is read
+    # one time step at a time instead of all at once
+    with xarray.open_dataset(flood_model_output_path, decode_coords="all", decode_times=False) as ds:
+        depth_raster = ds["hmax_P0"].rio.set_spatial_dims(x_dim="xx_P0", y_dim="yy_P0")
+        if "time" not in depth_raster.dims:
+            depth_raster = depth_raster.expand_dims(time=[0.0])
+        # hmax is a running maximum, so the last time holds the maximum depth at any time
+        max_depth_raster = depth_raster.isel(time=-1).load()
+        # Measure flood depths for each building directly against the depth raster
+        building_depths = classify_buildings_by_depth(buildings, max_depth_raster, flood_depth_threshold)
+        building_times = find_building_inundation_times(buildings, depth_raster, flood_depth_threshold)
+    return building_depths.join(building_times)
+
+
+def _get_building_pixels(buildings: gpd.GeoDataFrame,
+                         raster: xarray.DataArray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the raster pixels covered by each building, by rasterising the buildings onto the raster grid.
+    Each building covers the pixels it touches. Buildings that do not cover any pixel, for example because they
+    overlap a neighbouring building, use the pixel under a point within the building.
+
+    Parameters
+    ----------
+    buildings : gpd.GeoDataFrame
+        A GeoDataFrame with each polygon representing a building outline
+    raster : xarray.DataArray
+        Raster with spatial dimensions y and x, defining the grid.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Parallel arrays of the building position (in buildings), row, and column of each covered pixel.
+    """
+    transform = raster.rio.transform()
+    shape = (raster.rio.height, raster.rio.width)
+    buildings = buildings.to_crs(raster.rio.crs)
+    # Label each pixel with the position of the building covering it, starting at 1 so that 0 means no building
+    labels = rio.features.rasterize(
+        zip(buildings.geometry, range(1, len(buildings) + 1)),
+        out_shape=shape,
+        transform=transform,
+        fill=0,
+        all_touched=True,
+        dtype="int32",
+    )
+    rows, cols = np.nonzero(labels)
+    positions = labels[rows, cols] - 1
+
+    # Sample the pixel under each building that does not cover any pixels
+    is_covered = np.zeros(len(buildings), dtype=bool)
+    is_covered[positions] = True
+    uncovered = np.nonzero(~is_covered)[0]
+    if len(uncovered) > 0:
+        points = buildings.geometry.iloc[uncovered].representative_point()
+        point_cols, point_rows = ~transform * (points.x.values, points.y.values)
+        point_rows, point_cols = np.floor(point_rows).astype(int), np.floor(point_cols).astype(int)
+        inside = (point_rows >= 0) & (point_rows < shape[0]) & (point_cols >= 0) & (point_cols < shape[1])
+        positions = np.concatenate([positions, uncovered[inside]])
+        rows = np.concatenate([rows, point_rows[inside]])
+        cols = np.concatenate([cols, point_cols[inside]])
+    return positions, rows, cols
+
+
+def _max_by_building(pixel_values: np.ndarray, positions: np.ndarray, n_buildings: int) -> np.ndarray:
+    """
+    Finds the maximum of the pixel values of each building, ignoring NaN values, in one grouped reduction.
+
+    Parameters
+    ----------
+    pixel_values : np.ndarray
+        Array of pixel values with the pixel as the last dimension, e.g. (pixel) or (time, pixel).
+    positions : np.ndarray
+        The building position of each pixel. Parallels the last dimension of pixel_values.
+    n_buildings : int
+        The number of buildings.
+
+    Returns
+    -------
+    np.ndarray
+        Array of the maximum value of each building, with the building as the last dimension.
+        Values are NaN for buildings with no pixels, or only NaN pixel values.
+    """
+    building_max = np.full(pixel_values.shape[:-1] + (n_buildings,), np.nan)
+    if len(positions) == 0:
+        return building_max
+    # Sort the pixels by building, so that the pixels of each building are reduced as one contiguous group
+    pixel_order = np.argsort(positions, kind="stable")
+    building_positions, group_starts = np.unique(positions[pixel_order], return_index=True)
+    building_max[..., building_positions] = np.fmax.reduceat(pixel_values[..., pixel_order], group_starts, axis=-1)
+    return building_max
 
 
-def categorise_buildings_as_flooded(building_polygons: gpd.GeoDataFrame,
-                                    flood_polygons: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+def classify_buildings_by_depth(building_polygons: gpd.GeoDataFrame,
+                                max_depth_raster: xarray.DataArray,
+                                flood_depth_threshold: float) -> pd.DataFrame:
     """
-    Identifies all buildings in building_polygons that intersect with areas in flooded_polygons.
+    Measures the flood depths under each building by rasterising the buildings onto the depth raster grid.
 
     Parameters
     ----------
     building_polygons : gpd.GeoDataFrame
         A GeoDataFrame with each polygon representing a building outline
-    flood_polygons : gpd.GeoDataFrame
-        A GeoDataFrame with each polygon representing a flooded area
+    max_depth_raster : xarray.DataArray
+        Raster with each pixel representing the maximum flood depth at the point
+    flood_depth_threshold : float
+        The minimum depth required to designate a pixel in the raster as flooded.
 
     Returns
     -------
-    gpd.GeoDataFrame
-        A copy of building_polygons with an additional boolean attribute "is_flooded"
+    pd.DataFrame
+        A pd.DataFrame with the same index as building_polygons, and attributes "is_flooded" (any pixel flooded),
+        "max_depth", "mean_depth", and "flooded_fraction" (fraction of pixels flooded).
+        Depths are NaN for buildings outside the raster.
+    """
+    result_columns = ["is_flooded", "max_depth", "mean_depth", "flooded_fraction"]
+    if building_polygons.empty:
+        return pd.DataFrame(columns=result_columns, index=building_polygons.index)
+    positions, rows, cols = _get_building_pixels(building_polygons, max_depth_raster)
+    pixel_depths = max_depth_raster.values[rows, cols]
+    has_data = ~np.isnan(pixel_depths)
+    positions, pixel_depths = positions[has_data], pixel_depths[has_data]
+    # Aggregate the pixels of every building at once
+    n_buildings = len(building_polygons)
+    pixel_counts = np.bincount(positions, minlength=n_buildings).astype(float)
+    depth_sums = np.bincount(positions, weights=pixel_depths, minlength=n_buildings)
+    flooded_counts = np.bincount(positions, weights=pixel_depths >= flood_depth_threshold, minlength=n_buildings)
+    max_depths = _max_by_building(pixel_depths, positions, n_buildings)
+
+    # Buildings with no pixels have NaN mean depth and a flooded fraction of 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_depths = depth_sums / pixel_counts
+        flooded_fractions = np.nan_to_num(flooded_counts / pixel_counts)
+    return pd.DataFrame({
+        "is_flooded": flooded_counts > 0,
+        "max_depth": max_depths,
+        "mean_depth": mean_depths,
+        "flooded_fraction": flooded_fractions,
+    }, index=building_polygons.index)
+
+
+def find_building_inundation_times(building_polygons: gpd.GeoDataFrame,
+                                   depth_raster: xarray.DataArray,
+                                   flood_depth_threshold: float) -> pd.DataFrame:
+    """
+    Finds when each building reaches its peak flood depth, and when it is first flooded.
+
+    Parameters
+    ----------
+    building_polygons : gpd.GeoDataFrame
+        A GeoDataFrame with each polygon representing a building outline
+    depth_raster : xarray.DataArray
+        Raster with dimensions time, y, and x, with each pixel representing the flood depth at the point and time.
+        May be lazily loaded, in which case the window around the buildings is read one time step at a time, so that
+        only one time step of the window is held in memory.
+    flood_depth_threshold : float
+        The minimum depth required to designate a pixel in the raster as flooded.
+
+    Returns
+    -------
+    pd.DataFrame
+        A pd.DataFrame with the same index as building_polygons, and attributes "peak_time" (the first time the
+        building reaches its maximum depth) and "first_inundation_time" (the first time any pixel is flooded).
+        Times are NaN for buildings that are outside the raster, or never flooded, respectively.
     """
-    # Create a joined GeoDataFrame with each building, and any flood polygons they intersect
-    building_status = gpd.sjoin(left_df=building_polygons, right_df=flood_polygons, how="left",
-                                predicate="intersects")
-    # Add is_flooded attribute to each building
-    building_status["is_flooded"] = ~building_status["index_right"].isnull()
-    # Remove extraneous information about what flood polygon is flooding the building and geometry information
-    # that is duplicated in nz_building_outlines table
-    building_status.drop(['index_right', 'geometry'], axis=1, inplace=True)
-    # Remove duplicates created when a building is flooded by multiple different flood polygons
-    filtered_buildings = building_status[~building_status.index.duplicated(keep='first')]
-    return filtered_buildings
+    result_columns = ["peak_time", "first_inundation_time"]
+    if building_polygons.empty:
+        return pd.DataFrame(columns=result_columns, index=building_polygons.index)
+    positions, rows, cols = _get_building_pixels(building_polygons, depth_raster)
+    # Find the maximum depth of each building at each time, with dimensions (time, building)
+    building_max_depths = np.full((depth_raster.sizes["time"], len(building_polygons)), np.nan)
+    if len(positions) > 0:
+        y_dim, x_dim = depth_raster.rio.y_dim, depth_raster.rio.x_dim
+        row_start, col_start = rows.min(), cols.min()
+        window = depth_raster.isel({
+            y_dim: slice(row_start, rows.max() + 1),
+            x_dim: slice(col_start, cols.max() + 1),
+        }).transpose("time", y_dim, x_dim)
+        window_rows, window_cols = rows - row_start, cols - col_start
+        for time_index in range(window.sizes["time"]):
+            # Read one time step of the window, keeping only the depths under buildings
+            pixel_depths = window.isel(time=time_index).values[window_rows, window_cols]
+            building_max_depths[time_index] = _max_by_building(pixel_depths, positions, len(building_polygons))
+
+    times = np.asarray(depth_raster["time"].values, dtype=float)
+    has_data = ~np.isnan(building_max_depths).all(axis=0)
+    peak_indexes = np.where(has_data, np.nan_to_num(building_max_depths, nan=-np.inf).argmax(axis=0), 0)
+    is_flooded = building_max_depths >= flood_depth_threshold
+    ever_flooded = is_flooded.any(axis=0)
+    return pd.DataFrame({
+        "peak_time": np.where(has_data, times[peak_indexes], np.nan),
+        "first_inundation_time": np.where(ever_flooded, times[is_flooded.argmax(axis=0)], np.nan),
+    }, index=building_polygons.index)
 
 
 def retrieve_building_outlines(engine: Engine, area_of_interest: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
@@ -134,34 +493,3 @@ def retrieve_building_outlines(engine: Engine, area_of_interest: gpd.GeoDataFram
     # Execute the query and retrieve the result as a GeoDataFrame
     gdf = gpd.GeoDataFrame.from_postgis(query, engine, index_col="building_outline_id", geom_col="geometry")
     return gdf
-
-
-def polygonize_flooded_area(flood_raster: xarray.DataArray, flood_depth_threshold: float) -> gpd.GeoDataFrame:
-    """
-    Takes a flood depth raster and applies depth thresholding on it so that only areas
-    flooded deeper than or equal to flood_depth_threshold are represented.
-    Returns the data in a collection of polygons
-
-    Parameters
-    ----------
-    flood_raster : xarray.DataArray
-        Raster with each pixel representing flood depth at the point
-    flood_depth_threshold : float
-        The minimum depth specified to consider a pixel in the raster flooded
-
-    Returns
-    -------
-    gpd.GeoDataFrame
-        A GeoDataFrame containing polygons of the flooded areas
-    """
-    # Find areas that are flooded to at least the flood_depth_threshold depth
-    mask = flood_raster >= flood_depth_threshold
-    # Turn the flood mask into a vector polygon form
-    flood_polygons = rio.features.shapes(flood_raster, mask=mask, transform=flood_raster.rio.transform())
-    polygons_records = []
-    # Add each polygon to a list in a form ready to be ingested into a GeoDataFrame to be returned
-    for polygon, _h in flood_polygons:
-        shapely_poly = shapely.Polygon(polygon['coordinates'][0])
-        new_row = {"geometry": shapely_poly}
-        polygons_records.append(new_row)
-    return gpd.GeoDataFrame(polygons_records, crs=flood_raster.rio.crs.wkt)
@@ -9,10 +9,12 @@ import newzealidar.process
 
 from src.digitaltwin import setup_environment, tables
 from src.digitaltwin.utils import LogLevel, setup_logging
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 
 
+@track_stage("ensure_lidar_datasets_initialised")
 def ensure_lidar_datasets_initialised() -> None:
     """
     Check if LiDAR datasets table is initialised.
@@ -44,6 +46,7 @@ def ensure_lidar_datasets_initialised() -> None:
         newzealidar.utils.map_dataset_name(engine, instructions_file_name)
 
 
+@track_stage("process_dem")
 def process_dem(selected_polygon_gdf: gpd.GeoDataFrame) -> None:
     """
     Ensures hydrologically-conditioned DEM is processed for the given area and added to the database.
@@ -75,6 +78,7 @@ def refresh_lidar_datasets() -> None:
     newzealidar.datasets.main()
 
 
+@track_stage("process_hydro_dem")
 def main(
         selected_polygon_gdf: gpd.GeoDataFrame,
         log_level: LogLevel = LogLevel.DEBUG) -> None:
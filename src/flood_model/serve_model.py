@@ -7,13 +7,17 @@ import logging
 import os
 import pathlib
 import shutil
+import xml.etree.ElementTree as ET
 from http import HTTPStatus
+from typing import Optional
 
 import rasterio as rio
 import requests
 import xarray as xr
 
 from src.config import get_env_variable
+from src.flood_model.cloud_optimised_output import write_raster_to_cog
+from src.pipeline_metrics import track_stage
 
 log = logging.getLogger(__name__)
 _xml_header = {"Content-type": "text/xml"}
@@ -22,6 +26,8 @@ _xml_header = {"Content-type": "text/xml"}
 def convert_nc_to_gtiff(nc_file_path: pathlib.Path) -> pathlib.Path:
     """
     Creates a GeoTiff file from a netCDF model output. The Tiff represents the max flood height in the model output.
+    The GeoTiff is cloud-optimised (tiled, with overviews), so GeoServer can serve zoomed out views without reading
+    the full resolution raster.
 
     Parameters
     ----------
@@ -39,9 +45,9 @@ def convert_nc_to_gtiff(nc_file_path: pathlib.Path) -> pathlib.Path:
     # Create temporary storage folder if it does not already exist
     temp_dir.mkdir(parents=True, exist_ok=True)
     gtiff_filepath = temp_dir / new_name
-    # Convert the max depths to geo tiff
+    # Convert the max depths to geo tiff. hmax is a running maximum, so the last time holds the max over the whole run
     with xr.open_dataset(nc_file_path, decode_coords="all") as ds:
-        ds['hmax_P0'][0].rio.to_raster(gtiff_filepath)
+        write_raster_to_cog(ds['hmax_P0'].isel(time=-1), gtiff_filepath)
     return pathlib.Path(os.getcwd()) / gtiff_filepath
 
 
@@ -228,20 +234,27 @@ def create_workspace_if_not_exists(workspace_name: str) -> None:
         raise requests.HTTPError(response.text, response=response)
 
 
+def _get_virtual_table_sql(feature_type_xml: str) -> Optional[str]:
+    """
+    Get the SQL of the virtual table of a GeoServer featureType, with whitespace normalised for comparison.
+
+    Parameters
+    ----------
+    feature_type_xml : str
+        The XML definition of the featureType.
+
+    Returns
+    -------
+    Optional[str]
+        The SQL of the virtual table, or None if the featureType is not a virtual table.
+    """
+    sql_element = ET.fromstring(feature_type_xml).find(".//virtualTable/sql")
+    if sql_element is None or sql_element.text is None:
+        return None
+    return " ".join(sql_element.text.split())
+
+
 def create_datastore_layer(workspace_name, data_store_name: str, layer_name, metadata_elem: str = "") -> None:
-    db_exists_response = requests.get(
-        f'{get_geoserver_url()}/workspaces/{workspace_name}/datastores/{data_store_name}/featuretypes.json',
-        auth=(get_env_variable("GEOSERVER_ADMIN_NAME"), get_env_variable("GEOSERVER_ADMIN_PASSWORD")),
-    )
-    response_data = db_exists_response.json()
-    # Parse JSON structure to get list of feature names
-    top_layer_node = response_data["featureTypes"]
-    # defaults to empty list if no layers exist
-    layers = top_layer_node["featureType"] if top_layer_node else []
-    layer_names = [layer["name"] for layer in layers]
-    if layer_name in layer_names:
-        # If the layer already exists, we don't have to add it again, and can instead return
-        return
     # Construct new layer request
     data = f"""
         <featureType>
@@ -270,9 +283,45 @@ def create_datastore_layer(workspace_name, data_store_name: str, layer_name, met
             {metadata_elem}
         </featureType>
         """
+    feature_types_url = f"{get_geoserver_url()}/workspaces/{workspace_name}/datastores/{data_store_name}/featuretypes"
+    db_exists_response = requests.get(
+        f'{feature_types_url}.json',
+        auth=(get_env_variable("GEOSERVER_ADMIN_NAME"), get_env_variable("GEOSERVER_ADMIN_PASSWORD")),
+    )
+    response_data = db_exists_response.json()
+    # Parse JSON structure to get list of feature names
+    top_layer_node = response_data["featureTypes"]
+    # defaults to empty list if no layers exist
+    layers = top_layer_node["featureType"] if top_layer_node else []
+    layer_names = [layer["name"] for layer in layers]
+    if layer_name in layer_names:
+        # If the layer already exists, we don't have to add it again, but virtual tables created by older versions
+        # may have outdated SQL, so update them
+        new_sql = _get_virtual_table_sql(data)
+        if new_sql is None:
+            return
+        existing_response = requests.get(
+            f"{feature_types_url}/{layer_name}.xml",
+            auth=(get_env_variable("GEOSERVER_ADMIN_NAME"), get_env_variable("GEOSERVER_ADMIN_PASSWORD")),
+        )
+        existing_response.raise_for_status()
+        if _get_virtual_table_sql(existing_response.text) == new_sql:
+            return
+        update_response = requests.put(
+            f"{feature_types_url}/{layer_name}",
+            params={"recalculate": "nativebbox,latlonbbox"},
+            headers=_xml_header,
+            data=data,
+            auth=(get_env_variable("GEOSERVER_ADMIN_NAME"), get_env_variable("GEOSERVER_ADMIN_PASSWORD")),
+        )
+        if not update_response.ok:
+            # Raise error manually so we can configure the text
+            raise requests.HTTPError(update_response.text, response=update_response)
+        log.info(f"Updated the SQL of datastore layer {workspace_name}:{layer_name}.")
+        return
 
     response = requests.post(
-        f"{get_geoserver_url()}/workspaces/{workspace_name}/datastores/{data_store_name}/featuretypes",
+        feature_types_url,
         params={"configure": "all"},
         headers=_xml_header,
         data=data,
@@ -289,7 +338,7 @@ def create_datastore_layer(workspace_name, data_store_name: str, layer_name, met
 def create_building_layers(workspace_name: str, data_store_name: str) -> None:
     """
     Creates dynamic geoserver layers "nz_building_outlines" and "building_flood_status" for the given workspace.
-    If they already exist then does nothing.
+    If they already exist then only updates the SQL of "building_flood_status" if it has changed.
     "building_flood_status" required viewparam=scenario:{model_id} to dynamically fetch correct flood statuses.
 
     Parameters
@@ -307,7 +356,8 @@ def create_building_layers(workspace_name: str, data_store_name: str) -> None:
     # Simple layer that is just displaying the nz_building_outlines database table
     create_datastore_layer(workspace_name, data_store_name, layer_name="nz_building_outlines")
 
-    # More complex layer that has to do dynamic sql queries against model output ID to fetch
+    # More complex layer that has to do dynamic sql queries against model output ID to fetch.
+    # Reads from the precomputed, spatially indexed partition of model_building_flood_status for the model output.
     flood_status_layer_name = "building_flood_status"
     flood_status_xml_query = rf"""
       <metadata>
@@ -316,14 +366,8 @@ def create_building_layers(workspace_name: str, data_store_name: str) -> None:
             <name>{flood_status_layer_name}</name>
             <sql>
                 SELECT * &#xd;
-                FROM nz_building_outlines&#xd;
-                LEFT OUTER JOIN (&#xd;
-                    SELECT *&#xd;
-                    FROM building_flood_status&#xd;
-                    WHERE flood_model_id=%scenario%&#xd;
-                ) AS flood_statuses&#xd;
-                USING (building_outline_id)&#xd;
-                WHERE building_outline_lifecycle ILIKE &apos;current&apos;
+                FROM model_building_flood_status&#xd;
+                WHERE flood_model_id=%scenario%
             </sql>
             <escapeSql>false</escapeSql>
             <geometry>
@@ -498,6 +542,7 @@ def create_viridis_style_if_not_exists() -> None:
     sld_response.raise_for_status()
 
 
+@track_stage("add_model_output_to_geoserver")
 def add_model_output_to_geoserver(model_output_path: pathlib.Path, model_id: int) -> None:
     """
     Adds the model output max depths to GeoServer, ready for serving.
@@ -0,0 +1,379 @@
+"""
+Measures where time and resources go in the modelling pipeline.
+Pipeline stages (the main function of each module) and their substeps are timed with `track_stage`, which also counts
+the database queries and external HTTP requests made while the stage runs, and records the peak memory use of the
+process and its child processes.
+Each Celery task stores the measurements of the stages it ran in the message broker (Redis), beside the task result,
+and adds them to running totals that are exported in the Prometheus text format.
+Measurements are kept per task in context variables, so that tasks running at the same time in different threads of a
+worker are measured separately.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import resource
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.worker_heartbeat import get_redis_client
+
+log = logging.getLogger(__name__)
+
+TASK_METRICS_KEY_PREFIX = "pipeline_metrics:task:"
+WORKFLOW_TASKS_KEY_PREFIX = "pipeline_metrics:workflow:"
+TOTALS_KEY = "pipeline_metrics:totals"
+# Time that the measurements of each task are kept for
+TASK_METRICS_TTL_SECONDS = 7 * 24 * 60 * 60
+# Prefix of the names of the exported Prometheus metrics
+PROMETHEUS_NAMESPACE = "digital_twin"
+
+# Running totals exported to Prometheus, with the attribute of StageMetrics each is summed from
+_PROMETHEUS_COUNTERS = {
+    "stage_runs_total": (None, "Number of completed runs of the pipeline stage."),
+    "stage_seconds_total": ("wall_seconds", "Wall time spent in the pipeline stage."),
+    "stage_db_queries_total": ("db_queries", "Database queries made by the pipeline stage."),
+    "stage_db_seconds_total": ("db_seconds", "Time spent waiting for database queries in the pipeline stage."),
+    "stage_http_requests_total": ("http_requests", "External HTTP requests made by the pipeline stage."),
+    "stage_http_bytes_total": ("http_bytes", "Bytes received from external HTTP requests by the pipeline stage."),
+    "stage_http_seconds_total": ("http_seconds", "Time spent waiting for external HTTP requests in the stage."),
+}
+
+
+class StageMetrics:
+    """
+    Measurements of a single run of a pipeline stage or substep.
+
+    Attributes
+    ----------
+    stage : str
+        The name of the stage, prefixed by the names of the stages it runs within, e.g. "main_rainfall/hyetograph".
+    wall_seconds : float
+        The wall time taken by the stage.
+    db_queries : int
+        The number of database queries made during the stage.
+    db_seconds : float
+        The time spent waiting for database queries during the stage.
+    http_requests : int
+        The number of external HTTP requests made during the stage.
+    http_bytes : int
+        The number of bytes received from external HTTP requests, as reported by their Content-Length.
+    http_seconds : float
+        The time spent waiting for external HTTP requests during the stage.
+    peak_rss_bytes : int
+        The peak resident memory of the process or any of its child processes, up to the end of the stage.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.wall_seconds = 0.0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.http_requests = 0
+        self.http_bytes = 0
+        self.http_seconds = 0.0
+        self.peak_rss_bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the measurements as a JSON serializable dictionary.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The measurements, keyed by attribute name.
+        """
+        return dict(vars(self))
+
+
+# Stages currently running in this context, outermost first, and stages completed since collection started.
+# Kept per context, so that each task is measured separately. Helper threads that run in a copy of the task's context
+# (see propagate_context) share the task's completed stages, and count their queries in the task's running stages.
+_active_stages: contextvars.ContextVar[Tuple[StageMetrics, ...]] = contextvars.ContextVar(
+    "active_stages", default=())
+_completed_stages: contextvars.ContextVar[Optional[List[StageMetrics]]] = contextvars.ContextVar(
+    "completed_stages", default=None)
+# Protects the measurements shared between a task's threads
+_stages_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def _add_to_active_stages(**increments: float) -> None:
+    """
+    Adds to the measurements of every stage running in the current context.
+
+    Parameters
+    ----------
+    **increments : float
+        The amount to add to each StageMetrics attribute, by attribute name.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    active_stages = _active_stages.get()
+    with _stages_lock:
+        for stage_metrics in active_stages:
+            for attribute, increment in increments.items():
+                setattr(stage_metrics, attribute, getattr(stage_metrics, attribute) + increment)
+
+
+def get_peak_rss_bytes() -> int:
+    """
+    Get the peak resident memory of this process or any of its finished child processes, e.g. BG-Flood.
+
+    Returns
+    -------
+    int
+        The peak resident memory in bytes.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+@contextlib.contextmanager
+def track_stage(name: str) -> Iterator[StageMetrics]:
+    """
+    Measures a pipeline stage or substep while the context is open. Can also be used as a function decorator.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage. Stages within other stages are recorded with the names of the outer stages as a prefix.
+
+    Yields
+    ------
+    StageMetrics
+        The measurements of the stage, complete once the context exits.
+    """
+    active_stages = _active_stages.get()
+    stage = name if not active_stages else f"{active_stages[-1].stage}/{name}"
+    stage_metrics = StageMetrics(stage)
+    active_stages_token = _active_stages.set(active_stages + (stage_metrics,))
+    start_time = time.perf_counter()
+    try:
+        yield stage_metrics
+    finally:
+        stage_metrics.wall_seconds = time.perf_counter() - start_time
+        stage_metrics.peak_rss_bytes = get_peak_rss_bytes()
+        _active_stages.reset(active_stages_token)
+        completed_stages = _completed_stages.get()
+        if completed_stages is not None:
+            with _stages_lock:
+                completed_stages.append(stage_metrics)
+        log.debug(f"Stage {stage} took {stage_metrics.wall_seconds:.2f}s with {stage_metrics.db_queries} queries "
+                  f"and {stage_metrics.http_requests} HTTP requests.")
+
+
+def start_collecting() -> None:
+    """
+    Starts collecting the stages completed in the current context, forgetting any stages collected before,
+    so that the stages of a new task can be collected.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    _active_stages.set(())
+    _completed_stages.set([])
+
+
+def collect_stages() -> List[Dict[str, Any]]:
+    """
+    Get the measurements of the stages completed in the current context since collection started,
+    in the order they finished.
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        The measurements of each completed stage.
+    """
+    completed_stages = _completed_stages.get() or []
+    with _stages_lock:
+        return [stage_metrics.to_dict() for stage_metrics in completed_stages]
+
+
+def propagate_context(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wraps a function to run in a copy of the current context, so that when it runs in a helper thread (e.g. of a
+    ThreadPoolExecutor) its stages and requests are measured as part of the stages running now.
+    Must be called in the thread that starts the helper threads. Coroutines run by asyncio already copy the context.
+
+    Parameters
+    ----------
+    function : Callable[..., T]
+        The function to run in helper threads.
+
+    Returns
+    -------
+    Callable[..., T]
+        The wrapped function, which can be called from several threads at once.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def run_in_context(*args, **kwargs) -> T:
+        # A context can only be entered by one thread at a time, so each call runs in its own copy
+        return context.copy().run(function, *args, **kwargs)
+
+    return run_in_context
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+    """Records the start time of a database query, to be measured when it finishes."""
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+    """Adds a finished database query to the measurements of the running stages."""
+    query_seconds = time.perf_counter() - conn.info["query_start_times"].pop()
+    _add_to_active_stages(db_queries=1, db_seconds=query_seconds)
+
+
+_original_http_adapter_send = HTTPAdapter.send
+
+
+def _instrumented_http_adapter_send(self, request, **kwargs) -> requests.Response:
+    """Sends a request with the 'requests' library, adding it to the measurements of the running stages."""
+    start_time = time.perf_counter()
+    response = _original_http_adapter_send(self, request, **kwargs)
+    _add_to_active_stages(http_requests=1, http_seconds=time.perf_counter() - start_time,
+                          http_bytes=int(response.headers.get("Content-Length", 0)))
+    return response
+
+
+def install_http_instrumentation() -> None:
+    """
+    Measures every request made with the 'requests' library, including by third party packages such as geoapis,
+    by wrapping the send method of the requests HTTPAdapter. Called once at startup by processes that run the pipeline,
+    such as Celery workers, since it changes the behaviour of 'requests' for the whole process.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    HTTPAdapter.send = _instrumented_http_adapter_send
+
+
+def get_aiohttp_trace_config() -> aiohttp.TraceConfig:
+    """
+    Get an aiohttp trace configuration that adds requests made by an aiohttp.ClientSession to the measurements of the
+    running stages.
+
+    Returns
+    -------
+    aiohttp.TraceConfig
+        The trace configuration, to be passed to the ClientSession's trace_configs.
+    """
+
+    async def on_request_start(_session, trace_config_ctx, _params) -> None:
+        trace_config_ctx.start_time = time.perf_counter()
+
+    async def on_request_end(_session, trace_config_ctx, params) -> None:
+        _add_to_active_stages(http_requests=1, http_seconds=time.perf_counter() - trace_config_ctx.start_time,
+                              http_bytes=params.response.content_length or 0)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def store_task_metrics(task_id: str, task_name: str, root_id: Optional[str]) -> None:
+    """
+    Stores the measurements of the stages run by a Celery task, and adds them to the running totals.
+
+    Parameters
+    ----------
+    task_id : str
+        The id of the task.
+    task_name : str
+        The name of the task.
+    root_id : Optional[str]
+        The id of the first task of the workflow the task belongs to, or None if the task is not part of a workflow.
+
+    Returns
+    -------
+    None
+        This function does not return any value.
+    """
+    stages = collect_stages()
+    root_id = root_id or task_id
+    redis_client = get_redis_client()
+    task_metrics = {"taskId": task_id, "taskName": task_name, "rootId": root_id, "stages": stages}
+    pipeline = redis_client.pipeline()
+    pipeline.set(f"{TASK_METRICS_KEY_PREFIX}{task_id}", json.dumps(task_metrics), ex=TASK_METRICS_TTL_SECONDS)
+    pipeline.rpush(f"{WORKFLOW_TASKS_KEY_PREFIX}{root_id}", task_id)
+    pipeline.expire(f"{WORKFLOW_TASKS_KEY_PREFIX}{root_id}", TASK_METRICS_TTL_SECONDS)
+    for stage_metrics in stages:
+        stage = stage_metrics["stage"]
+        for metric, (attribute, _description) in _PROMETHEUS_COUNTERS.items():
+            increment = 1 if attribute is None else stage_metrics[attribute]
+            pipeline.hincrbyfloat(TOTALS_KEY, f"{metric}|{stage}", increment)
+        pipeline.hset(TOTALS_KEY, f"stage_peak_rss_bytes|{stage}", stage_metrics["peak_rss_bytes"])
+    pipeline.execute()
+
+
+def get_workflow_metrics(task_id: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Get the measurements of every finished task in the workflow that a task belongs to.
+
+    Parameters
+    ----------
+    task_id : str
+        The id of any task in the workflow.
+
+    Returns
+    -------
+    Optional[List[Dict[str, Any]]]
+        The measurements of each finished task in the workflow, in the order they finished,
+        or None if there are no measurements for the task.
+    """
+    redis_client = get_redis_client()
+    task_metrics = redis_client.get(f"{TASK_METRICS_KEY_PREFIX}{task_id}")
+    if task_metrics is None:
+        return None
+    root_id = json.loads(task_metrics)["rootId"]
+    workflow_task_ids = [workflow_task_id.decode() for workflow_task_id in
+                         redis_client.lrange(f"{WORKFLOW_TASKS_KEY_PREFIX}{root_id}", 0, -1)]
+    workflow_metrics = redis_client.mget([f"{TASK_METRICS_KEY_PREFIX}{task_id}" for task_id in workflow_task_ids])
+    return [json.loads(metrics) for metrics in workflow_metrics if metrics is not None]
+
+
+def render_prometheus_metrics() -> str:
+    """
+    Render the running totals of the stage measurements of all tasks in the Prometheus text exposition format.
+
+    Returns
+    -------
+    str
+        The metrics, one sample per line.
+    """
+    totals = {field.decode(): float(value) for field, value in get_redis_client().hgetall(TOTALS_KEY).items()}
+    metric_descriptions = {metric: description for metric, (_attribute, description) in _PROMETHEUS_COUNTERS.items()}
+    metric_descriptions["stage_peak_rss_bytes"] = "Peak resident memory at the end of the latest run of the stage."
+    lines = []
+    for metric, description in metric_descriptions.items():
+        metric_type = "gauge" if metric == "stage_peak_rss_bytes" else "counter"
+        lines.append(f"# HELP {PROMETHEUS_NAMESPACE}_{metric} {description}")
+        lines.append(f"# TYPE {PROMETHEUS_NAMESPACE}_{metric} {metric_type}")
+        for field, value in sorted(totals.items()):
+            field_metric, stage = field.split("|", 1)
+            if field_metric == metric:
+                lines.append(f'{PROMETHEUS_NAMESPACE}_{metric}{{stage="{stage}"}} {value}')
+    return "\n".join(lines) + "\n"
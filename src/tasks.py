@@ -3,32 +3,135 @@ Runs backend tasks using Celery. Allowing for multiple long-running tasks to com
 Allows the frontend to send tasks and retrieve status later.
 """
 import logging
+import pathlib
 import traceback
-from typing import Dict, List, NamedTuple, Union
+from enum import StrEnum
+from typing import Dict, List, Union
 
 import geopandas as gpd
+import psutil
+import redis
 import shapely
-import xarray
-from celery import Celery, states, result
-from pyproj import Transformer
+from celery import Celery, group, states, result
+from celery.signals import task_postrun, task_prerun, worker_init, worker_ready
+from celery.utils import uuid
 
+from src import data_access, pipeline_metrics, worker_heartbeat
 from src.config import get_env_variable
+from src.data_access import DepthTimePlot
 from src.digitaltwin import retrieve_static_boundaries, setup_environment
 from src.digitaltwin.utils import setup_logging
-from src.dynamic_boundary_conditions.rainfall import main_rainfall
+from src.dynamic_boundary_conditions.rainfall import bootstrap_hirds_rainfall_data, main_rainfall
 from src.dynamic_boundary_conditions.river import main_river
 from src.dynamic_boundary_conditions.tide import main_tide_slr
-from src.flood_model import bg_flood_model, process_hydro_dem
+from src.flood_model import bg_flood_model, flood_model_cache, process_hydro_dem
 from src.run_all import DEFAULT_MODULES_TO_PARAMETERS
 
 # Setup celery backend task management
 message_broker_url = f"redis://{get_env_variable('MESSAGE_BROKER_HOST')}:6379/0"
 app = Celery("tasks", backend=message_broker_url, broker=message_broker_url)
+# Only reserve one task at a time per worker thread, so that quick tasks are not held behind long-running tasks
+app.conf.worker_prefetch_multiplier = 1
 
 setup_logging()
 log = logging.getLogger(__name__)
 
 
+@worker_init.connect
+def install_worker_instrumentation(**_kwargs) -> None:
+    """
+    Starts measuring the external HTTP requests made by pipeline stages, before the worker starts running tasks.
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    pipeline_metrics.install_http_instrumentation()
+
+
+@worker_ready.connect
+def start_worker_heartbeat(sender, **_kwargs) -> None:
+    """
+    Starts recording heartbeats once a worker is ready, so that the web application can check workers are alive.
+
+    Parameters
+    ----------
+    sender : celery.worker.consumer.Consumer
+        The consumer of the worker that is ready.
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    worker_heartbeat.start_heartbeat(sender.hostname)
+    # Take a first CPU use sample, so that later samples measure the CPU use since then without blocking
+    psutil.cpu_percent(interval=None)
+
+
+@task_prerun.connect
+def start_task_metrics(**_kwargs) -> None:
+    """
+    Starts collecting the measurements of the pipeline stages run by a task.
+    Task signals are sent in the thread that runs the task, so the measurements are collected in that task's context.
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    pipeline_metrics.start_collecting()
+
+
+@task_postrun.connect
+def store_task_metrics(task_id: str, task, **_kwargs) -> None:
+    """
+    Stores the measurements of the pipeline stages run by a finished task, so they can be retrieved with its result.
+
+    Parameters
+    ----------
+    task_id : str
+        The id of the finished task.
+    task : celery.Task
+        The finished task.
+
+    Returns
+    -------
+    None
+        This function does not return anything
+    """
+    try:
+        pipeline_metrics.store_task_metrics(task_id, task.name, task.request.root_id)
+    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+        log.warning(f"Could not store metrics for task {task_id}, message broker unavailable.")
+
+
+class TaskQueue(StrEnum):
+    """
+    Enum class representing the queues that tasks are routed to.
+    Each queue is consumed by its own worker, so that each kind of task has its own concurrency limit.
+
+    Attributes
+    ----------
+    INTERACTIVE : str
+        Quick tasks that a user is waiting on, such as point queries and parameter validation.
+    INGEST : str
+        Tasks that fetch data from external sources and store it in the database.
+    DEM : str
+        Processing of LiDAR data into hydrologically conditioned DEMs. CPU and memory intensive.
+    SIMULATION : str
+        Running the flood model. CPU/GPU and memory intensive, and can take hours.
+    """
+    INTERACTIVE = "interactive"
+    INGEST = "ingest"
+    DEM = "dem"
+    SIMULATION = "simulation"
+
+
+app.conf.task_default_queue = TaskQueue.INTERACTIVE
+
+
 class OnFailureStateTask(app.Task):
     """Task that switches state to FAILURE if an exception occurs"""
 
@@ -40,29 +143,47 @@ class OnFailureStateTask(app.Task):
         })
 
 
-class DepthTimePlot(NamedTuple):
+class ResourceAwareTask(OnFailureStateTask):
     """
-    Represents the depths over time for a particular pixel location in a raster.
-    Uses tuples and lists instead of Arrays or Dataframes because it needs to be easily serializable when communicating
-    over message_broker
-
-    Attributes
-    ----------
-    depths : List[float]
-        A list of all of the depths in m for the pixel. Parallels the times list
-    times : List[float]
-        A list of all of the times in s for the pixel. Parallels the depts list
+    Task that only starts when the worker has enough free memory and CPU, otherwise it is retried later.
+    Prevents heavy tasks from starting when they would compete for resources with other heavy tasks on the same host.
+    The thresholds are configured by the environment variables CELERY_MIN_AVAILABLE_MEMORY_GB and
+    CELERY_MAX_CPU_PERCENT. If resources do not become available within CELERY_ADMISSION_TIMEOUT_MINUTES, the task
+    fails instead of waiting forever, e.g. on a host with less memory than required.
     """
-    depths: List[float]
-    times: List[float]
+    admission_retry_seconds = 60
+
+    def __call__(self, *args, **kwargs):
+        min_available_memory_gb = get_env_variable("CELERY_MIN_AVAILABLE_MEMORY_GB", default=4.0, cast_to=float)
+        max_cpu_percent = get_env_variable("CELERY_MAX_CPU_PERCENT", default=90.0, cast_to=float)
+        admission_timeout_minutes = get_env_variable("CELERY_ADMISSION_TIMEOUT_MINUTES", default=60.0, cast_to=float)
+        available_memory_gb = psutil.virtual_memory().available / 1024 ** 3
+        # CPU use since the previous sample, so the worker thread is not blocked while measuring it
+        cpu_percent = psutil.cpu_percent(interval=None)
+        if available_memory_gb < min_available_memory_gb or cpu_percent > max_cpu_percent:
+            max_admission_retries = int(admission_timeout_minutes * 60 / self.admission_retry_seconds)
+            if self.request.retries >= max_admission_retries:
+                raise RuntimeError(
+                    f"{self.name} could not start within {admission_timeout_minutes} minutes: "
+                    f"{available_memory_gb:.1f}GB memory available and CPU at {cpu_percent}%. "
+                    f"Requires {min_available_memory_gb}GB available (CELERY_MIN_AVAILABLE_MEMORY_GB) and CPU at most "
+                    f"{max_cpu_percent}% (CELERY_MAX_CPU_PERCENT).")
+            log.info(f"Delaying {self.name}: {available_memory_gb:.1f}GB memory available and CPU at {cpu_percent}%. "
+                     f"Requires {min_available_memory_gb}GB available and CPU at most {max_cpu_percent}%.")
+            # Put the task back on the queue, until resources are available or the admission timeout is reached
+            raise self.retry(countdown=self.admission_retry_seconds, max_retries=max_admission_retries)
+        return super().__call__(*args, **kwargs)
 
 
 def create_model_for_area(
     selected_polygon_wkt: str,
     scenario_options: Dict[str, Union[str, float, int, bool]]
-) -> result.GroupResult:
+) -> result.AsyncResult:
     """
-    Creates a model for the area using series of chained (sequential) sub-tasks.
+    Creates a model for the area using series of chained sub-tasks.
+    Rainfall, tide and river model inputs are independent of each other, so they are generated in parallel once the
+    DEM is processed, and joined before running the flood model.
+    If a model has already been generated for the same area and scenario, the existing model is returned instead.
 
     Parameters
     ----------
@@ -73,20 +194,55 @@ def create_model_for_area(
 
     Returns
     -------
-    result.GroupResult
+    result.AsyncResult
         The task result for the long-running group of tasks. The task ID represents the final task in the group.
     """
+    # Check if there is an existing model output for the same inputs
+    selected_polygon = wkt_to_gdf(selected_polygon_wkt)
+    cache_key = flood_model_cache.get_model_cache_key(selected_polygon, scenario_options,
+                                                      DEFAULT_MODULES_TO_PARAMETERS)
+    engine = setup_environment.get_connection_from_profile()
+    cached_flood_model_id = flood_model_cache.get_cached_flood_model_id(engine, cache_key)
+    if cached_flood_model_id is not None:
+        log.info(f"Serving cached flood model output {cached_flood_model_id} for {cache_key}.")
+        return create_completed_result(cached_flood_model_id)
+
+    # Unique identifier for this model run, used to separate its model input files from any other model runs
+    run_id = uuid()
     return (
             add_base_data_to_db.si(selected_polygon_wkt) |
             process_dem.si(selected_polygon_wkt) |
-            generate_rainfall_inputs.si(selected_polygon_wkt) |
-            generate_tide_inputs.si(selected_polygon_wkt, scenario_options) |
-            generate_river_inputs.si(selected_polygon_wkt) |
-            run_flood_model.si(selected_polygon_wkt)
-    )()
+            group(
+                generate_rainfall_inputs.si(selected_polygon_wkt, run_id),
+                generate_tide_inputs.si(selected_polygon_wkt, scenario_options, run_id),
+                generate_river_inputs.si(selected_polygon_wkt, run_id),
+            ) |
+            run_flood_model.s(selected_polygon_wkt, run_id) |
+            store_flood_model_in_cache.s(cache_key)
+    ).on_error(remove_model_inputs.si(run_id))()
+
+
+def create_completed_result(flood_model_id: int) -> result.AsyncResult:
+    """
+    Creates a task result that has already succeeded with the given flood model id, without running any tasks.
+    Allows cached model outputs to be retrieved the same way as newly generated ones.
+
+    Parameters
+    ----------
+    flood_model_id : int
+        The database ID of the existing flood model output.
+
+    Returns
+    -------
+    result.AsyncResult
+        The completed task result, with the flood model id as its value.
+    """
+    task_id = uuid()
+    app.backend.store_result(task_id, flood_model_id, states.SUCCESS)
+    return result.AsyncResult(task_id, app=app)
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INGEST)
 def add_base_data_to_db(selected_polygon_wkt: str) -> None:
     """
     Task to ensure static base data for the given area is added to the database
@@ -106,7 +262,7 @@ def add_base_data_to_db(selected_polygon_wkt: str) -> None:
     retrieve_static_boundaries.main(selected_polygon, **parameters)
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=ResourceAwareTask, queue=TaskQueue.DEM)
 def process_dem(selected_polygon_wkt: str):
     """
     Task to ensure hydrologically-conditioned DEM is processed for the given area and added to the database.
@@ -126,8 +282,8 @@ def process_dem(selected_polygon_wkt: str):
     process_hydro_dem.main(selected_polygon, **parameters)
 
 
-@app.task(base=OnFailureStateTask)
-def generate_rainfall_inputs(selected_polygon_wkt: str):
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INGEST)
+def generate_rainfall_inputs(selected_polygon_wkt: str, run_id: str) -> str:
     """
     Task to ensure rainfall input data for the given area is added to the database and model input files are created.
 
@@ -135,19 +291,27 @@ def generate_rainfall_inputs(selected_polygon_wkt: str):
     ----------
     selected_polygon_wkt : str
         The polygon defining the selected area to add rainfall data for. Defined in WKT form.
+    run_id : str
+        The unique identifier of the model run, used to find the staging directory for the model input files.
 
     Returns
     -------
-    None
-        This task does not return anything
+    str
+        Serialized posix-style str version of the staging directory containing the rainfall model input files.
     """
     parameters = DEFAULT_MODULES_TO_PARAMETERS[main_rainfall]
     selected_polygon = wkt_to_gdf(selected_polygon_wkt)
-    main_rainfall.main(selected_polygon, **parameters)
+    staging_dir = bg_flood_model.get_model_inputs_staging_dir(run_id, "rainfall")
+    main_rainfall.main(selected_polygon, bg_flood_dir=staging_dir, **parameters)
+    return staging_dir.as_posix()
 
 
-@app.task(base=OnFailureStateTask)
-def generate_tide_inputs(selected_polygon_wkt: str, scenario_options: Dict[str, Union[str, float, int, bool]]):
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INGEST)
+def generate_tide_inputs(
+    selected_polygon_wkt: str,
+    scenario_options: Dict[str, Union[str, float, int, bool]],
+    run_id: str
+) -> str:
     """
     Task to ensure tide input data for the given area is added to the database and model input files are created.
 
@@ -157,24 +321,29 @@ def generate_tide_inputs(selected_polygon_wkt: str, scenario_options: Dict[str,
         The polygon defining the selected area to add tide data for. Defined in WKT form.
     scenario_options : Dict[str, Union[str, float, int, bool]]
         Options for scenario modelling inputs, coming from JSON body.
+    run_id : str
+        The unique identifier of the model run, used to find the staging directory for the model input files.
 
     Returns
     -------
-    None
-        This task does not return anything
+    str
+        Serialized posix-style str version of the staging directory containing the tide model input files.
     """
-    parameters = DEFAULT_MODULES_TO_PARAMETERS[main_tide_slr]
+    # Copy the default parameters so that scenario options are not shared between tasks
+    parameters = dict(DEFAULT_MODULES_TO_PARAMETERS[main_tide_slr])
     parameters["proj_year"] = scenario_options["projectedYear"]
     parameters["add_vlm"] = scenario_options["addVerticalLandMovement"]
     parameters["confidence_level"] = scenario_options["confidenceLevel"]
     parameters["ssp_scenario"] = scenario_options["sspScenario"]
     parameters["percentile"] = scenario_options["percentile"]
     selected_polygon = wkt_to_gdf(selected_polygon_wkt)
-    main_tide_slr.main(selected_polygon, **parameters)
+    staging_dir = bg_flood_model.get_model_inputs_staging_dir(run_id, "tide")
+    main_tide_slr.main(selected_polygon, bg_flood_dir=staging_dir, **parameters)
+    return staging_dir.as_posix()
 
 
-@app.task(base=OnFailureStateTask)
-def generate_river_inputs(selected_polygon_wkt: str):
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INGEST)
+def generate_river_inputs(selected_polygon_wkt: str, run_id: str) -> str:
     """
     Task to ensure river input data for the given area is added to the database and model input files are created.
 
@@ -182,26 +351,34 @@ def generate_river_inputs(selected_polygon_wkt: str):
     ----------
     selected_polygon_wkt : str
         The polygon defining the selected area to add river data for. Defined in WKT form.
+    run_id : str
+        The unique identifier of the model run, used to find the staging directory for the model input files.
 
     Returns
     -------
-    None
-        This task does not return anything
+    str
+        Serialized posix-style str version of the staging directory containing the river model input files.
     """
     parameters = DEFAULT_MODULES_TO_PARAMETERS[main_river]
     selected_polygon = wkt_to_gdf(selected_polygon_wkt)
-    main_river.main(selected_polygon, **parameters)
+    staging_dir = bg_flood_model.get_model_inputs_staging_dir(run_id, "river")
+    main_river.main(selected_polygon, bg_flood_dir=staging_dir, **parameters)
+    return staging_dir.as_posix()
 
 
-@app.task(base=OnFailureStateTask)
-def run_flood_model(selected_polygon_wkt: str) -> int:
+@app.task(base=ResourceAwareTask, queue=TaskQueue.SIMULATION)
+def run_flood_model(model_input_dirs: List[str], selected_polygon_wkt: str, run_id: str) -> int:
     """
     Task to run flood model using input data from previous tasks.
 
     Parameters
     ----------
+    model_input_dirs : List[str]
+        The staging directories containing the model input files, returned from the model input tasks.
     selected_polygon_wkt : str
         The polygon defining the selected area to run the flood model for. Defined in WKT form.
+    run_id : str
+        The unique identifier of the model run, used to clean up the staging directories once the model has run.
 
     Returns
     -------
@@ -210,15 +387,62 @@ def run_flood_model(selected_polygon_wkt: str) -> int:
     """
     parameters = DEFAULT_MODULES_TO_PARAMETERS[bg_flood_model]
     selected_polygon = wkt_to_gdf(selected_polygon_wkt)
-    flood_model_id = bg_flood_model.main(selected_polygon, **parameters)
+    model_input_paths = [pathlib.Path(model_input_dir) for model_input_dir in model_input_dirs]
+    try:
+        return bg_flood_model.main(selected_polygon, model_input_dirs=model_input_paths, **parameters)
+    finally:
+        # The model inputs are not reused, even if the model failed
+        bg_flood_model.remove_model_inputs_staging_dirs(run_id)
+
+
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
+def remove_model_inputs(run_id: str) -> None:
+    """
+    Task to remove the staging directories of the model inputs of a model run that failed.
+    Linked as the error callback of the model run, so that the inputs are removed when any of its tasks fails,
+    including the model input tasks before the flood model is run.
+
+    Parameters
+    ----------
+    run_id : str
+        The unique identifier of the model run.
+
+    Returns
+    -------
+    None
+        This task does not return anything
+    """
+    bg_flood_model.remove_model_inputs_staging_dirs(run_id)
+
+
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
+def store_flood_model_in_cache(flood_model_id: int, cache_key: str) -> int:
+    """
+    Task to store a newly generated flood model in the flood model cache, so that it can be reused.
+
+    Parameters
+    ----------
+    flood_model_id : int
+        The database ID of the flood model that has been run. Passed on from the run_flood_model task.
+    cache_key : str
+        The hash of the inputs used to generate the flood model.
+
+    Returns
+    -------
+    int
+        The database ID of the flood model that has been run.
+    """
+    engine = setup_environment.get_connection_from_profile()
+    flood_model_cache.store_flood_model_in_cache(engine, cache_key, flood_model_id)
     return flood_model_id
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INGEST)
 def refresh_lidar_datasets() -> None:
     """
     Web-scrapes OpenTopography metadata to create the datasets table containing links to LiDAR data sources.
-    Takes a long time to run but needs to be run periodically so that the datasets are up to date
+    Takes a long time to run but needs to be run periodically so that the datasets are up to date.
+    Clears the flood model cache so that new models are generated from the refreshed datasets.
 
     Returns
     -------
@@ -226,6 +450,38 @@ def refresh_lidar_datasets() -> None:
         This task does not return anything
     """
     process_hydro_dem.refresh_lidar_datasets()
+    clear_flood_model_cache()
+
+
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INGEST)
+def ingest_all_hirds_rainfall_data() -> None:
+    """
+    Stores the rainfall data of every HIRDS rainfall site in New Zealand in the database, so that requests for new
+    catchment areas do not have to wait for HIRDS. Takes a long time to run, and resumes where it stopped if it is
+    interrupted and run again.
+
+    Returns
+    -------
+    None
+        This task does not return anything
+    """
+    engine = setup_environment.get_connection_from_profile()
+    bootstrap_hirds_rainfall_data.ingest_all_hirds_rainfall_data(engine)
+
+
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
+def clear_flood_model_cache() -> None:
+    """
+    Task to clear the flood model cache.
+    Needs to be run when LiDAR datasets or static layers are refreshed, so that new models use the refreshed data.
+
+    Returns
+    -------
+    None
+        This task does not return anything
+    """
+    engine = setup_environment.get_connection_from_profile()
+    flood_model_cache.clear_flood_model_cache(engine)
 
 
 def wkt_to_gdf(wkt: str) -> gpd.GeoDataFrame:
@@ -253,7 +509,7 @@ def wkt_to_gdf(wkt: str) -> gpd.GeoDataFrame:
     return selected_as_rectangle_2193
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
 def get_model_output_filepath_from_model_id(model_id: int) -> str:
     """
     Task to query the database and find the filepath for the model output for the model_id.
@@ -268,11 +524,10 @@ def get_model_output_filepath_from_model_id(model_id: int) -> str:
     str
         Serialized posix-style str version of the filepath
     """
-    engine = setup_environment.get_connection_from_profile()
-    return bg_flood_model.model_output_from_db_by_id(engine, model_id).as_posix()
+    return data_access.get_model_output_filepath_from_model_id(model_id).as_posix()
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
 def get_depth_by_time_at_point(model_id: int, lat: float, lng: float) -> DepthTimePlot:
     """
     Task to query a point in a flood model output and return the list of depths and times.
@@ -292,19 +547,10 @@ def get_depth_by_time_at_point(model_id: int, lat: float, lng: float) -> DepthTi
     DepthTimePlot
         Tuple of depths list and times list for the pixel in the output nearest to the point.
     """
-    engine = setup_environment.get_connection_from_profile()
-    model_file_path = bg_flood_model.model_output_from_db_by_id(engine, model_id).as_posix()
-    with xarray.open_dataset(model_file_path) as ds:
-        transformer = Transformer.from_crs(4326, 2193)
-        y, x = transformer.transform(lat, lng)
-        da = ds["hmax_P0"].sel(xx_P0=x, yy_P0=y, method="nearest")
-
-    depths = da.values.tolist()
-    times = da.coords['time'].values.tolist()
-    return DepthTimePlot(depths, times)
+    return data_access.get_depth_by_time_at_point(model_id, lat, lng)
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
 def get_model_extents_bbox(model_id: int) -> str:
     """
     Task to find the bounding box of a given model output
@@ -319,15 +565,10 @@ def get_model_extents_bbox(model_id: int) -> str:
     str:
         The bounding box in 'x1,y1,x2,y2' format
     """
-    engine = setup_environment.get_connection_from_profile()
-    extents = bg_flood_model.model_extents_from_db_by_id(engine, model_id).geometry[0]
-    # Retrieve a tuple of the corners of the extents
-    bbox_corners = extents.bounds
-    # Convert the tuple into a string in x1,y1,x2,y2 form
-    return ",".join(map(str, bbox_corners))
+    return data_access.get_model_extents_bbox(model_id)
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
 def get_valid_parameters_based_on_confidence_level() -> Dict[str, Dict[str, Union[str, int]]]:
     """
     Task to get information on valid tide and sea-level-rise parameters based on the valid values in the database.
@@ -338,10 +579,10 @@ def get_valid_parameters_based_on_confidence_level() -> Dict[str, Dict[str, Unio
     Dict[str, Dict[str, Union[str, int]]]
         Dictionary with confidence_level as the key, and 2nd level dict with allowed values for dependent values.
     """
-    return main_tide_slr.get_valid_parameters_based_on_confidence_level()
+    return data_access.get_valid_parameters_based_on_confidence_level()
 
 
-@app.task(base=OnFailureStateTask)
+@app.task(base=OnFailureStateTask, queue=TaskQueue.INTERACTIVE)
 def validate_slr_parameters(
     scenario_options: Dict[str, Union[str, float, int, bool]]
 ) -> main_tide_slr.ValidationResult:
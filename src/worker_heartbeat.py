@@ -0,0 +1,182 @@
+"""
+Records the liveness of Celery workers in the message broker (Redis), so that the web application can check that
+workers are running without broadcasting a ping to every worker on each request.
+Each worker records the time of its latest heartbeat in a single sorted set, which is read with one query.
+Workers that stop sending heartbeats are removed from the set by the workers that are still running.
+"""
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+import redis
+
+from src.config import get_env_variable
+
+log = logging.getLogger(__name__)
+
+HEARTBEATS_KEY = "celery_worker_heartbeats"
+# Time between heartbeats written by each worker
+HEARTBEAT_INTERVAL_SECONDS = 5
+# Time before a worker that has stopped sending heartbeats is considered inactive
+HEARTBEAT_TTL_SECONDS = 3 * HEARTBEAT_INTERVAL_SECONDS
+# Minimum time between reads of the heartbeats by the web application
+HEARTBEAT_CHECK_INTERVAL_SECONDS = 1
+# Time limits for connecting to and waiting for replies from the message broker, so that a slow or hung broker does
+# not block request threads
+REDIS_CONNECT_TIMEOUT_SECONDS = 2
+REDIS_SOCKET_TIMEOUT_SECONDS = 5
+
+# The last read heartbeat age, and the time it was read. Used to limit the rate of reading heartbeats.
+_last_heartbeat_check: Tuple[float, Optional[float]] = (0.0, None)
+_last_heartbeat_check_lock = threading.Lock()
+# Held by the thread reading the heartbeats from the message broker, so that only one thread reads at a time
+_heartbeat_read_lock = threading.Lock()
+
+_redis_client: Optional[redis.Redis] = None
+_redis_client_lock = threading.Lock()
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    Get the client for the Redis message broker used by Celery, shared by all threads of the process.
+    The client keeps a pool of connections, and gives up on the broker after a short timeout.
+
+    Returns
+    -------
+    redis.Redis
+        Client connected to the message broker.
+    """
+    global _redis_client
+    with _redis_client_lock:
+        if _redis_client is None:
+            _redis_client = redis.Redis(host=get_env_variable("MESSAGE_BROKER_HOST"), port=6379, db=0,
+                                        socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SECONDS,
+                                        socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS)
+        return _redis_client
+
+
+def start_heartbeat(worker_name: str) -> threading.Thread:
+    """
+    Starts a background thread that periodically records that the worker is alive.
+
+    Parameters
+    ----------
+    worker_name : str
+        The name of the worker sending heartbeats, e.g. celery@hostname.
+
+    Returns
+    -------
+    threading.Thread
+        The daemon thread sending heartbeats. It stops when the worker process exits.
+    """
+    heartbeat_thread = threading.Thread(target=_send_heartbeats, args=(worker_name,), daemon=True,
+                                        name=f"heartbeat-{worker_name}")
+    heartbeat_thread.start()
+    log.info(f"Started heartbeat for worker {worker_name}")
+    return heartbeat_thread
+
+
+def _send_heartbeats(worker_name: str) -> None:
+    """
+    Records the current time as the worker's latest heartbeat, every HEARTBEAT_INTERVAL_SECONDS, forever.
+
+    Parameters
+    ----------
+    worker_name : str
+        The name of the worker sending heartbeats.
+
+    Returns
+    -------
+    None
+        This function does not return, it runs until the process exits.
+    """
+    redis_client = get_redis_client()
+    while True:
+        now = time.time()
+        try:
+            pipeline = redis_client.pipeline()
+            pipeline.zadd(HEARTBEATS_KEY, {worker_name: now})
+            # Forget workers that have stopped sending heartbeats
+            pipeline.zremrangebyscore(HEARTBEATS_KEY, "-inf", now - HEARTBEAT_TTL_SECONDS)
+            pipeline.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+            log.warning(f"Could not send heartbeat for worker {worker_name}, message broker unavailable.")
+        time.sleep(HEARTBEAT_INTERVAL_SECONDS)
+
+
+def read_latest_heartbeat_age() -> Optional[float]:
+    """
+    Reads the most recent heartbeat of any worker from the message broker, and finds its age.
+
+    Returns
+    -------
+    Optional[float]
+        The number of seconds since any worker last sent a heartbeat, or None if no workers are active.
+
+    Raises
+    ------
+    redis.exceptions.ConnectionError
+        If the message broker cannot be reached.
+    redis.exceptions.TimeoutError
+        If the message broker does not reply in time.
+    """
+    latest_heartbeat = get_redis_client().zrevrange(HEARTBEATS_KEY, 0, 0, withscores=True)
+    if not latest_heartbeat:
+        return None
+    heartbeat_age = max(time.time() - latest_heartbeat[0][1], 0.0)
+    return None if heartbeat_age > HEARTBEAT_TTL_SECONDS else heartbeat_age
+
+
+def _get_cached_heartbeat_age() -> Tuple[float, Optional[float]]:
+    """
+    Get the heartbeat age from the last read of the heartbeats, aged by the time since it was read.
+
+    Returns
+    -------
+    Tuple[float, Optional[float]]
+        The time the heartbeats were last read, or 0 if they have never been read, and the heartbeat age.
+    """
+    with _last_heartbeat_check_lock:
+        checked_at, heartbeat_age = _last_heartbeat_check
+    if heartbeat_age is not None:
+        heartbeat_age += time.time() - checked_at
+    return checked_at, heartbeat_age
+
+
+def get_latest_heartbeat_age() -> Optional[float]:
+    """
+    Finds the age of the most recent heartbeat from any worker.
+    Reads from the message broker at most once every HEARTBEAT_CHECK_INTERVAL_SECONDS, otherwise returns the age
+    from the last read. While one thread reads from the message broker, other threads use the age from the last read
+    rather than waiting, unless the heartbeats have never been read.
+
+    Returns
+    -------
+    Optional[float]
+        The number of seconds since any worker last sent a heartbeat, or None if no workers are active or the
+        message broker cannot be reached.
+    """
+    global _last_heartbeat_check
+    checked_at, heartbeat_age = _get_cached_heartbeat_age()
+    if time.time() - checked_at < HEARTBEAT_CHECK_INTERVAL_SECONDS:
+        return heartbeat_age
+    if not _heartbeat_read_lock.acquire(blocking=False):
+        # Another thread is reading the heartbeats
+        if checked_at > 0:
+            return heartbeat_age
+        # There is no previous read to fall back on, so wait for the first read, limited by the broker timeouts
+        with _heartbeat_read_lock:
+            return _get_cached_heartbeat_age()[1]
+    try:
+        checked_at = time.time()
+        try:
+            heartbeat_age = read_latest_heartbeat_age()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+            log.warning("Could not read worker heartbeats, message broker unavailable.")
+            heartbeat_age = None
+        with _last_heartbeat_check_lock:
+            _last_heartbeat_check = (checked_at, heartbeat_age)
+        return heartbeat_age
+    finally:
+        _heartbeat_read_lock.release()
@@ -0,0 +1,91 @@
+import contextlib
+import unittest
+from unittest import mock
+
+import numpy as np
+import shapely
+import xarray
+from pyproj import Transformer
+from shapely.ops import transform
+
+from src import data_access
+
+
+class GetModelBuildingsTileTest(unittest.TestCase):
+    """Tests for get_model_buildings_tile, with the database replaced by a mock."""
+
+    def setUp(self) -> None:
+        self.engine = mock.MagicMock()
+        self.engine.execute.return_value.scalar.return_value = b"tile"
+        patchers = [
+            mock.patch.object(data_access.setup_environment, "get_connection_from_profile", return_value=self.engine),
+            mock.patch.object(data_access, "_get_model_buildings_source",
+                              return_value=("model_building_flood_status_1", {})),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_tile_bounds_match_tile_envelope(self):
+        """The bounds of the whole world tile and of a tile at zoom 1 should match ST_TileEnvelope."""
+        half_width = data_access.WEB_MERCATOR_HALF_WIDTH
+        self.assertEqual(data_access._get_tile_bounds(0, 0, 0), (-half_width, -half_width, half_width, half_width))
+        self.assertEqual(data_access._get_tile_bounds(1, 1, 1), (0, -half_width, half_width, 0))
+
+    def test_tile_outside_nz_is_empty(self):
+        """A tile that does not overlap New Zealand should be empty, without querying the database."""
+        # The north-west quarter of the world at zoom 1
+        self.assertEqual(data_access.get_model_buildings_tile(1, 1, 0, 0), b"")
+        self.engine.execute.assert_not_called()
+
+    def test_tile_overlapping_nz_is_queried(self):
+        """A tile that overlaps New Zealand, even partly, should be queried from the database."""
+        # The south-east quarter of the world at zoom 1, and the tile over Wellington at zoom 12
+        for z, x, y in [(1, 1, 1), (12, 4036, 2564)]:
+            with self.subTest(z=z, x=x, y=y):
+                self.assertEqual(data_access.get_model_buildings_tile(1, z, x, y), b"tile")
+        self.assertEqual(self.engine.execute.call_count, 2)
+
+
+class GetDepthStatisticsInGeometryTest(unittest.TestCase):
+    """Tests get_depth_statistics_in_geometry on a model output one pixel wide, opened from memory."""
+
+    def setUp(self) -> None:
+        # A column of five 10m pixels, with y decreasing down the rows
+        xx = np.array([1748000.0])
+        yy = np.array([5428040.0, 5428030.0, 5428020.0, 5428010.0, 5428000.0])
+        depths = np.zeros((2, len(yy), len(xx)))
+        depths[1, 0, 0] = 0.5
+        depths[1, 4, 0] = 0.2
+        ds = xarray.Dataset(
+            {"hmax_P0": (("time", "yy_P0", "xx_P0"), depths)},
+            coords={"time": [0.0, 60.0], "yy_P0": yy, "xx_P0": xx},
+        )
+        patcher = mock.patch.object(data_access, "_open_model_output",
+                                    side_effect=lambda _model_id: contextlib.nullcontext(ds))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.nztm_to_wgs84 = Transformer.from_crs(2193, 4326, always_xy=True).transform
+
+    def test_pixel_size_of_single_pixel_axis(self):
+        """An axis one pixel long should use the pixel spacing of the other axis, and a single pixel has no size."""
+        self.assertEqual(data_access._get_pixel_size(np.array([0.0]), np.array([20.0, 10.0])), 10.0)
+        self.assertIsNone(data_access._get_pixel_size(np.array([0.0]), np.array([0.0])))
+
+    def test_line_along_single_pixel_column(self):
+        """A line along a model output one pixel wide should include every pixel it passes through."""
+        line = transform(self.nztm_to_wgs84, shapely.LineString([(1748002, 5427996), (1748002, 5428044)]))
+        statistics = data_access.get_depth_statistics_in_geometry(1, line)
+        self.assertListEqual(statistics.times, [0.0, 60.0])
+        self.assertListEqual(statistics.max_depths, [0.0, 0.5])
+        self.assertListEqual(statistics.flooded_fractions, [0.0, 0.4])
+
+    def test_line_outside_single_pixel_column(self):
+        """A line beyond the edge of a model output one pixel wide should have no statistics."""
+        line = transform(self.nztm_to_wgs84, shapely.LineString([(1748010, 5427996), (1748010, 5428044)]))
+        statistics = data_access.get_depth_statistics_in_geometry(1, line)
+        self.assertListEqual(statistics.max_depths, [None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+import geopandas as gpd
+import shapely
+
+from src.digitaltwin import data_to_db
+
+
+class CopyNewVectorDataToDbTest(unittest.TestCase):
+    """Loads a national layer with the database replaced by mocks."""
+
+    def setUp(self) -> None:
+        self.engine = mock.MagicMock()
+        self.connection = self.engine.raw_connection.return_value
+        self.cursor = self.connection.cursor.return_value.__enter__.return_value
+        self.executed_sql = []
+        self.cursor.execute.side_effect = self.execute
+        self.vector_data = gpd.GeoDataFrame(
+            {"id": [1, 2]},
+            geometry=[shapely.Point(1570000, 5193000), shapely.Point(1571000, 5194000)],
+            crs=2193,
+        )
+
+    def execute(self, sql: str, *_args) -> None:
+        """Records the SQL, failing like PostgreSQL if the spatial index created by geoalchemy2 is created again."""
+        if sql.startswith("CREATE INDEX idx_"):
+            raise RuntimeError("relation already exists")
+        self.executed_sql.append(sql)
+
+    def test_layer_swapped_in_with_spatial_index(self):
+        """The loaded table should replace the layer table, keeping the spatial index geoalchemy2 creates with it."""
+        with mock.patch.object(gpd.GeoDataFrame, "to_postgis") as to_postgis:
+            data_to_db.copy_new_vector_data_to_db(self.engine, self.vector_data, "nz_coastlines")
+        loading_table_name = to_postgis.call_args.args[0]
+        self.assertTrue(loading_table_name.startswith("nz_coastlines_loading_"))
+        self.cursor.copy_expert.assert_called_once()
+        self.connection.commit.assert_called_once()
+        self.connection.rollback.assert_not_called()
+        self.assertIn(f"ALTER TABLE {loading_table_name} RENAME TO nz_coastlines;", self.executed_sql)
+        self.assertIn(f"ALTER INDEX idx_{loading_table_name}_geometry RENAME TO idx_nz_coastlines_geometry;",
+                      self.executed_sql)
+
+    def test_failed_load_drops_loading_table(self):
+        """A failed COPY should leave neither the layer table nor the loading table."""
+        self.cursor.copy_expert.side_effect = RuntimeError("COPY failed")
+        with mock.patch.object(gpd.GeoDataFrame, "to_postgis") as to_postgis, self.assertRaises(RuntimeError):
+            data_to_db.copy_new_vector_data_to_db(self.engine, self.vector_data, "nz_coastlines")
+        loading_table_name = to_postgis.call_args.args[0]
+        self.connection.rollback.assert_called_once()
+        self.assertListEqual(self.executed_sql, [f"DROP TABLE IF EXISTS {loading_table_name};"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -32,6 +32,15 @@ class SetupEnvironmentTest(unittest.TestCase):
         self.assertFalse(connection.closed,
                          msg="The connection to the database failed and is needed for these tests.")
 
+    def test_engine_shared(self):
+        """Ensure that repeated connections with the same credentials share the same engine and connection pool"""
+        # Skip this if database tests are not intended to be run in this environment
+        if not self.run_database_integration_tests:
+            pytest.skip(self.DATABASE_SKIP_REASON)
+        engine = setup_environment.get_connection_from_profile()
+        self.assertIs(engine, setup_environment.get_connection_from_profile(),
+                      msg="get_connection_from_profile should return the same engine for the same credentials")
+
     def test_incorrect_password(self):
         """Ensure that when a bad password is given to the database, the connection fails and an exception is raised"""
         # Skip this if database tests are not intended to be run in this environment
@@ -0,0 +1,83 @@
+import io
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from src.digitaltwin import static_data_snapshot
+
+
+class StaticDataSnapshotRoundTripTest(unittest.TestCase):
+    """Exports tables to a snapshot and imports them again, with the database replaced by mocks."""
+
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.snapshot_dir = pathlib.Path(temp_dir.name)
+        self.engine = mock.MagicMock()
+        self.cursor = self.engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+        # Keep the CSV of each COPY, since the buffer is not kept by the mock
+        self.copied_csv = []
+        self.cursor.copy_expert.side_effect = lambda sql, csv_buffer: self.copied_csv.append(csv_buffer.getvalue())
+        self.plain_table = pd.DataFrame({
+            "site_id": ["A", "B", "C"],
+            "depth": [1.5, None, 3.25],
+        })
+        self.spatial_table = gpd.GeoDataFrame(
+            {"site_id": ["A", "B"]},
+            geometry=[shapely.Point(1570000, 5193000), shapely.box(1570000, 5193000, 1571000, 5194000)],
+            crs=2193,
+        )
+
+    def export_then_import(self, table_name: str, geometry_column=None) -> pd.DataFrame:
+        """Export table_name to the snapshot, import it into an existing table, and read back the loaded rows."""
+        with mock.patch.object(static_data_snapshot.pd, "read_sql", return_value=self.plain_table), \
+                mock.patch.object(static_data_snapshot.gpd, "read_postgis", return_value=self.spatial_table):
+            table_entry = static_data_snapshot.export_table(self.engine, table_name, geometry_column,
+                                                            self.snapshot_dir)
+        with mock.patch.object(static_data_snapshot, "check_table_exists", return_value=True):
+            imported_records = static_data_snapshot.import_table(self.engine, self.snapshot_dir, table_name,
+                                                                 table_entry, overwrite=True)
+        self.assertEqual(imported_records, table_entry["records"])
+        self.assertEqual(len(self.copied_csv), 1)
+        columns = list(self.plain_table.columns if geometry_column is None else self.spatial_table.columns)
+        return pd.read_csv(io.StringIO(self.copied_csv[0]), header=None, names=columns)
+
+    def test_plain_table_round_trip(self):
+        """The records of a table without geometries should be loaded unchanged, including NULL values."""
+        loaded_table = self.export_then_import("sea_level_rise")
+        pd.testing.assert_frame_equal(loaded_table, self.plain_table)
+
+    def test_spatial_table_round_trip(self):
+        """The geometries of a spatial table should be loaded unchanged, with the SRID of the table's CRS."""
+        loaded_table = self.export_then_import("rainfall_sites", geometry_column="geometry")
+        self.assertListEqual(loaded_table["site_id"].tolist(), self.spatial_table["site_id"].tolist())
+        geometries = shapely.from_wkb(loaded_table["geometry"].values)
+        self.assertListEqual(shapely.get_srid(geometries).tolist(), [2193, 2193])
+        self.assertTrue(all(shapely.equals(geometries, self.spatial_table.geometry.values)))
+
+    def test_existing_table_is_truncated_not_replaced(self):
+        """Overwriting an existing table should keep the table, its indexes and its dependent views."""
+        with mock.patch.object(pd.DataFrame, "to_sql") as to_sql:
+            self.export_then_import("sea_level_rise")
+        to_sql.assert_not_called()
+        executed_sql = [call.args[0] for call in self.cursor.execute.call_args_list]
+        self.assertIn('TRUNCATE "sea_level_rise";', executed_sql)
+        self.assertFalse(any("DROP" in sql for sql in executed_sql))
+
+    def test_changed_snapshot_file_rejected(self):
+        """Importing a snapshot file that does not match its checksum should fail before loading any data."""
+        with mock.patch.object(static_data_snapshot.pd, "read_sql", return_value=self.plain_table):
+            table_entry = static_data_snapshot.export_table(self.engine, "sea_level_rise", None, self.snapshot_dir)
+        self.plain_table.iloc[:1].to_parquet(self.snapshot_dir / table_entry["file"], index=False)
+        with self.assertRaises(ValueError):
+            static_data_snapshot.import_table(self.engine, self.snapshot_dir, "sea_level_rise", table_entry)
+        self.engine.raw_connection.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from src.dynamic_boundary_conditions.rainfall import bootstrap_hirds_rainfall_data
+
+
+class IngestAllHirdsRainfallDataTest(unittest.TestCase):
+    """Tests that only one ingest of the HIRDS rainfall data runs at a time, with the database replaced by a mock."""
+
+    def setUp(self) -> None:
+        self.engine = mock.MagicMock()
+        self.connection = self.engine.connect.return_value.__enter__.return_value
+        patchers = [
+            mock.patch.object(bootstrap_hirds_rainfall_data.rainfall_sites, "rainfall_sites_to_db"),
+            mock.patch.object(bootstrap_hirds_rainfall_data.hirds_rainfall_data_to_db, "all_sites_rainfall_data_to_db"),
+        ]
+        self.rainfall_sites_to_db, self.all_sites_rainfall_data_to_db = (patcher.start() for patcher in patchers)
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def executed_sql(self):
+        """The SQL executed on the connection, in order."""
+        return [str(call.args[0]) for call in self.connection.execute.call_args_list]
+
+    def test_ingest_holds_lock(self):
+        """An ingest should take the lock, ingest the depth then the intensity data, and release the lock."""
+        self.connection.execute.return_value.scalar.return_value = True
+        bootstrap_hirds_rainfall_data.ingest_all_hirds_rainfall_data(self.engine)
+        self.rainfall_sites_to_db.assert_called_once_with(self.engine)
+        self.assertListEqual([call.args[1] for call in self.all_sites_rainfall_data_to_db.call_args_list],
+                             [False, True])
+        executed_sql = self.executed_sql()
+        self.assertIn("pg_try_advisory_lock", executed_sql[0])
+        self.assertIn("pg_advisory_unlock", executed_sql[-1])
+
+    def test_lock_released_when_ingest_fails(self):
+        """The lock should be released when the ingest fails."""
+        self.connection.execute.return_value.scalar.return_value = True
+        self.all_sites_rainfall_data_to_db.side_effect = RuntimeError("HIRDS unavailable")
+        with self.assertRaises(RuntimeError):
+            bootstrap_hirds_rainfall_data.ingest_all_hirds_rainfall_data(self.engine)
+        self.assertIn("pg_advisory_unlock", self.executed_sql()[-1])
+
+    def test_concurrent_ingest_rejected(self):
+        """An ingest should fail without ingesting anything while another ingest holds the lock."""
+        self.connection.execute.return_value.scalar.return_value = False
+        self.assertTrue(bootstrap_hirds_rainfall_data.is_hirds_ingest_running(self.engine))
+        with self.assertRaises(bootstrap_hirds_rainfall_data.HirdsIngestRunningError):
+            bootstrap_hirds_rainfall_data.ingest_all_hirds_rainfall_data(self.engine)
+        self.rainfall_sites_to_db.assert_not_called()
+        self.assertFalse(any("pg_advisory_unlock" in sql for sql in self.executed_sql()))
+
+    def test_not_running_check_releases_lock(self):
+        """Checking whether an ingest is running should not keep the lock."""
+        self.connection.execute.return_value.scalar.return_value = True
+        self.assertFalse(bootstrap_hirds_rainfall_data.is_hirds_ingest_running(self.engine))
+        self.assertIn("pg_advisory_unlock", self.executed_sql()[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+
+from src.dynamic_boundary_conditions.rainfall import hirds_rainfall_data_from_db
+
+
+class HirdsRainfallDataFromDbTest(unittest.TestCase):
+    """Tests for hirds_rainfall_data_from_db.py, with the database query replaced by a mock."""
+
+    def setUp(self) -> None:
+        self.engine = MagicMock()
+        self.rain_data = pd.DataFrame({
+            "site_id": ["B", "B", "A", "A"],
+            "category": ["hist"] * 4,
+            "rcp": [None] * 4,
+            "time_period": [None] * 4,
+            "ari": [100.0, 2.0, 100.0, 2.0],
+            "aep": [0.01, 0.5, 0.01, 0.5],
+            "1h": [40.0, 15.0, 35.0, 12.0],
+            "2h": [55.0, 20.0, 50.0, 18.0],
+        })
+
+    def get_sites_rainfall_data(self, **kwargs) -> tuple:
+        """Run get_sites_rainfall_data, returning its result with the SQL and parameters of the query it made."""
+        arguments = dict(engine=self.engine, site_ids=["B", "A"], rcp=None, time_period=None, aris=[100, 2],
+                         duration="all", idf=False)
+        arguments.update(kwargs)
+        with patch.object(hirds_rainfall_data_from_db.pd, "read_sql_query", return_value=self.rain_data) as read_sql:
+            rain_data = hirds_rainfall_data_from_db.get_sites_rainfall_data(**arguments)
+        query = read_sql.call_args.args[0]
+        return rain_data, str(query), query.compile().params
+
+    def test_one_query_for_all_sites_and_aris(self):
+        """All sites and ARIs should be retrieved in a single query, with the values in the order requested."""
+        _, _, params = self.get_sites_rainfall_data()
+        self.assertListEqual(params["site_ids"], ["B", "A"])
+        self.assertListEqual(params["aris"], [100.0, 2.0])
+
+    def test_ordered_by_requested_site_then_ari(self):
+        """The rows should be ordered by site in the order requested, then by ARI in the order requested."""
+        _, sql, _ = self.get_sites_rainfall_data()
+        order_by = sql.split("ORDER BY", 1)[1]
+        self.assertLess(order_by.index(":site_ids"), order_by.index(":aris"))
+        self.assertIn("array_position", order_by)
+
+    def test_historical_scenario_filter(self):
+        """Historical data should be filtered by NULL rcp and time_period."""
+        _, sql, params = self.get_sites_rainfall_data()
+        self.assertIn("rcp IS NULL AND time_period IS NULL", sql)
+        self.assertNotIn("rcp", params)
+
+    def test_future_scenario_filter(self):
+        """Future scenarios should be filtered by the requested rcp and time_period."""
+        _, sql, params = self.get_sites_rainfall_data(rcp=4.5, time_period="2031-2050")
+        self.assertIn("rcp=:rcp AND time_period=:time_period", sql)
+        self.assertEqual(params["rcp"], 4.5)
+        self.assertEqual(params["time_period"], "2031-2050")
+
+    def test_inconsistent_scenario_rejected(self):
+        """An rcp without a time_period should be rejected before querying the database."""
+        with self.assertRaises(ValueError):
+            self.get_sites_rainfall_data(rcp=4.5)
+
+    def test_duration_filter(self):
+        """Only the requested duration column should be kept, with the identifying columns."""
+        rain_data, _, _ = self.get_sites_rainfall_data(duration="1h")
+        self.assertListEqual(list(rain_data.columns),
+                             ["site_id", "category", "rcp", "time_period", "ari", "aep", "1h"])
+
+    @patch.object(hirds_rainfall_data_from_db, "get_sites_rainfall_data")
+    @patch.object(hirds_rainfall_data_from_db.hirds_rainfall_data_to_db, "get_site_ids_in_catchment",
+                  return_value=["B", "A"])
+    def test_rainfall_data_from_db_ari_types(self, _mock_site_ids, mock_get_sites_rainfall_data):
+        """A single ARI, a list of ARIs, and a NumPy array of ARIs should all be queried as a list of floats."""
+        for ari, expected_aris in [(100, [100.0]), ([100, 2], [100.0, 2.0]), (np.array([100, 2]), [100.0, 2.0])]:
+            hirds_rainfall_data_from_db.rainfall_data_from_db(self.engine, MagicMock(), None, None, ari)
+            aris = mock_get_sites_rainfall_data.call_args.args[4]
+            self.assertListEqual(aris, expected_aris)
+
+
+if __name__ == "__main__":
+    unittest.main()
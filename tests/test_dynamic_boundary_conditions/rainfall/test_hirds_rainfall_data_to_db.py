@@ -0,0 +1,43 @@
+import unittest
+from unittest import mock
+
+from src.dynamic_boundary_conditions.rainfall import hirds_rainfall_data_to_db
+
+
+class AddEachSiteRainfallDataTest(unittest.TestCase):
+    """Tests for add_each_site_rainfall_data, with HIRDS and the database replaced by mocks."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Get the rainfall depth data fetched from HIRDS for site 323605."""
+        data_dir = "tests/test_dynamic_boundary_conditions/rainfall/data"
+        with open(f"{data_dir}/rainfall_depth.txt") as in_file:
+            cls.rainfall_depth = in_file.read()
+
+    def setUp(self) -> None:
+        self.engine = mock.MagicMock()
+        patcher = mock.patch.object(hirds_rainfall_data_to_db, "copy_rainfall_data_to_db", return_value=0)
+        self.copy_rainfall_data_to_db = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_sites(self, sites_data):
+        """Add the rainfall depth data of the given sites, as fetched from HIRDS."""
+        with mock.patch.object(hirds_rainfall_data_to_db.rainfall_data_from_hirds, "get_data_from_hirds_for_sites",
+                               return_value=sites_data):
+            hirds_rainfall_data_to_db.add_each_site_rainfall_data(self.engine, list(sites_data), idf=False)
+
+    def test_sites_without_data_skipped(self):
+        """Sites whose response has no blocks of data should be skipped, storing the data of the other sites."""
+        self.add_sites({"323605": self.rainfall_depth, "empty_site": "No data for this site."})
+        self.copy_rainfall_data_to_db.assert_called_once()
+        rain_data = self.copy_rainfall_data_to_db.call_args.args[1]
+        self.assertListEqual(rain_data["site_id"].unique().tolist(), ["323605"])
+
+    def test_nothing_stored_without_data(self):
+        """Nothing should be stored when no site has any data."""
+        self.add_sites({"empty_site": ""})
+        self.copy_rainfall_data_to_db.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
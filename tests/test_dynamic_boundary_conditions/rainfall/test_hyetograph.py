@@ -275,6 +275,27 @@ class HyetographTest(unittest.TestCase):
                 # check the number of returned rows
                 self.assertEqual(len(mock_storm_length_data.return_value) * 2, len(hyetograph_depth))
 
+    @patch("src.dynamic_boundary_conditions.rainfall.hyetograph.get_storm_length_increment_data")
+    def test_transform_data_for_selected_method_matches_expected_data(self, mock_storm_length_data):
+        """Test to ensure the hyetograph depths of all sites match the expected data for both methods."""
+        mock_storm_length_data.return_value = self.storm_length_data
+        combined_list = [(self.hyetograph_depth_alt_block, self.hyeto_method_alt_block),
+                         (self.hyetograph_depth_chicago, self.hyeto_method_chicago)]
+        for expected_hyetograph_depth, hyeto_method in combined_list:
+            hyetograph_depth = hyetograph.transform_data_for_selected_method(
+                interp_increment_data=pd.DataFrame(),
+                storm_length_mins=self.storm_length_mins,
+                time_to_peak_mins=self.time_to_peak_mins,
+                increment_mins=self.increment_mins,
+                hyeto_method=hyeto_method)
+            pd.testing.assert_frame_equal(expected_hyetograph_depth, hyetograph_depth, check_dtype=False)
+
+    def test_get_alt_block_order_alternates_around_peak(self):
+        """Test to ensure ranked depths are placed alternately after and before the peak, in time order."""
+        steps_from_peak, rank_at_step = hyetograph.get_alt_block_order(5)
+        self.assertEqual([0, 1, -1, 2, -2], steps_from_peak.tolist())
+        self.assertEqual([4, 2, 0, 1, 3], rank_at_step.tolist())
+
     def test_hyetograph_depth_to_intensity_correct_conversion(self):
         """Test to ensure hyetograph data have been correctly converted from 'depths' to 'intensities'."""
         combined_list = [(self.hyetograph_depth_alt_block, self.hyeto_method_alt_block),
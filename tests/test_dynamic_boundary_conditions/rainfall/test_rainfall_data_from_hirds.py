@@ -1,9 +1,14 @@
+import asyncio
 import unittest
 import pathlib
 from typing import List, Optional
+from unittest import mock
 import math
 
+import aiohttp
 import pandas as pd
+from aiohttp import web
+from aiohttp import test_utils
 
 from src.dynamic_boundary_conditions.rainfall import rainfall_data_from_hirds
 
@@ -168,6 +173,83 @@ class RainfallDataFromHirdsTest(unittest.TestCase):
         self.assertGreater(len(depth_data), 0)
         self.assertGreater(len(intensity_data), 0)
 
+    def test_get_data_from_hirds_for_sites_matches_single_site(self):
+        """Test that rainfall data fetched concurrently matches the data fetched for a single site."""
+        sites_data = rainfall_data_from_hirds.get_data_from_hirds_for_sites([self.example_site_id], idf=False)
+        single_site_data = rainfall_data_from_hirds.get_data_from_hirds(self.example_site_id, idf=False)
+        self.assertEqual([self.example_site_id], list(sites_data))
+        self.assertEqual(single_site_data, sites_data[self.example_site_id])
+
+    def test_get_retry_delay_within_doubling_limit(self):
+        """Test that the delay before each retry is within a limit that doubles with each attempt."""
+        for attempt in range(5):
+            delay = rainfall_data_from_hirds.get_retry_delay(attempt, base_delay=1.0)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, 2 ** attempt)
+
+
+class RequestHirdsWithRetryTest(unittest.IsolatedAsyncioTestCase):
+    """Tests for request_hirds_with_retry, against a local server answering with the given response statuses."""
+
+    async def asyncSetUp(self) -> None:
+        # The statuses to answer the next requests with, answering 200 once they are used up
+        self.statuses: List[int] = []
+        self.request_count = 0
+
+        async def handle(_request: web.Request) -> web.Response:
+            status = self.statuses[self.request_count] if self.request_count < len(self.statuses) else 200
+            self.request_count += 1
+            return web.Response(status=status, text=f"status {status}")
+
+        application = web.Application()
+        application.router.add_get("/hirds", handle)
+        self.server = test_utils.TestServer(application)
+        await self.server.start_server()
+        self.session = aiohttp.ClientSession()
+        patchers = [
+            mock.patch.object(rainfall_data_from_hirds, "HIRDS_MAX_RETRIES", 2),
+            # Retry without waiting
+            mock.patch.object(rainfall_data_from_hirds, "get_retry_delay", return_value=0),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self) -> None:
+        await self.session.close()
+        await self.server.close()
+
+    async def request(self) -> str:
+        """Send a request to the local server, returning the response body."""
+        return await rainfall_data_from_hirds.request_hirds_with_retry(
+            self.session, asyncio.Semaphore(1), "GET", str(self.server.make_url("/hirds")))
+
+    async def test_temporary_failures_retried(self):
+        """Requests that fail with 429 or 5xx should be retried until they succeed."""
+        for status in (429, 500, 502, 503, 504):
+            with self.subTest(status=status):
+                self.statuses, self.request_count = [status, status], 0
+                self.assertEqual(await self.request(), "status 200")
+                self.assertEqual(self.request_count, 3)
+
+    async def test_client_errors_not_retried(self):
+        """Requests that fail with other 4xx statuses should raise immediately, without retrying."""
+        for status in (400, 404):
+            with self.subTest(status=status):
+                self.statuses, self.request_count = [status], 0
+                with self.assertRaises(aiohttp.ClientResponseError) as context:
+                    await self.request()
+                self.assertEqual(context.exception.status, status)
+                self.assertEqual(self.request_count, 1)
+
+    async def test_gives_up_after_max_retries(self):
+        """Requests that keep failing should raise the last error after HIRDS_MAX_RETRIES retries."""
+        self.statuses = [503] * 10
+        with self.assertRaises(aiohttp.ClientResponseError) as context:
+            await self.request()
+        self.assertEqual(context.exception.status, 503)
+        self.assertEqual(self.request_count, 3)
+
 
 if __name__ == "__main__":
     unittest.main()
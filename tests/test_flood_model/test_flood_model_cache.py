@@ -0,0 +1,58 @@
+import unittest
+
+import geopandas as gpd
+import shapely
+
+from src.digitaltwin.utils import LogLevel
+from src.flood_model import flood_model_cache
+from src.run_all import DEFAULT_MODULES_TO_PARAMETERS
+
+
+class GetModelCacheKeyTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.polygon = gpd.GeoDataFrame(index=[0], crs="epsg:2193",
+                                        geometry=[shapely.box(1570000, 5193000, 1571000, 5194000)])
+        self.scenario_options = {
+            "projectedYear": 2050,
+            "sspScenario": "SSP1-2.6",
+            "confidenceLevel": "low",
+            "addVerticalLandMovement": True,
+            "percentile": 50,
+        }
+
+    def test_same_inputs_same_key(self):
+        key_1 = flood_model_cache.get_model_cache_key(self.polygon, self.scenario_options,
+                                                      DEFAULT_MODULES_TO_PARAMETERS)
+        # Re-order the scenario options, which should not change the key
+        reordered_options = dict(reversed(list(self.scenario_options.items())))
+        key_2 = flood_model_cache.get_model_cache_key(self.polygon, reordered_options, DEFAULT_MODULES_TO_PARAMETERS)
+        self.assertEqual(key_1, key_2)
+
+    def test_equivalent_polygon_in_other_crs_same_key(self):
+        key_1 = flood_model_cache.get_model_cache_key(self.polygon, self.scenario_options,
+                                                      DEFAULT_MODULES_TO_PARAMETERS)
+        # Round-tripping through WGS84 only introduces floating point noise
+        round_tripped_polygon = self.polygon.to_crs(4326)
+        key_2 = flood_model_cache.get_model_cache_key(round_tripped_polygon, self.scenario_options,
+                                                      DEFAULT_MODULES_TO_PARAMETERS)
+        self.assertEqual(key_1, key_2)
+
+    def test_different_scenario_different_key(self):
+        key_1 = flood_model_cache.get_model_cache_key(self.polygon, self.scenario_options,
+                                                      DEFAULT_MODULES_TO_PARAMETERS)
+        other_options = {**self.scenario_options, "projectedYear": 2100}
+        key_2 = flood_model_cache.get_model_cache_key(self.polygon, other_options, DEFAULT_MODULES_TO_PARAMETERS)
+        self.assertNotEqual(key_1, key_2)
+
+    def test_log_level_does_not_change_key(self):
+        key_1 = flood_model_cache.get_model_cache_key(self.polygon, self.scenario_options,
+                                                      DEFAULT_MODULES_TO_PARAMETERS)
+        debug_parameters = {module: {**parameters, "log_level": LogLevel.DEBUG}
+                            for module, parameters in DEFAULT_MODULES_TO_PARAMETERS.items()}
+        key_2 = flood_model_cache.get_model_cache_key(self.polygon, self.scenario_options, debug_parameters)
+        self.assertEqual(key_1, key_2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,27 +1,71 @@
 import unittest
 
 import numpy as np
+import rioxarray  # noqa: F401 Registers the rio accessor used to set the raster CRS
+import shapely
+import xarray
 from geopandas import GeoDataFrame
 
-from src.flood_model.flooded_buildings import categorise_buildings_as_flooded
+from src.flood_model.flooded_buildings import (
+    classify_buildings_by_depth,
+    find_building_inundation_times
+)
 
 
-class CategoriseBuildingsAsFloodedTest(unittest.TestCase):
+class ClassifyBuildingsByDepthTest(unittest.TestCase):
 
     def setUp(self) -> None:
-        data_dir = "tests/test_flood_model/data"
-        self.flood_polygons = GeoDataFrame.from_file(f"{data_dir}/flood_polygon_test.geojson")
-        self.building_polygons = GeoDataFrame.from_file(f"{data_dir}/flood_building_test.geojson")
-
-    def test_correct_flooded_buildings(self):
-        """
-        Tests a series of cases of non-flooded and flooded buildings.
-        Check the labels in self.building_polygons to see the details of each case
-        """
-        flooded_gdf = categorise_buildings_as_flooded(self.building_polygons, self.flood_polygons)
-
-        correct_flood_categories = np.array([False, True, True, True, True]) # To understand the values of this array, check the labels in the file supplied by self.building_polygons
-        self.assertTrue((flooded_gdf["is_flooded"].values == correct_flood_categories).all())
+        # 10m x 10m raster of 1m pixels, with y decreasing down the rows
+        depths = np.zeros((10, 10))
+        # Pixels x: 6-8, y: 6-8 are flooded, with one deeper pixel
+        depths[2:4, 6:8] = 0.5
+        depths[2, 6] = 1.0
+        # Pixel x: 4-5, y: 3-4 is flooded, but pixel x: 4-5, y: 2-3 is not
+        depths[6, 4] = 0.2
+        self.max_depth_raster = xarray.DataArray(
+            depths, dims=("y", "x"), coords={"y": np.arange(9.5, 0, -1), "x": np.arange(0.5, 10)}
+        ).rio.write_crs(2193)
+        self.buildings = GeoDataFrame(
+            index=[101, 102, 103],
+            geometry=[
+                shapely.box(1.2, 1.2, 2.8, 2.8),  # Not flooded
+                shapely.box(6.2, 6.2, 7.8, 7.8),  # Fully flooded
+                shapely.box(4.2, 2.2, 4.8, 3.8),  # Half flooded
+            ],
+            crs=2193,
+        )
+
+    def test_depth_statistics(self):
+        """Tests the flood status and depths of buildings that are not flooded, fully flooded, and half flooded."""
+        building_depths = classify_buildings_by_depth(self.buildings, self.max_depth_raster, 0.1)
+
+        np.testing.assert_array_equal(building_depths["is_flooded"].values, [False, True, True])
+        np.testing.assert_allclose(building_depths["max_depth"].values, [0, 1.0, 0.2])
+        np.testing.assert_allclose(building_depths["mean_depth"].values, [0, 0.625, 0.1])
+        np.testing.assert_allclose(building_depths["flooded_fraction"].values, [0, 1, 0.5])
+
+    def test_index_preserved(self):
+        """The building outline ids of the buildings should be kept as the index."""
+        building_depths = classify_buildings_by_depth(self.buildings, self.max_depth_raster, 0.1)
+        self.assertListEqual(building_depths.index.tolist(), [101, 102, 103])
+
+    def test_inundation_times(self):
+        """Tests when each building reaches its peak depth and when it is first flooded."""
+        # The fully flooded building floods at 100s, and the half flooded building floods at 200s
+        depths_over_time = np.stack([
+            np.zeros((10, 10)),
+            np.where(self.max_depth_raster.values >= 0.5, self.max_depth_raster.values, 0),
+            self.max_depth_raster.values,
+        ])
+        depth_raster = xarray.DataArray(
+            depths_over_time,
+            dims=("time", "y", "x"),
+            coords={"time": [0.0, 100.0, 200.0], "y": self.max_depth_raster.y, "x": self.max_depth_raster.x},
+        ).rio.write_crs(2193)
+        building_times = find_building_inundation_times(self.buildings, depth_raster, 0.1)
+
+        np.testing.assert_array_equal(building_times["peak_time"].values, [0, 100, 200])
+        np.testing.assert_array_equal(building_times["first_inundation_time"].values, [np.nan, 100, 200])
 
 
 if __name__ == "__main__":